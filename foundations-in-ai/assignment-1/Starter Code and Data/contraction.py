@@ -0,0 +1,310 @@
+import heapq
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from mapUtil import CityMap, CompactCityMap
+from util import SearchAlgorithm, SearchMetrics, SearchProblem
+
+########################################################################################
+# Contraction Hierarchies (CH)
+#   > Preprocessing :: locations are "contracted" (removed from the map) one at a time,
+#                      from least to most important. Removing location `v` might destroy
+#                      a shortest path `u -> v -> w`; in that case, we add a "shortcut"
+#                      connection `u -> w` (remembering `v` so that we can expand it
+#                      again later). The position of a location in this ordering is its
+#                      "rank".
+#
+#   > Query :: every shortest path can be found by a bidirectional search that only
+#              follows connections towards *higher* ranked locations, from the start
+#              (forward) and from the end locations (backward). This "upward" search
+#              space is tiny compared to a full Dijkstra search.
+#
+#   > Reference: Geisberger et al., "Contraction Hierarchies: Faster and Simpler
+#                Hierarchical Routing in Road Networks" (2008).
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy over a (static) `CityMap`; build once, then answer shortest
+    path queries with `query(startLocation, endTag)`.
+
+    Usage:
+        hierarchy = ContractionHierarchy(cityMap)
+        path, cost = hierarchy.query(startLocation, endTag)
+    """
+    def __init__(self, cityMap: CityMap, witnessLimit: int = 64, verbose: int = 0):
+        """
+        :param cityMap: Map to preprocess; all connections must be symmetric (which
+                        `CityMap.addConnection` guarantees).
+        :param witnessLimit: Maximum number of locations settled by each "witness"
+                             search (used to decide whether a shortcut is necessary).
+                             Smaller values speed up preprocessing but add more
+                             (unnecessary) shortcuts.
+        """
+        self.graph: CompactCityMap = cityMap.compact()
+        self.witnessLimit = witnessLimit
+        self.verbose = verbose
+
+        # Filled in by `_contract`
+        self.ranks = array("i", [0] * self.graph.numLocations)
+        self.middles: Dict[Tuple[int, int], int] = {}  # (u, w) -> v for shortcut u-v-w
+        self.upOffsets, self.upTargets, self.upWeights = array("q"), array("i"), array("d")
+        self.numShortcuts = 0
+        self._contract()
+
+    ####################################################################################
+    # Preprocessing
+
+    def _contract(self) -> None:
+        graph, numLocations = self.graph, self.graph.numLocations
+
+        # Remaining (uncontracted) graph, as location id -> neighbor id -> distance. When
+        # there are parallel connections, we only need to keep the shortest one.
+        remaining: List[Dict[int, float]] = [{} for _ in range(numLocations)]
+        for location in range(numLocations):
+            for neighbor, distance in graph.neighbors(location):
+                if neighbor != location and distance < remaining[location].get(neighbor, float("inf")):
+                    remaining[location][neighbor] = distance
+
+        # Location id -> (higher ranked neighbor id, distance) for the query graph
+        upwardEdges: List[List[Tuple[int, float]]] = [[] for _ in range(numLocations)]
+        contractedNeighbors, levels = [0] * numLocations, [0] * numLocations
+
+        # Order locations by importance, using lazy updates; when a location is popped,
+        # recompute its importance, and contract it only if it's still the minimum.
+        def importance(location: int) -> int:
+            numShortcuts = len(self._findShortcuts(location, remaining))
+            edgeDifference = numShortcuts - len(remaining[location])
+            return 2 * edgeDifference + contractedNeighbors[location] + levels[location]
+
+        queue = [(importance(location), location) for location in range(numLocations)]
+        heapq.heapify(queue)
+        rank = 0
+        while queue:
+            _, location = heapq.heappop(queue)
+            newImportance = importance(location)
+            if queue and newImportance > queue[0][0]:
+                heapq.heappush(queue, (newImportance, location))
+                continue
+
+            # Contract `location` :: add shortcuts between its remaining neighbors, then
+            # remove it from the remaining graph.
+            for (source, target), distance in self._findShortcuts(location, remaining).items():
+                if distance < remaining[source].get(target, float("inf")):
+                    remaining[source][target] = remaining[target][source] = distance
+                    self.middles[(source, target)] = self.middles[(target, source)] = location
+                    self.numShortcuts += 1
+
+            for neighbor, distance in remaining[location].items():
+                upwardEdges[location].append((neighbor, distance))
+                del remaining[neighbor][location]
+                contractedNeighbors[neighbor] += 1
+                levels[neighbor] = max(levels[neighbor], levels[location] + 1)
+            remaining[location] = {}
+
+            self.ranks[location] = rank
+            rank += 1
+            if self.verbose >= 1 and rank % 10000 == 0:
+                print(f"Contracted {rank} / {numLocations} locations")
+
+        # Pack the upward graph into CSR arrays (same layout as `CompactCityMap`)
+        self.upOffsets.append(0)
+        for location in range(numLocations):
+            for neighbor, distance in upwardEdges[location]:
+                self.upTargets.append(neighbor)
+                self.upWeights.append(distance)
+            self.upOffsets.append(len(self.upTargets))
+
+        if self.verbose >= 1:
+            print(f"Added {self.numShortcuts} shortcuts for {numLocations} locations")
+
+    def _findShortcuts(
+        self, location: int, remaining: List[Dict[int, float]]
+    ) -> Dict[Tuple[int, int], float]:
+        """
+        Return the shortcuts (source, target) -> distance needed to contract `location`,
+        i.e., pairs of neighbors whose shortest connection (ignoring `location`) is
+        longer than going through `location`, as determined by a bounded "witness"
+        Dijkstra search from each neighbor.
+        """
+        shortcuts = {}
+        neighbors = list(remaining[location].items())
+        for i, (source, sourceDistance) in enumerate(neighbors):
+            others = neighbors[i + 1:]
+            if len(others) == 0:
+                continue
+            maxDistance = sourceDistance + max(distance for _, distance in others)
+
+            # Witness search from `source`, skipping `location`
+            costs, frontier, numSettled = {source: 0.0}, [(0.0, source)], 0
+            settled = set()
+            while frontier and numSettled < self.witnessLimit:
+                pastCost, current = heapq.heappop(frontier)
+                if current in settled:
+                    continue
+                if pastCost > maxDistance:
+                    break
+                settled.add(current)
+                numSettled += 1
+                for nextLocation, distance in remaining[current].items():
+                    newCost = pastCost + distance
+                    if nextLocation != location and newCost < costs.get(nextLocation, float("inf")):
+                        costs[nextLocation] = newCost
+                        heapq.heappush(frontier, (newCost, nextLocation))
+
+            for target, targetDistance in others:
+                viaDistance = sourceDistance + targetDistance
+                if costs.get(target, float("inf")) > viaDistance:
+                    shortcuts[(source, target)] = viaDistance
+        return shortcuts
+
+    ####################################################################################
+    # Queries
+
+    def query(
+        self, startLocation: str, endTag: str
+    ) -> Tuple[Optional[List[str]], Optional[float]]:
+        """
+        Return (path, cost) for the shortest path from `startLocation` to any location
+        with `endTag`, where `path` is the list of location labels starting with
+        `startLocation` (i.e., `[startLocation] + actions` from `UniformCostSearch` on
+        the matching `ShortestPathProblem`); returns (None, None) if there's no path.
+        """
+        path, cost, _, _ = self._search(self.graph.index(startLocation), endTag)
+        return path, cost
+
+    def _search(self, start: int, endTag: str, metrics: Optional[SearchMetrics] = None):
+        """
+        Returns (path, cost, number of locations settled, forward costs); also fills in
+        the frontier counters of `metrics`, if given.
+        """
+        upOffsets, upTargets, upWeights = self.upOffsets, self.upTargets, self.upWeights
+        inf = float("inf")
+
+        # Index 0 :: forward search, index 1 :: backward search. The upward searches
+        # only visit a few hundred locations, so we use dictionaries rather than
+        # per-location lists (which would cost O(#locations) to allocate on each query).
+        costs: Tuple[Dict[int, float], Dict[int, float]] = ({start: 0.0}, {})
+        parents: Tuple[Dict[int, int], Dict[int, int]] = ({start: -1}, {})
+        frontiers = ([(0.0, start)], [])
+        for end in map(self.graph.index, self.graph.locationsWithTag(endTag)):
+            costs[1][end], parents[1][end] = 0.0, -1
+            frontiers[1].append((0.0, end))
+
+        settled = (set(), set())
+        bestCost, meeting = inf, -1
+        numPushes, numStalePops = len(frontiers[0]) + len(frontiers[1]), 0
+        maxFrontierSize = numPushes
+        while (frontiers[0] and frontiers[0][0][0] < bestCost) or (
+            frontiers[1] and frontiers[1][0][0] < bestCost
+        ):
+            # Alternate between sides, skipping any side that can't improve `bestCost`
+            side = 0 if len(settled[0]) <= len(settled[1]) else 1
+            if not frontiers[side] or frontiers[side][0][0] >= bestCost:
+                side = 1 - side
+
+            pastCost, location = heapq.heappop(frontiers[side])
+            if location in settled[side]:
+                numStalePops += 1
+                continue
+            settled[side].add(location)
+
+            otherCost = costs[1 - side].get(location)
+            if otherCost is not None and pastCost + otherCost < bestCost:
+                bestCost, meeting = pastCost + otherCost, location
+
+            # "Stall-on-demand" :: if a higher ranked neighbor offers a cheaper way to
+            # reach `location` (via a downward connection, which this search never
+            # follows), `location` can't be on a shortest path, so don't expand it.
+            sideCosts, sideParents = costs[side], parents[side]
+            edges = range(upOffsets[location], upOffsets[location + 1])
+            if any(sideCosts.get(upTargets[edge], inf) + upWeights[edge] < pastCost for edge in edges):
+                continue
+
+            for edge in edges:
+                nextLocation = upTargets[edge]
+                newCost = pastCost + upWeights[edge]
+                if newCost < sideCosts.get(nextLocation, inf):
+                    sideCosts[nextLocation] = newCost
+                    sideParents[nextLocation] = location
+                    heapq.heappush(frontiers[side], (newCost, nextLocation))
+                    numPushes += 1
+            frontierSize = len(frontiers[0]) + len(frontiers[1])
+            if frontierSize > maxFrontierSize:
+                maxFrontierSize = frontierSize
+
+        numSettled = len(settled[0]) + len(settled[1])
+        if metrics is not None:
+            metrics.numPushes, metrics.numStalePops = numPushes, numStalePops
+            metrics.maxFrontierSize = maxFrontierSize
+        if meeting == -1:
+            return None, None, numSettled, costs[0]
+
+        # Upward path start -> meeting, then meeting -> end (both may use shortcuts)
+        upwardPath = [meeting]
+        while parents[0][upwardPath[-1]] != -1:
+            upwardPath.append(parents[0][upwardPath[-1]])
+        upwardPath.reverse()
+        while parents[1][upwardPath[-1]] != -1:
+            upwardPath.append(parents[1][upwardPath[-1]])
+
+        labels = self.graph.labels
+        path = [labels[start]]
+        for source, target in zip(upwardPath, upwardPath[1:]):
+            path.extend(labels[location] for location in self._unpack(source, target))
+        return path, bestCost, numSettled, costs[0]
+
+    def _unpack(self, source: int, target: int) -> List[int]:
+        """Expand the (possible shortcut) connection source -> target, excluding `source`."""
+        path, stack = [], [(source, target)]
+        while stack:
+            source, target = stack.pop()
+            middle = self.middles.get((source, target))
+            if middle is None:
+                path.append(target)
+            else:
+                # Expand source -> middle first (so push it last)
+                stack.append((middle, target))
+                stack.append((source, middle))
+        return path
+
+
+class ContractionHierarchySearch(SearchAlgorithm):
+    def __init__(self, hierarchy: ContractionHierarchy, verbose: int = 0):
+        """
+        A `SearchAlgorithm` that answers `ShortestPathProblem` queries with a prebuilt
+        `ContractionHierarchy` (which must be built over `problem.cityMap`).
+        """
+        super().__init__()
+        self.hierarchy = hierarchy
+        self.verbose = verbose
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Sets the same instance variables as `UniformCostSearch`, except that
+        `self.pastCosts` maps locations visited by the (upward) forward search to costs
+        in the hierarchy, which may include shortcuts.
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.metrics = SearchMetrics()
+        startTime = time.perf_counter()
+
+        hierarchy = self.hierarchy
+        start = hierarchy.graph.index(problem.startLocation)
+        path, cost, self.numStatesExplored, forwardCosts = hierarchy._search(
+            start, problem.endTag, self.metrics
+        )
+        labels = hierarchy.graph.labels
+        self.pastCosts = {labels[location]: cost for location, cost in forwardCosts.items()}
+        if path is not None:
+            self.actions, self.pathCost = path[1:], cost
+        if self.verbose >= 1:
+            print(f"numStatesExplored = {self.numStatesExplored}")
+            print(f"pathCost = {self.pathCost}")
+            print(f"actions = {self.actions}")
+
+        self.metrics.numStatesExplored = self.numStatesExplored
+        self.metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
@@ -1,21 +1,37 @@
 #!/usr/bin/python3
 
+import asyncio
+import gc
 import json
-from typing import List, Optional, Type
+import os
+import tempfile
+import weakref
+from typing import Callable, Dict, List, Optional, Tuple, Type
 from math import radians
 
+import contraction
 import graderUtil
+import routeServer
+import routing
 import util
 from mapUtil import (
+    addLandmarks,
     CityMap,
     checkValid,
+    computeDistance,
     createGridMap,
     createGridMapWithCustomTags,
     createSanJoseMap,
+    GeoLocation,
     getTotalCost,
+    loadCompiledMap,
     locationFromTag,
     makeGridLabel,
-    makeTag, RADIUS_EARTH
+    makeTag, RADIUS_EARTH,
+    readMap,
+    readRoutableMap,
+    saveCompiledMap,
+    TravelTimeProfiles,
 )
 
 grader = graderUtil.Grader()
@@ -335,6 +351,40 @@ grader.add_hidden_part(
     description="shortest path with 4 waypoints and multiple end locations",
 )
 
+def t_2a_bitmask():
+    """
+    Check the integer bitmask `memory` of WaypointsShortestPathProblem states: the
+    tags at the start location are visited in the start state, and each successor adds
+    the tags at its location (waypoint tag `i`, in sorted order, is bit `1 << i`).
+    """
+    cityMap = createGridMapWithCustomTags(2, 2, {(0,0): ["fuel", "food"], (0,1): ["books"], (1,0): [], (1,1): ["food"]})
+    problem = submission.WaypointsShortestPathProblem(
+        makeGridLabel(0, 0), ["fuel", "food", "books"], makeTag("label", makeGridLabel(0, 1)), cityMap
+    )
+    startState = problem.startState()
+    grader.require_is_equal(0b110, startState.memory)
+    grader.require_is_true(not problem.isEnd(startState))
+
+    successors = {action: newState for action, newState, _ in problem.successorsAndCosts(startState)}
+    grader.require_is_equal(0b111, successors[makeGridLabel(0, 1)].memory)
+    grader.require_is_equal(0b110, successors[makeGridLabel(1, 0)].memory)
+    grader.require_is_true(problem.isEnd(successors[makeGridLabel(0, 1)]))
+
+    # A start location covering every waypoint (and with the end tag) is already an end
+    problem = submission.WaypointsShortestPathProblem(
+        makeGridLabel(0, 0), ["food", "fuel"], makeTag("label", makeGridLabel(0, 0)), cityMap
+    )
+    grader.require_is_true(problem.isEnd(problem.startState()))
+
+
+grader.add_basic_part(
+    "2a-bitmask-basic",
+    t_2a_bitmask,
+    max_points=0,
+    max_seconds=1,
+    description="waypoint bitmask memory, with the start location covering waypoints",
+)
+
 # Problem 2a (continued): full San Jose map...
 grader.add_basic_part(
     "2a-6-basic",
@@ -597,5 +647,1298 @@ grader.add_hidden_part(
     description="hidden straight line heuristic unit test",
 )
 
+
+
+def t_3b_waypoints_heuristic(
+    cityMap: CityMap, startLocation: str, waypointTags: List[str], endTag: str, step: int
+):
+    """
+    Check that `WaypointsHeuristic` is consistent, i.e., h(s) <= cost + h(s') for every
+    connection s -> s' (from every `step`-th location, with every waypoint bitmask),
+    and that A* with it finds a path of the same cost as UCS. Needs a map with real
+    distances (on grid maps, straight-line distances exceed the unit connection costs).
+    """
+    problem = submission.WaypointsShortestPathProblem(startLocation, waypointTags, endTag, cityMap)
+    heuristic = submission.WaypointsHeuristic(waypointTags, endTag, cityMap)
+    for location in sorted(cityMap.geoLocations)[::step]:
+        for memory in range(problem.allWaypoints + 1):
+            state = util.State(location, memory)
+            stateCost = heuristic.evaluate(state)
+            if problem.isEnd(state):
+                grader.require_is_equal(0.0, stateCost)
+            for _, newState, cost in problem.successorsAndCosts(state):
+                if stateCost > cost + heuristic.evaluate(newState) + 1e-6:
+                    grader.fail(f"Inconsistent heuristic from {state} to {newState}")
+                    return
+
+    ucs = util.UniformCostSearch(verbose=0)
+    ucs.solve(problem)
+    reduced = util.UniformCostSearch(verbose=0)
+    reduced.solve(submission.aStarReduction(problem, heuristic))
+    path = extractPath(startLocation, reduced)
+    grader.require_is_true(checkValid(path, cityMap, startLocation, endTag, waypointTags))
+    grader.require_is_true(abs(ucs.pathCost - getTotalCost(path, cityMap)) < 1e-6)
+    grader.require_is_true(reduced.numStatesExplored <= ucs.numStatesExplored)
+
+
+grader.add_basic_part(
+    "3b-waypoints-heuristic-1-basic",
+    lambda: t_3b_waypoints_heuristic(
+        cityMap=sanJoseMap,
+        startLocation=locationFromTag(makeTag("landmark", "city_hall"), sanJoseMap),
+        waypointTags=[
+            makeTag("landmark", "northeastern_building"),
+            makeTag("landmark", "dac_phunk"),
+            makeTag("landmark", "seven_eleven"),
+        ],
+        endTag=makeTag("landmark", "bus_station"),
+        step=5,
+    ),
+    max_points=0,
+    max_seconds=10,
+    description="waypoint heuristic consistency on the San Jose map",
+)
+
+########################################################################################
+# Map storage: `CompactCityMap` (and compiled maps) against the source `CityMap`
+
+
+def requireSameMap(cityMap: CityMap, otherMap: CityMap):
+    """Check that `otherMap` has the same locations, tags, and connections as `cityMap`."""
+    grader.require_is_equal(len(cityMap.geoLocations), len(otherMap.geoLocations))
+    grader.require_is_true(all(
+        otherMap.geoLocations[label] == geo
+        and dict(otherMap.distances[label].items()) == dict(cityMap.distances.get(label, {}))
+        and all(otherMap.distances[label][neighbor] == distance
+                for neighbor, distance in cityMap.distances.get(label, {}).items())
+        and list(otherMap.tags[label]) == list(cityMap.tags[label])
+        for label, geo in cityMap.geoLocations.items()
+    ))
+    allTags = {tag for tags in cityMap.tags.values() for tag in tags}
+    grader.require_is_true(all(
+        list(otherMap.locationsWithTag(tag)) == list(cityMap.locationsWithTag(tag))
+        and all(otherMap.hasTag(label, tag) for label in cityMap.locationsWithTag(tag))
+        for tag in allTags
+    ))
+    grader.require_is_true(all(
+        list(otherMap.locationsWithTagKey(key)) == list(cityMap.locationsWithTagKey(key))
+        for key in {tag.split("=", 1)[0] for tag in allTags}
+    ))
+
+
+def t_compact(cityMap: CityMap):
+    """Check `cityMap.compact()` against `cityMap`, and that it can't be changed."""
+    compactMap = cityMap.compact()
+    requireSameMap(cityMap, compactMap)
+    label = next(iter(cityMap.geoLocations))
+    try:
+        compactMap.addTag(label, "amenity=food")
+        grader.fail("Expected addTag on a CompactCityMap to raise a TypeError")
+    except TypeError:
+        pass
+    grader.require_is_true(not cityMap.hasTag(label, "amenity=food"))
+
+
+grader.add_basic_part(
+    "map-compact-1-basic",
+    lambda: t_compact(
+        createGridMapWithCustomTags(2, 2, {(0,0): [], (0,1): ["food", "fuel"], (1,0): ["food"], (1,1): ["amenity=park"]})
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="compact map on small grid with custom tags",
+)
+
+grader.add_basic_part(
+    "map-compact-2-basic",
+    lambda: t_compact(sanJoseMap),
+    max_points=0,
+    max_seconds=10,
+    description="compact San Jose map",
+)
+
+
+def t_compiled_map(cityMap: CityMap, startLocation: str, endTag: str):
+    """
+    Round-trip `cityMap` through `saveCompiledMap`/`loadCompiledMap`, and check that UCS
+    finds a path of the same cost on both maps.
+    """
+    with tempfile.TemporaryDirectory() as cacheDir:
+        path = os.path.join(cacheDir, "map.cmap")
+        saveCompiledMap(cityMap, path, key="test")
+        loadedMap, key = loadCompiledMap(path)
+        grader.require_is_equal("test", key)
+        requireSameMap(cityMap, loadedMap)
+        costs = []
+        for someMap in [cityMap, loadedMap]:
+            ucs = util.UniformCostSearch(verbose=0)
+            ucs.solve(submission.ShortestPathProblem(startLocation, endTag, someMap))
+            costs.append(ucs.pathCost)
+        grader.require_is_equal(costs[0], costs[1])
+
+
+grader.add_basic_part(
+    "map-compiled-1-basic",
+    lambda: t_compiled_map(
+        createGridMapWithCustomTags(2, 2, {(0,0): [], (0,1): ["food", "fuel"], (1,0): ["food"], (1,1): ["amenity=park"]}),
+        startLocation=makeGridLabel(0, 0),
+        endTag="fuel",
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="compiled map round trip on small grid with custom tags",
+)
+
+grader.add_basic_part(
+    "map-compiled-2-basic",
+    lambda: t_compiled_map(
+        sanJoseMap,
+        startLocation=locationFromTag(makeTag("landmark", "philz"), sanJoseMap),
+        endTag=makeTag("landmark", "northeastern_building"),
+    ),
+    max_points=0,
+    max_seconds=10,
+    description="compiled San Jose map round trip",
+)
+
+
+def t_routable_map(osmPath: str, landmarks: List[Dict[str, str]]):
+    """
+    Check `readRoutableMap` against `readMap` (plus `addLandmarks`) on a small `.osm`
+    file: the same map without `simplifyChains`, and the same shortest path costs
+    between the remaining locations (with symmetric connections) with it.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        landmarkPath = os.path.join(directory, "landmarks.json")
+        with open(landmarkPath, "w") as f:
+            json.dump(landmarks, f)
+        cityMap = readMap(osmPath)
+        addLandmarks(cityMap, landmarkPath)
+        routableMap = readRoutableMap(osmPath, landmarkPath=landmarkPath)
+        simplifiedMap = readRoutableMap(osmPath, simplifyChains=True, landmarkPath=landmarkPath)
+
+    requireSameMap(cityMap, routableMap)
+    grader.require_is_true(simplifiedMap.numLocations < routableMap.numLocations)
+    for landmark in landmarks:
+        tag = makeTag("landmark", landmark["landmark"])
+        grader.require_is_equal(cityMap.locationsWithTag(tag), simplifiedMap.locationsWithTag(tag))
+    grader.require_is_true(
+        all(
+            simplifiedMap.distances[target][source] == distance
+            for source in simplifiedMap.labels
+            for target, distance in simplifiedMap.distances[source].items()
+        )
+    )
+    for start in simplifiedMap.labels:
+        costs, simplifiedCosts = allPastCosts(cityMap, start), allPastCosts(simplifiedMap, start)
+        grader.require_is_true(
+            all(abs(costs[label] - cost) < 1e-6 for label, cost in simplifiedCosts.items())
+        )
+        grader.require_is_equal(
+            sorted(label for label in costs if label in simplifiedMap.labelIndex), sorted(simplifiedCosts)
+        )
+
+
+grader.add_basic_part(
+    "map-routable-1-basic",
+    lambda: t_routable_map(
+        osmPath="data/grader-small.osm",
+        landmarks=[{"landmark": "fountain", "geo": "37.33001,-121.89101"}],
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="streaming map reader against readMap on a small .osm file",
+)
+
+
+def t_connection_distances(cityMap: CityMap):
+    """
+    Check that the (batched) connection distances of `cityMap` match `computeDistance`
+    between the endpoints, and that each connection is symmetric.
+    """
+    geoLocations = cityMap.geoLocations
+    for source, neighbors in cityMap.distances.items():
+        for target, distance in neighbors.items():
+            expected = computeDistance(geoLocations[source], geoLocations[target])
+            if abs(distance - expected) > 1e-6 * max(1.0, expected):
+                grader.fail(f"Distance {source} -> {target} is {distance}, expected {expected}")
+                return
+            grader.require_is_equal(distance, cityMap.distances[target][source])
+
+
+grader.add_basic_part(
+    "map-distances-1-basic",
+    lambda: t_connection_distances(readMap("data/grader-small.osm")),
+    max_points=0,
+    max_seconds=1,
+    description="readMap connection distances against computeDistance on a small .osm file",
+)
+
+grader.add_basic_part(
+    "map-distances-2-basic",
+    lambda: t_connection_distances(readMap("data/sanjose.pbf")),
+    max_points=0,
+    max_seconds=10,
+    description="readMap connection distances against computeDistance on the San Jose map",
+)
+
+
+def t_tag_index(cityMap: CityMap, labels: List[str], tag: str):
+    """
+    Check that `addTag` keeps `tags`, `hasTag`, `locationsWithTag`, and
+    `locationsWithTagKey` consistent (in the map and its compact snapshot), and that
+    callers can't modify the index through `locationsWithTag`.
+    """
+    compactMap = cityMap.compact()
+    for label in labels:
+        cityMap.addTag(label, tag)
+    for otherMap in [cityMap, compactMap]:
+        grader.require_is_equal(tuple(sorted(set(labels))), otherMap.locationsWithTag(tag))
+        grader.require_is_equal(
+            sorted(label for label, tags in cityMap.tags.items() if tag in tags),
+            list(otherMap.locationsWithTag(tag)),
+        )
+        grader.require_is_true(all(otherMap.hasTag(label, tag) for label in labels))
+        grader.require_is_true(
+            set(labels) <= set(otherMap.locationsWithTagKey(tag.split("=", 1)[0]))
+        )
+    grader.require_is_true(isinstance(cityMap.locationsWithTag(tag), tuple))
+
+
+grader.add_basic_part(
+    "map-tag-index-1-basic",
+    lambda: t_tag_index(
+        cityMap=createGridMap(5, 5),
+        labels=[makeGridLabel(3, 1), makeGridLabel(0, 4), makeGridLabel(3, 1), makeGridLabel(2, 2)],
+        tag=makeTag("amenity", "food"),
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="tag index kept consistent by addTag on small grid",
+)
+
+
+def t_spatial_index(cityMap: CityMap, queries: List[GeoLocation]):
+    """
+    Check `SpatialIndex.nearest` and `within` against distances to every location,
+    including queries far outside the indexed area.
+    """
+    index = cityMap.spatialIndex()
+    for geo in queries:
+        distances = sorted(
+            (computeDistance(geo, location), label) for label, location in cityMap.geoLocations.items()
+        )
+        label, distance = index.nearest(geo)
+        grader.require_is_equal(distances[0][0], distance, tolerance=1e-6)
+        grader.require_is_equal(distances[0][1], label)
+        if distances[0][0] > 0:
+            grader.require_is_equal(None, index.nearest(geo, maxDistance=distances[0][0] / 2))
+        radius = distances[len(distances) // 2][0]
+        within = index.within(geo, radius)
+        grader.require_is_equal(sum(distance <= radius for distance, _ in distances), len(within))
+        grader.require_is_true(all(abs(computeDistance(geo, cityMap.geoLocations[label]) - distance) < 1e-6 for label, distance in within))
+
+
+grader.add_basic_part(
+    "map-spatial-index-1-basic",
+    lambda: t_spatial_index(
+        cityMap=createGridMap(10, 10),
+        queries=[
+            GeoLocation(3.2, 4.7), GeoLocation(0, 0), GeoLocation(-50, 80), GeoLocation(10, -170),
+        ],
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="spatial index queries (including far away ones) on small grid",
+)
+
+
+########################################################################################
+# Routing engines: compared against `UniformCostSearch` on small grid maps
+#   > Engines that explore locations in order of their cost from the start (as UCS
+#     does) must agree with UCS on `pathCost`, and explore every location cheaper
+#     than the end location (plus some of the locations that tie with it).
+
+
+def allPastCosts(cityMap: CityMap, startLocation: str) -> Dict[str, float]:
+    """Costs from `startLocation` to every location (UCS with an end tag no location has)."""
+    ucs = util.UniformCostSearch(verbose=0)
+    ucs.solve(submission.ShortestPathProblem(startLocation, makeTag("label", "nowhere"), cityMap))
+    return dict(ucs.pastCosts)
+
+
+def t_routing(
+    makeSearch: Callable[[CityMap, str], util.SearchAlgorithm],
+    cityMap: CityMap,
+    startLocation: str,
+    endTag: str,
+    costOrder: bool = True,
+    exactPastCosts: bool = True,
+) -> util.SearchAlgorithm:
+    """
+    Run `makeSearch(cityMap, endTag)` and UCS on a ShortestPathProblem, specified by
+        (startLocation, endTag).
+    Check that both find a (valid) path of the same cost; the paths themselves may
+    differ when there are ties (see `routing.py`). With `costOrder=True`, also check
+    `numStatesExplored` against the costs of all locations, and with
+    `exactPastCosts=True`, that `pastCosts` only holds the costs of cheapest paths.
+    Returns the search (for further checks).
+    """
+    problem = submission.ShortestPathProblem(startLocation, endTag, cityMap)
+    ucs = util.UniformCostSearch(verbose=0)
+    ucs.solve(problem)
+    search = makeSearch(cityMap, endTag)
+    search.solve(problem)
+    grader.require_is_equal(ucs.pathCost, search.pathCost)
+    path = extractPath(startLocation, search)
+    grader.require_is_true(checkValid(path, cityMap, startLocation, endTag, []))
+    grader.require_is_equal(search.pathCost, getTotalCost(path, cityMap))
+    costs = allPastCosts(cityMap, startLocation)
+    if costOrder:
+        numCheaper = sum(cost < ucs.pathCost for cost in costs.values())
+        numAsCheap = sum(cost <= ucs.pathCost for cost in costs.values())
+        grader.require_is_true(numCheaper <= search.numStatesExplored <= numAsCheap)
+    if exactPastCosts:
+        grader.require_is_true(
+            all(costs[location] == cost for location, cost in search.pastCosts.items())
+        )
+    return search
+
+
+class GridHeuristic(util.Heuristic):
+    """
+    Estimates the cost between grid locations as the (consistent) number of steps
+    between them; `StraightLineHeuristic` overestimates on grid maps, where
+    locations 1 step apart are ~1.11m apart.
+    """
+    def __init__(self, endTag: str, cityMap: CityMap):
+        self.endTag = endTag
+        self.cityMap = cityMap
+        self.endPoints = [
+            tuple(map(int, location.split(",")))
+            for location, tags in self.cityMap.tags.items()
+            if endTag in tags
+        ]
+
+    def evaluate(self, state: util.State) -> float:
+        x, y = map(int, state.location.split(","))
+        return min((abs(x - endX) + abs(y - endY) for endX, endY in self.endPoints), default=0.0)
+
+
+def t_routing_astar(
+    makeSearch: Callable[[CityMap, str], util.SearchAlgorithm],
+    cityMap: CityMap,
+    startLocation: str,
+    endTag: str,
+    exactPastCosts: bool = True,
+) -> util.SearchAlgorithm:
+    """
+    As `t_routing` for A* with a consistent heuristic, which only explores locations
+    no farther from the start than the end location.
+    """
+    search = t_routing(makeSearch, cityMap, startLocation, endTag, costOrder=False, exactPastCosts=exactPastCosts)
+    costs = allPastCosts(cityMap, startLocation)
+    grader.require_is_true(
+        search.numStatesExplored <= sum(cost <= search.pathCost for cost in costs.values())
+    )
+    return search
+
+
+grader.add_basic_part(
+    "routing-dijkstra-1-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: routing.DijkstraSearch(verbose=0),
+        cityMap=createGridMap(6, 6),
+        startLocation=makeGridLabel(1, 1),
+        endTag=makeTag("label", makeGridLabel(4, 3)),
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="array-based Dijkstra on small grid",
+)
+
+grader.add_basic_part(
+    "routing-dijkstra-2-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: routing.DijkstraSearch(verbose=0),
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("x", "5"),
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="array-based Dijkstra with multiple end locations",
+)
+
+grader.add_basic_part(
+    "routing-indexed-queue-1-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: util.UniformCostSearch(verbose=0, frontierFactory=util.IndexedPriorityQueue),
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("label", makeGridLabel(3, 3)),
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="UCS with an indexed decrease-key priority queue",
+)
+
+grader.add_basic_part(
+    "routing-bucket-queue-1-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: util.UniformCostSearch(verbose=0, frontierFactory=util.BucketQueue),
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("label", makeGridLabel(3, 3)),
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="UCS with a bucket priority queue",
+)
+
+
+grader.add_basic_part(
+    "routing-bidirectional-1-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: routing.BidirectionalSearch(verbose=0),
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("label", makeGridLabel(3, 3)),
+        costOrder=False,
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="bidirectional Dijkstra on medium grid",
+)
+
+grader.add_basic_part(
+    "routing-bidirectional-2-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: routing.BidirectionalSearch(verbose=0),
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("x", "5"),
+        costOrder=False,
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="bidirectional Dijkstra with multiple end locations",
+)
+
+
+grader.add_basic_part(
+    "routing-contraction-1-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: contraction.ContractionHierarchySearch(
+            contraction.ContractionHierarchy(cityMap)
+        ),
+        cityMap=createGridMap(20, 20),
+        startLocation=makeGridLabel(15, 2),
+        endTag=makeTag("label", makeGridLabel(3, 17)),
+        costOrder=False,
+        exactPastCosts=False,
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="contraction hierarchy query on medium grid",
+)
+
+grader.add_basic_part(
+    "routing-contraction-2-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: contraction.ContractionHierarchySearch(
+            contraction.ContractionHierarchy(cityMap)
+        ),
+        cityMap=createGridMap(20, 20),
+        startLocation=makeGridLabel(15, 2),
+        endTag=makeTag("y", "10"),
+        costOrder=False,
+        exactPastCosts=False,
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="contraction hierarchy query with multiple end locations",
+)
+
+
+def t_routing_alt(cityMap: CityMap, startLocation: str, endLocation: str):
+    """
+    Check that `ALTHeuristic` never overestimates the cost to `endLocation`, that A*
+    with it agrees with UCS, and that `LandmarkTables` survive a save/load round trip.
+    """
+    endTag = makeTag("label", endLocation)
+    tables = routing.LandmarkTables.compute(cityMap, numLandmarks=4)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "landmarks.alt")
+        tables.save(path)
+        loaded = routing.LandmarkTables.load(path, cityMap)
+    grader.require_is_equal(tables.landmarks, loaded.landmarks)
+    grader.require_is_equal(tables.costs, loaded.costs)
+    heuristic = routing.ALTHeuristic(endTag, cityMap, loaded)
+    # (Connections are symmetric, so costs from the end location are costs to it)
+    costsToEnd = allPastCosts(cityMap, endLocation)
+    grader.require_is_true(
+        all(heuristic.evaluate(util.State(location)) <= cost for location, cost in costsToEnd.items())
+    )
+    t_routing_astar(
+        lambda cityMap, endTag: util.AStarSearch(heuristic),
+        cityMap=cityMap,
+        startLocation=startLocation,
+        endTag=endTag,
+    )
+
+
+grader.add_basic_part(
+    "routing-alt-1-basic",
+    lambda: t_routing_alt(
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endLocation=makeGridLabel(3, 3),
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="ALT landmark heuristic on medium grid",
+)
+
+
+def t_routing_waypoints(
+    search: util.SearchAlgorithm,
+    cityMap: CityMap,
+    startLocation: str,
+    waypointTags: List[str],
+    endTag: str,
+):
+    """
+    Run `search` and UCS on a WaypointsShortestPathProblem, specified by
+        (startLocation, waypointTags, endTag).
+    Check that both find a path of the same cost, and that `pastCosts` only holds the
+    costs of cheapest paths from the start.
+    """
+    problem = submission.WaypointsShortestPathProblem(startLocation, waypointTags, endTag, cityMap)
+    ucs = util.UniformCostSearch(verbose=0)
+    ucs.solve(problem)
+    search.solve(problem)
+    grader.require_is_equal(ucs.pathCost, search.pathCost)
+    path = extractPath(startLocation, search)
+    grader.require_is_true(checkValid(path, cityMap, startLocation, endTag, waypointTags))
+    grader.require_is_equal(search.pathCost, getTotalCost(path, cityMap))
+    costs = allPastCosts(cityMap, startLocation)
+    grader.require_is_true(
+        all(costs[location] == cost for location, cost in search.pastCosts.items())
+    )
+
+
+grader.add_basic_part(
+    "routing-held-karp-1-basic",
+    lambda: t_routing_waypoints(
+        routing.HeldKarpWaypointsSearch(verbose=0),
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        waypointTags=[
+            makeTag("label", makeGridLabel(3, 25)),
+            makeTag("label", makeGridLabel(25, 25)),
+            makeTag("label", makeGridLabel(5, 2)),
+        ],
+        endTag=makeTag("x", "15"),
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="Held-Karp waypoints over a distance matrix on medium grid",
+)
+
+grader.add_basic_part(
+    "routing-held-karp-2-basic",
+    lambda: t_routing_waypoints(
+        routing.HeldKarpWaypointsSearch(verbose=0),
+        cityMap=createGridMapWithCustomTags(2, 2, {(0,0): [], (0,1): ["food", "fuel", "books"], (1,0): ["food"], (1,1): ["fuel"]}),
+        startLocation=makeGridLabel(0, 0),
+        waypointTags=["food", "fuel", "books"],
+        endTag=makeTag("label", makeGridLabel(0, 1)),
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="Held-Karp waypoints with locations covering multiple waypoints",
+)
+
+grader.add_basic_part(
+    "routing-held-karp-3-basic",
+    lambda: t_routing_waypoints(
+        routing.HeldKarpWaypointsSearch(maxCandidates=10, verbose=0),
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        waypointTags=[makeTag("x", 5), makeTag("y", 7)],
+        endTag=makeTag("label", makeGridLabel(3, 3)),
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="Held-Karp waypoints searching (location, waypoints) states with many candidates",
+)
+
+grader.add_basic_part(
+    "routing-held-karp-4-basic",
+    lambda: t_routing_waypoints(
+        routing.HeldKarpWaypointsSearch(verbose=0),
+        cityMap=sanJoseMap,
+        startLocation=locationFromTag(makeTag("landmark", "northeastern_building"), sanJoseMap),
+        waypointTags=["highway=stop", "barrier=gate", "railway=level_crossing"],
+        endTag=makeTag("landmark", "san_jose_state"),
+    ),
+    max_points=0,
+    max_seconds=10,
+    description="Held-Karp waypoints with hundreds of candidates on the San Jose map",
+)
+
+
+def t_routing_workspace(cityMap: CityMap, queries: List[Tuple[str, str]]):
+    """
+    Run `DijkstraSearch` with one shared `SearchWorkspace` on each (startLocation,
+    endTag) query in turn, checking each against UCS, and check that the `pastCosts`
+    of a previous search are kept, while its `exploredCosts` can no longer be read.
+    """
+    workspace = routing.SearchWorkspace(cityMap)
+    previous, previousCosts = None, None
+    for startLocation, endTag in queries:
+        search = t_routing(
+            lambda cityMap, endTag: routing.DijkstraSearch(verbose=0, workspace=workspace),
+            cityMap=cityMap,
+            startLocation=startLocation,
+            endTag=endTag,
+        )
+        grader.require_is_true(dict(search.exploredCosts) == search.pastCosts)
+        if previous is not None:
+            grader.require_is_true(previous.pastCosts == previousCosts)
+            try:
+                len(previous.exploredCosts)
+                grader.fail("Expected stale exploredCosts to raise a RuntimeError")
+            except RuntimeError:
+                pass
+        previous, previousCosts = search, dict(search.pastCosts)
+
+
+grader.add_basic_part(
+    "routing-workspace-1-basic",
+    lambda: t_routing_workspace(
+        cityMap=createGridMap(30, 30),
+        queries=[
+            (makeGridLabel(20, 10), makeTag("label", makeGridLabel(3, 3))),
+            (makeGridLabel(3, 3), makeTag("x", "25")),
+            (makeGridLabel(0, 0), makeTag("label", makeGridLabel(1, 0))),
+            (makeGridLabel(20, 10), makeTag("label", makeGridLabel(3, 3))),
+        ],
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="repeated Dijkstra searches reusing one search workspace",
+)
+
+
+grader.add_basic_part(
+    "routing-astar-1-basic",
+    lambda: t_routing_astar(
+        lambda cityMap, endTag: util.AStarSearch(GridHeuristic(endTag, cityMap)),
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("label", makeGridLabel(3, 3)),
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="native A* on medium grid",
+)
+
+grader.add_basic_part(
+    "routing-astar-2-basic",
+    lambda: t_routing_astar(
+        lambda cityMap, endTag: util.AStarSearch(GridHeuristic(endTag, cityMap)),
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("x", "5"),
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="native A* with multiple end locations",
+)
+
+
+def t_routing_reduction(
+    cityMap: CityMap, startLocation: str, endTag: str, makeHeuristic: Callable = GridHeuristic
+):
+    """
+    Check that UCS on `aStarReduction` (with `makeHeuristic(endTag, cityMap)`) finds a
+    path of the same cost as UCS.
+    """
+    problem = submission.ShortestPathProblem(startLocation, endTag, cityMap)
+    ucs = util.UniformCostSearch(verbose=0)
+    ucs.solve(problem)
+    reduced = util.UniformCostSearch(verbose=0)
+    reduced.solve(submission.aStarReduction(problem, makeHeuristic(endTag, cityMap)))
+    path = extractPath(startLocation, reduced)
+    grader.require_is_true(checkValid(path, cityMap, startLocation, endTag, []))
+    grader.require_is_equal(ucs.pathCost, getTotalCost(path, cityMap))
+    costs = allPastCosts(cityMap, startLocation)
+    grader.require_is_true(
+        reduced.numStatesExplored <= sum(cost <= ucs.pathCost for cost in costs.values())
+    )
+
+
+grader.add_basic_part(
+    "routing-astar-reduction-1-basic",
+    lambda: t_routing_reduction(
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("label", makeGridLabel(3, 3)),
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="UCS on the A* reduction on medium grid",
+)
+
+grader.add_basic_part(
+    "routing-astar-reduction-2-basic",
+    lambda: t_routing_reduction(
+        cityMap=sanJoseMap,
+        startLocation=locationFromTag(makeTag("landmark", "philz"), sanJoseMap),
+        endTag=makeTag("landmark", "northeastern_building"),
+        makeHeuristic=submission.StraightLineHeuristic,
+    ),
+    max_points=0,
+    max_seconds=5,
+    description="UCS on the A* reduction on San Jose map",
+)
+
+
+def t_routing_weighted(cityMap: CityMap, startLocation: str, endTag: str, weight: float):
+    """
+    Check that weighted A* finds a path within `weight` times the cost found by UCS,
+    that ARA* ends with the optimal path, and that weights below 1 are rejected.
+    """
+    problem = submission.ShortestPathProblem(startLocation, endTag, cityMap)
+    ucs = util.UniformCostSearch(verbose=0)
+    ucs.solve(problem)
+
+    weighted = util.AStarSearch(GridHeuristic(endTag, cityMap), weight=weight)
+    weighted.solve(problem)
+    path = extractPath(startLocation, weighted)
+    grader.require_is_true(checkValid(path, cityMap, startLocation, endTag, []))
+    grader.require_is_equal(weighted.pathCost, getTotalCost(path, cityMap))
+    grader.require_is_true(ucs.pathCost <= weighted.pathCost <= weight * ucs.pathCost)
+    grader.require_is_equal(weight, weighted.suboptimalityBound)
+
+    anytime = util.AnytimeRepairingAStarSearch(GridHeuristic(endTag, cityMap), initialWeight=weight)
+    anytime.solve(problem)
+    path = extractPath(startLocation, anytime)
+    grader.require_is_true(checkValid(path, cityMap, startLocation, endTag, []))
+    grader.require_is_equal(ucs.pathCost, anytime.pathCost)
+    grader.require_is_equal(1.0, anytime.suboptimalityBound)
+    pathCosts = [pathCost for _, pathCost, _ in anytime.improvements]
+    grader.require_is_true(pathCosts == sorted(pathCosts, reverse=True))
+
+    try:
+        util.AStarSearch(GridHeuristic(endTag, cityMap), weight=0.5)
+        grader.fail("Expected a weight below 1 to raise a ValueError")
+    except ValueError:
+        pass
+
+
+grader.add_basic_part(
+    "routing-weighted-astar-1-basic",
+    lambda: t_routing_weighted(
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("label", makeGridLabel(3, 3)),
+        weight=2.0,
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="weighted A* and ARA* on medium grid",
+)
+
+grader.add_basic_part(
+    "routing-weighted-astar-2-basic",
+    lambda: t_routing_weighted(
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("x", "5"),
+        weight=1.5,
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="weighted A* and ARA* with multiple end locations",
+)
+
+
+def t_routing_anytime_zero_costs():
+    """
+    Check that ARA* finds a zero-cost path, with a suboptimality bound of 1, when
+    states with a zero lower bound (zero cost and heuristic) are still in the frontier.
+    """
+    cityMap = createGridMap(2, 2)
+    for source, target in [((0, 0), (0, 1)), ((0, 0), (1, 0)), ((1, 0), (1, 1)), ((0, 1), (1, 1))]:
+        cityMap.addConnection(makeGridLabel(*source), makeGridLabel(*target), 0.0)
+    endTag = makeTag("label", makeGridLabel(0, 1))
+    problem = submission.ShortestPathProblem(makeGridLabel(0, 0), endTag, cityMap)
+    anytime = util.AnytimeRepairingAStarSearch(ZeroHeuristic(endTag, cityMap), initialWeight=2.0)
+    anytime.solve(problem)
+    grader.require_is_equal(0.0, anytime.pathCost)
+    grader.require_is_equal(1.0, anytime.suboptimalityBound)
+
+
+grader.add_basic_part(
+    "routing-weighted-astar-3-basic",
+    t_routing_anytime_zero_costs,
+    max_points=0,
+    max_seconds=2,
+    description="ARA* with zero-cost connections",
+)
+
+
+grader.add_basic_part(
+    "routing-ida-star-1-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: util.IterativeDeepeningAStarSearch(GridHeuristic(endTag, cityMap)),
+        cityMap=createGridMap(15, 15),
+        startLocation=makeGridLabel(12, 2),
+        endTag=makeTag("label", makeGridLabel(3, 11)),
+        costOrder=False,
+        exactPastCosts=False,
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="IDA* on small grid",
+)
+
+grader.add_basic_part(
+    "routing-ida-star-2-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: util.IterativeDeepeningAStarSearch(GridHeuristic(endTag, cityMap), maxTableSize=20),
+        cityMap=createGridMap(8, 8),
+        startLocation=makeGridLabel(6, 1),
+        endTag=makeTag("label", makeGridLabel(1, 5)),
+        costOrder=False,
+        exactPastCosts=False,
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="IDA* with a small transposition table",
+)
+
+grader.add_basic_part(
+    "routing-sma-star-1-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: util.SimplifiedMemoryBoundedAStarSearch(GridHeuristic(endTag, cityMap), maxNodes=1000),
+        cityMap=createGridMap(15, 15),
+        startLocation=makeGridLabel(12, 2),
+        endTag=makeTag("label", makeGridLabel(3, 11)),
+        costOrder=False,
+        exactPastCosts=False,
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="SMA* on small grid",
+)
+
+grader.add_basic_part(
+    "routing-sma-star-2-basic",
+    lambda: t_routing(
+        lambda cityMap, endTag: util.SimplifiedMemoryBoundedAStarSearch(GridHeuristic(endTag, cityMap), maxNodes=40),
+        cityMap=createGridMap(8, 8),
+        startLocation=makeGridLabel(6, 1),
+        endTag=makeTag("x", "1"),
+        costOrder=False,
+        exactPastCosts=False,
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="SMA* with a small memory bound and multiple end locations",
+)
+
+
+def t_routing_dstar_lite(
+    cityMap: CityMap,
+    startLocation: str,
+    endTag: str,
+    updates: List[Tuple[str, str, float]],
+    newStartLocation: str,
+):
+    """
+    Check D* Lite against UCS on a ShortestPathProblem, then after each of `updates`
+    (a closure or a longer distance) to the map, and from `newStartLocation`; also
+    check that connections shorter than the straight-line distance are rejected.
+    """
+    search = routing.DStarLiteSearch(verbose=0)
+
+    def check(startLocation: str):
+        problem = submission.ShortestPathProblem(startLocation, endTag, cityMap)
+        ucs = util.UniformCostSearch(verbose=0)
+        ucs.solve(problem)
+        search.solve(problem)
+        grader.require_is_equal(ucs.pathCost, search.pathCost)
+        if ucs.pathCost is not None:
+            path = extractPath(startLocation, search)
+            grader.require_is_true(checkValid(path, cityMap, startLocation, endTag, []))
+            grader.require_is_equal(search.pathCost, getTotalCost(path, cityMap))
+            grader.require_is_equal(search.pathCost, search.pastCosts[path[-1]])
+
+    check(startLocation)
+    for update in updates:
+        cityMap.updateConnections([update])
+        check(startLocation)
+    check(newStartLocation)
+
+    source, target, _ = updates[0]
+    try:
+        cityMap.updateConnections([(source, target, 0.5)])
+        grader.fail("Expected a connection shorter than the straight-line distance to raise a ValueError")
+    except ValueError:
+        pass
+
+    # Changes to the same connection are coalesced until the next `solve`, and the map
+    # doesn't keep discarded searches alive
+    for distance in range(10, 110):
+        cityMap.updateConnections([(source, target, float(distance))])
+    grader.require_is_equal(2, len(search.pending))
+    reference = weakref.ref(search)
+    del search
+    gc.collect()
+    grader.require_is_true(reference() is None)
+
+
+grader.add_basic_part(
+    "routing-dstar-lite-1-basic",
+    lambda: t_routing_dstar_lite(
+        cityMap=createGridMap(10, 10),
+        startLocation=makeGridLabel(1, 1),
+        endTag=makeTag("label", makeGridLabel(8, 7)),
+        updates=[
+            (makeGridLabel(1, 1), makeGridLabel(2, 1), float("inf")),
+            (makeGridLabel(1, 1), makeGridLabel(1, 2), 5.0),
+            (makeGridLabel(1, 2), makeGridLabel(2, 2), float("inf")),
+            (makeGridLabel(1, 1), makeGridLabel(1, 2), float("inf")),
+            (makeGridLabel(1, 1), makeGridLabel(2, 1), 3.0),
+        ],
+        newStartLocation=makeGridLabel(6, 2),
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="D* Lite re-planning after connection changes on small grid",
+)
+
+grader.add_basic_part(
+    "routing-dstar-lite-2-basic",
+    lambda: t_routing_dstar_lite(
+        cityMap=createGridMap(10, 10),
+        startLocation=makeGridLabel(5, 5),
+        endTag=makeTag("x", "0"),
+        updates=[
+            (makeGridLabel(0, 5), makeGridLabel(1, 5), float("inf")),
+            (makeGridLabel(1, 5), makeGridLabel(2, 5), 4.0),
+            (makeGridLabel(5, 5), makeGridLabel(4, 5), float("inf")),
+        ],
+        newStartLocation=makeGridLabel(9, 9),
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="D* Lite re-planning with multiple end locations",
+)
+
+
+def t_routing_time_dependent(cityMap: CityMap, startLocation: str, endTag: str):
+    """
+    With constant travel times (`distance / speed`), check `TimeDependentSearch`
+    against UCS (with and without its heuristic); with congestion, check that
+    `arrivalProfile` agrees with a `TimeDependentSearch` at several departure times.
+    """
+    problem = submission.ShortestPathProblem(startLocation, endTag, cityMap)
+    ucs = util.UniformCostSearch(verbose=0)
+    ucs.solve(problem)
+    costs = allPastCosts(cityMap, startLocation)
+    profiles = TravelTimeProfiles(cityMap)
+    for useHeuristic in [False, True]:
+        search = routing.TimeDependentSearch(profiles, 8 * 3600, useHeuristic=useHeuristic)
+        search.solve(problem)
+        grader.require_is_equal(ucs.pathCost, search.pathCost * profiles.speed)
+        grader.require_is_equal(8 * 3600 + search.pathCost, search.arrivalTime)
+        path = extractPath(startLocation, search)
+        grader.require_is_true(checkValid(path, cityMap, startLocation, endTag, []))
+        grader.require_is_true(
+            all(abs(costs[location] - cost * profiles.speed) < 1e-6 for location, cost in search.pastCosts.items())
+        )
+        if not useHeuristic:
+            numCheaper = sum(cost < ucs.pathCost for cost in costs.values())
+            numAsCheap = sum(cost <= ucs.pathCost for cost in costs.values())
+            grader.require_is_true(numCheaper <= search.numStatesExplored <= numAsCheap)
+
+    congestion = TravelTimeProfiles.fromCongestion(
+        cityMap, [7 * 3600, 8 * 3600, 9 * 3600], [1.0, 3.0, 1.0]
+    )
+    profile = routing.arrivalProfile(congestion, startLocation, endTag, 7 * 3600, 9 * 3600)
+    for departure in [7 * 3600, 7.5 * 3600, 8 * 3600, 8.25 * 3600, 9 * 3600]:
+        search = routing.TimeDependentSearch(congestion, departure)
+        search.solve(problem)
+        grader.require_is_equal(search.arrivalTime, profile(departure), tolerance=1e-2)
+
+
+grader.add_basic_part(
+    "routing-time-dependent-1-basic",
+    lambda: t_routing_time_dependent(
+        cityMap=createGridMap(10, 10),
+        startLocation=makeGridLabel(1, 1),
+        endTag=makeTag("label", makeGridLabel(8, 7)),
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="time-dependent search and arrival profiles on small grid",
+)
+
+grader.add_basic_part(
+    "routing-time-dependent-2-basic",
+    lambda: t_routing_time_dependent(
+        cityMap=createGridMap(10, 10),
+        startLocation=makeGridLabel(5, 5),
+        endTag=makeTag("x", "0"),
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="time-dependent search and arrival profiles with multiple end locations",
+)
+
+
+def t_distance_matrix(cityMap: CityMap, sources: List[str], targets: List[str]):
+    """Check `distanceMatrix` (serial and with 2 worker processes) against pairwise UCS."""
+    expected = []
+    for source in sources:
+        row = []
+        for target in targets:
+            ucs = util.UniformCostSearch(verbose=0)
+            ucs.solve(submission.ShortestPathProblem(source, makeTag("label", target), cityMap))
+            row.append(ucs.pathCost)
+        expected.append(row)
+    for processes in [1, 2]:
+        matrix = routing.distanceMatrix(cityMap, sources, targets, processes=processes)
+        grader.require_is_equal((len(sources), len(targets)), matrix.shape)
+        grader.require_is_true(
+            all(abs(matrix[i][j] - cost) < 1e-6 for i, row in enumerate(expected) for j, cost in enumerate(row))
+        )
+
+
+grader.add_basic_part(
+    "routing-distance-matrix-1-basic",
+    lambda: t_distance_matrix(
+        cityMap=createGridMap(10, 10),
+        sources=[makeGridLabel(1, 1), makeGridLabel(5, 5), makeGridLabel(9, 0)],
+        targets=[makeGridLabel(0, 9), makeGridLabel(5, 5), makeGridLabel(8, 7), makeGridLabel(1, 1)],
+    ),
+    max_points=0,
+    max_seconds=5,
+    description="distance matrix against pairwise UCS on small grid",
+)
+
+
+def t_heuristic_cache(cityMap: CityMap, startLocation: str, endTag: str):
+    """
+    Check that the `StraightLineHeuristic` cache stays within `maxCacheSize` entries
+    (across searches), without changing the heuristic values or the path found.
+    """
+    problem = submission.ShortestPathProblem(startLocation, endTag, cityMap)
+    heuristic = submission.StraightLineHeuristic(endTag, cityMap)
+    search = util.AStarSearch(heuristic)
+    search.solve(problem)
+    bounded = submission.StraightLineHeuristic(endTag, cityMap)
+    bounded.maxCacheSize = 8
+    for _ in range(2):
+        boundedSearch = util.AStarSearch(bounded)
+        boundedSearch.solve(problem)
+        grader.require_is_true(len(bounded.cache) <= 8)
+        grader.require_is_equal(search.actions, boundedSearch.actions)
+    grader.require_is_true(
+        all(bounded.evaluate(util.State(location)) == distance for location, distance in heuristic.cache.items())
+    )
+
+
+grader.add_basic_part(
+    "routing-heuristic-cache-1-basic",
+    lambda: t_heuristic_cache(
+        cityMap=createGridMap(30, 30),
+        startLocation=makeGridLabel(20, 10),
+        endTag=makeTag("label", makeGridLabel(3, 3)),
+    ),
+    max_points=0,
+    max_seconds=1,
+    description="bounded straight line heuristic cache on medium grid",
+)
+
+
+########################################################################################
+# Route server
+
+
+async def httpRequest(port: int, method: str, target: str, body: bytes = b"", contentLength: Optional[int] = None):
+    """Send one HTTP request to the route server; returns (status code, JSON response)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    contentLength = len(body) if contentLength is None else contentLength
+    head = f"{method} {target} HTTP/1.1\r\nContent-Length: {contentLength}\r\nConnection: close\r\n\r\n"
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+def t_route_server(cityMap: CityMap, queries: List[Tuple[str, str]], waypointTags: List[str]):
+    """
+    Run a `RouteServer` (with 2 workers, and a time limit of 0 for waypoint queries) and
+    send it concurrent shortest path queries (which should be answered in batches, like
+    UCS would) mixed with waypoint queries (which should all time out), followed by
+    invalid requests.
+    """
+    server = routeServer.RouteServer(
+        "data/sanjose.pbf", "data/sanjose-landmarks.json",
+        processes=2, batchSize=4, batchDelay=0.1, queryTimeLimit=0.0,
+    )
+
+    async def run():
+        await server.start("127.0.0.1", 0)
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            requests = [{"startLocation": start, "endTag": endTag} for start, endTag in queries]
+            requests += [
+                {"startLocation": start, "endTag": endTag, "waypointTags": waypointTags}
+                for start, endTag in queries[:2]
+            ]
+            responses = await asyncio.gather(*(
+                httpRequest(port, "POST", "/route", json.dumps(request).encode("utf-8"))
+                for request in requests
+            ))
+            errors = await asyncio.gather(
+                httpRequest(port, "POST", "/route", b"{not json"),
+                httpRequest(port, "POST", "/route", b'{"startLocation": "nowhere", "endTag": "x"}'),
+                httpRequest(port, "GET", "/route"),
+                httpRequest(port, "POST", "/route", contentLength=routeServer.MAX_BODY_BYTES + 1),
+            )
+            return responses, errors
+        finally:
+            server.close()
+
+    responses, errors = asyncio.run(run())
+    for (start, endTag), (status, response) in zip(queries, responses):
+        ucs = util.UniformCostSearch(verbose=0)
+        ucs.solve(submission.ShortestPathProblem(start, endTag, cityMap))
+        grader.require_is_equal(200, status)
+        grader.require_is_equal(ucs.pathCost, response["cost"], tolerance=1e-6)
+        grader.require_is_true(checkValid(response["path"], cityMap, start, endTag, []))
+    for status, response in responses[len(queries):]:
+        grader.require_is_equal(504, status)
+        grader.require_is_true(response["timedOut"])
+    # Waypoint queries are sent on their own; shortest path queries share batches
+    grader.require_is_true(server.numBatches < len(responses))
+    grader.require_is_equal([400, 400, 404, 413], [status for status, _ in errors])
+    grader.require_is_true(all("error" in response for _, response in errors))
+
+
+grader.add_basic_part(
+    "route-server-1-basic",
+    lambda: t_route_server(
+        sanJoseMap,
+        queries=[
+            (locationFromTag(makeTag("landmark", start), sanJoseMap), makeTag("landmark", end))
+            for start, end in [
+                ("philz", "city_hall"), ("city_hall", "philz"), ("grocery_outlet", "starbucks"),
+                ("san_pedro_market", "san_jose_state"), ("cathedral_basilica", "city_hall"),
+                ("northeastern_building", "philz"), ("philz", "grocery_outlet"),
+                ("city_hall", "cathedral_basilica"),
+            ]
+        ],
+        waypointTags=[makeTag("landmark", "city_hall"), makeTag("landmark", "philz")],
+    ),
+    max_points=0,
+    max_seconds=30,
+    description="route server batching, time limit and error responses on San Jose map",
+)
+
+
+########################################################################################
+# Search metrics
+
+
+class IteratorProblem(util.SearchProblem):
+    """Wraps a problem so that `successorsAndCosts` returns an iterator."""
+    def __init__(self, problem: util.SearchProblem):
+        self.problem = problem
+
+    def startState(self) -> util.State:
+        return self.problem.startState()
+
+    def isEnd(self, state: util.State) -> bool:
+        return self.problem.isEnd(state)
+
+    def successorsAndCosts(self, state: util.State):
+        return iter(self.problem.successorsAndCosts(state))
+
+
+class UnsizedQueue:
+    """A frontier without `__len__` (or `numStalePops`)."""
+    def __init__(self):
+        self.queue = util.PriorityQueue()
+        self.update, self.removeMin = self.queue.update, self.queue.removeMin
+
+
+def t_search_metrics(cityMap: CityMap, startLocation: str, endTag: str):
+    """
+    Check the counters of `UniformCostSearch` and `AStarSearch` (only filled in with
+    `profile=True`), with iterator successors and unsized frontiers too, and check that
+    `MetricsTrace` records every search.
+    """
+    problem = submission.ShortestPathProblem(startLocation, endTag, cityMap)
+    plain = util.UniformCostSearch(verbose=0)
+    plain.solve(problem)
+    grader.require_is_equal(plain.numStatesExplored, plain.metrics.numStatesExplored)
+    grader.require_is_equal(0, plain.metrics.numPushes + plain.metrics.numSuccessors)
+
+    with tempfile.TemporaryDirectory() as directory:
+        tracePath = os.path.join(directory, "metrics.jsonl")
+        searches = [
+            util.UniformCostSearch(verbose=0, profile=True),
+            util.UniformCostSearch(verbose=0, profile=True, frontierFactory=UnsizedQueue),
+            util.AStarSearch(submission.StraightLineHeuristic(endTag, cityMap), verbose=0, profile=True),
+        ]
+        for search in searches:
+            search.addMetricsCallback(util.MetricsTrace(tracePath))
+            for searchProblem in [problem, IteratorProblem(problem)]:
+                search.solve(searchProblem)
+                metrics = search.metrics
+                grader.require_is_equal(plain.pathCost, search.pathCost, tolerance=1e-6)
+                grader.require_is_equal(search.numStatesExplored - 1, metrics.numSuccessorCalls)
+                grader.require_is_true(metrics.numPushes <= metrics.numSuccessors + 1)
+                grader.require_is_true(metrics.numPushes >= search.numStatesExplored)
+                if isinstance(search, util.AStarSearch):
+                    grader.require_is_true(metrics.numPushes <= metrics.numHeuristicCalls <= metrics.numSuccessors + 1)
+                else:
+                    grader.require_is_equal(search.numStatesExplored, plain.numStatesExplored)
+                sized = not isinstance(search.frontierFactory(), UnsizedQueue)
+                grader.require_is_equal(sized, metrics.maxFrontierSize > 0)
+
+        with open(tracePath) as f:
+            records = [json.loads(line) for line in f]
+        grader.require_is_equal(
+            ["UniformCostSearch"] * 4 + ["AStarSearch"] * 2, [record["algorithm"] for record in records]
+        )
+        grader.require_is_true(all(abs(record["pathCost"] - plain.pathCost) < 1e-6 for record in records))
+        grader.require_is_equal(searches[-1].metrics.asDict()["numPushes"], records[-1]["numPushes"])
+
+
+grader.add_basic_part(
+    "search-metrics-1-basic",
+    lambda: t_search_metrics(
+        cityMap=createGridMap(10, 10),
+        startLocation=makeGridLabel(1, 1),
+        endTag=makeTag("label", makeGridLabel(8, 7)),
+    ),
+    max_points=0,
+    max_seconds=2,
+    description="search metrics counters and MetricsTrace on small grid",
+)
+
+
+
 if __name__ == "__main__":
     grader.grade()
@@ -1,9 +1,19 @@
+import hashlib
 import json
+import mmap
+import os
+import sys
+import types
+import weakref
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from collections import defaultdict
 from dataclasses import dataclass
-from math import asin, cos, radians, sin, sqrt
-from typing import Dict, List, Optional, Set, Tuple
+from math import asin, cos, degrees, floor, radians, sin, sqrt
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
 
+import numpy as np
 import osmium
 from osmium import osm
 
@@ -29,9 +39,24 @@ UNIT_DELTA = 0.00001    # Denotes the change in latitude/longitude (in degrees)
 #                                    defined manually as "landmarks" in
 #                                    `data/sanjose-landmarks.json`.
 #
+#       + `tagLocations` [str -> List[str]]: The inverse of `tags`; maps each tag to
+#                                            the sorted list of location labels that
+#                                            have that tag.
+#
 #       + `distances` [str -> [str -> float]]: A nested dictionary mapping pairs of
 #                                              locations to distances (e.g.,
 #                                              `distances[label1][label2] = 21.3`).
+#                                              Distances of existing connections can
+#                                              change over time (e.g., closures or
+#                                              congestion; see `updateConnections`).
+#
+#   > `CompactCityMap` is a read-only alternative storage mode for a `CityMap`; labels
+#     are interned to dense integer ids and connections are kept in flat arrays
+#     (compressed sparse row form), while `geoLocations`, `tags`, and `distances` are
+#     still available as read-only dictionary-like views keyed by label.
+#
+#   > `SpatialIndex` buckets the locations of a `CityMap` into a uniform grid over
+#     latitude/longitude, for fast nearest-location and radius queries.
 
 
 @dataclass(frozen=True)
@@ -44,6 +69,10 @@ class GeoLocation:
         return f"{self.latitude},{self.longitude}"
 
 
+# (source label, target label, old distance, new distance) of a changed connection
+ConnectionUpdate = Tuple[str, str, float, float]
+
+
 class CityMap:
     """
     A city map consists of a set of *labeled* locations with associated tags, and
@@ -62,11 +91,77 @@ class CityMap:
         # (e.g., self.distances["0,1"]["0,2"] = 21.3)
         self.distances: Dict[str, Dict[str, float]] = defaultdict(dict)
 
+        # Inverted tag index, kept up to date by `addLocation` and `addTag`:
+        #   > Tag -> sorted list of location labels with that tag
+        #     (e.g., self.tagLocations["amenity=food"] = ["0,1", "3,4"])
+        #   > Location label -> set of tags (for constant-time membership tests)
+        #   > Tag key -> set of tags with that key
+        #     (e.g., self.tagKeys["amenity"] = {"amenity=food", "amenity=parking"})
+        self.tagLocations: Dict[str, List[str]] = defaultdict(list)
+        self.tagSets: Dict[str, Set[str]] = defaultdict(set)
+        self.tagKeys: Dict[str, Set[str]] = defaultdict(set)
+
+        # (source, target) -> intermediate geolocations along that connection, for
+        # connections that replace a chain of locations (see `readRoutableMap`)
+        self.shapes: Dict[Tuple[str, str], List[GeoLocation]] = {}
+
+        # Cached read-only snapshot of this map in compact form (see `compact()`), and
+        # spatial index over all locations (see `spatialIndex()`)
+        self._compactMap: Optional["CompactCityMap"] = None
+        self._spatialIndex: Optional["SpatialIndex"] = None
+
+        # Callbacks for changed connections (see `updateConnections`), each behind a
+        # (weak) reference :: calling it returns the listener, or None once it's gone
+        self._connectionListeners: List[Callable[[], Optional[Callable[[List[ConnectionUpdate]], None]]]] = []
+
     def addLocation(self, label: str, location: GeoLocation, tags: List[str]) -> None:
         """Add a location (denoted by `label`) to map with the provided set of tags."""
         assert label not in self.geoLocations, f"Location {label} already processed!"
         self.geoLocations[label] = location
         self.tags[label] = [makeTag("label", label)] + tags
+        for tag in self.tags[label]:
+            self._indexTag(label, tag)
+        self._compactMap = None
+        self._spatialIndex = None
+
+    def addTag(self, label: str, tag: str) -> None:
+        """
+        Add `tag` to the existing location `label`. Always add tags through this method
+        (rather than appending to `self.tags[label]`) so that the tag index stays valid.
+        """
+        self.tags[label].append(tag)
+        self._indexTag(label, tag)
+
+    def _indexTag(self, label: str, tag: str) -> None:
+        if tag not in self.tagSets[label]:
+            self.tagSets[label].add(tag)
+            insort(self.tagLocations[tag], label)
+            self.tagKeys[tag.split("=", 1)[0]].add(tag)
+
+    def connectionShape(self, source: str, target: str) -> List[GeoLocation]:
+        """Return the geolocations along the connection source --> target, in order."""
+        inner = self.shapes.get((source, target), [])
+        return [self.geoLocations[source]] + inner + [self.geoLocations[target]]
+
+    def hasTag(self, label: str, tag: str) -> bool:
+        """Return whether location `label` has `tag`."""
+        tags = self.tagSets.get(label)
+        return tags is not None and tag in tags
+
+    def locationsWithTag(self, tag: str) -> Tuple[str, ...]:
+        """Return the (sorted) labels of all locations with `tag`."""
+        # (A copy, so that callers can't corrupt the index)
+        return tuple(self.tagLocations.get(tag, ()))
+
+    def locationsWithTagKey(self, key: str) -> List[str]:
+        """
+        Return the sorted labels of all locations with any tag for `key` (e.g., all
+        locations with an `amenity=...` tag for key "amenity").
+        """
+        labels = set()
+        for tag in self.tagKeys.get(key, ()):
+            labels.update(self.tagLocations[tag])
+        return sorted(labels)
 
     def addConnection(
         self, source: str, target: str, distance: Optional[float] = None
@@ -78,6 +173,648 @@ class CityMap:
             )
         self.distances[source][target] = distance
         self.distances[target][source] = distance
+        self._compactMap = None
+
+    def addConnections(
+        self, connections: Sequence[Tuple[str, str]], distances: Optional[Sequence[float]] = None
+    ) -> None:
+        """
+        Batch version of `addConnection` for (source, target) pairs; when `distances`
+        is not given, all straight-line distances are computed in a single vectorized
+        call (see `computeConnectionDistances`).
+        """
+        if distances is None:
+            sources = [self.geoLocations[source] for source, _ in connections]
+            targets = [self.geoLocations[target] for _, target in connections]
+            distances = computeConnectionDistances(
+                np.array([geo.latitude for geo in sources]),
+                np.array([geo.longitude for geo in sources]),
+                np.array([geo.latitude for geo in targets]),
+                np.array([geo.longitude for geo in targets]),
+            ).tolist()
+        for (source, target), distance in zip(connections, distances):
+            self.distances[source][target] = distance
+            self.distances[target][source] = distance
+        self._compactMap = None
+
+    def updateConnections(
+        self, updates: Sequence[Tuple[str, str, float]], symmetric: bool = True
+    ) -> List[ConnectionUpdate]:
+        """
+        Change the distances of existing connections, e.g., to model congestion (a
+        longer distance) or a closure (`float("inf")`), given (source, target, new
+        distance) triples. With `symmetric=True`, target --> source changes as well.
+
+        Returns the changed connections as (source, target, old distance, new distance)
+        tuples (one per direction), and passes them to every listener registered with
+        `addConnectionListener` (e.g., for incremental re-planning; see
+        `routing.DStarLiteSearch`).
+
+        Raises a `ValueError` (before changing anything) if a new distance is shorter
+        than both the old distance and the straight-line distance between its
+        locations; `StraightLineHeuristic` (and `routing.DStarLiteSearch`) rely on no
+        connection being shorter than the straight-line distance.
+        """
+        changes: List[ConnectionUpdate] = []
+        for source, target, distance in updates:
+            directions = [(source, target), (target, source)] if symmetric else [(source, target)]
+            for start, end in directions:
+                oldDistance = self.distances.get(start, {}).get(end)
+                if oldDistance is None:
+                    raise KeyError(f"No connection {start} --> {end}")
+                # (With some slack for rounding differences between distance computations)
+                if not distance >= min(oldDistance, self._straightLineDistance(start, end)) * (1 - 1e-9):
+                    raise ValueError(
+                        f"{start} --> {end}: distance {distance} is shorter than the straight-line distance"
+                    )
+        for source, target, distance in updates:
+            directions = [(source, target), (target, source)] if symmetric else [(source, target)]
+            for start, end in directions:
+                oldDistance = self.distances[start][end]
+                if oldDistance != distance:
+                    self.distances[start][end] = distance
+                    changes.append((start, end, oldDistance, distance))
+
+        if len(changes) > 0:
+            self._compactMap = None
+            listeners = [reference() for reference in self._connectionListeners]
+            self._connectionListeners = [
+                reference for reference, listener in zip(self._connectionListeners, listeners)
+                if listener is not None
+            ]
+            for listener in listeners:
+                if listener is not None:
+                    listener(changes)
+        return changes
+
+    def _straightLineDistance(self, source: str, target: str) -> float:
+        """Straight-line distance between two locations (0 if either has no coordinates)."""
+        geo1, geo2 = self.geoLocations.get(source), self.geoLocations.get(target)
+        if geo1 is None or geo2 is None:
+            return 0.0
+        return computeDistance(geo1, geo2)
+
+    def addConnectionListener(self, listener: Callable[[List[ConnectionUpdate]], None]) -> None:
+        """
+        Call `listener(changes)` after every `updateConnections` that changes something.
+        Bound methods are only referenced weakly, so that listening doesn't keep their
+        object (e.g., a discarded `routing.DStarLiteSearch`) alive.
+        """
+        if isinstance(listener, types.MethodType):
+            self._connectionListeners.append(weakref.WeakMethod(listener))
+        else:
+            self._connectionListeners.append(lambda: listener)
+
+    def removeConnectionListener(self, listener: Callable[[List[ConnectionUpdate]], None]) -> None:
+        for i, reference in enumerate(self._connectionListeners):
+            if reference() == listener:
+                del self._connectionListeners[i]
+                return
+        raise ValueError("Not a connection listener")
+
+    def compact(self) -> "CompactCityMap":
+        """
+        Return a read-only `CompactCityMap` snapshot of this map. The snapshot is cached,
+        and rebuilt only after new locations or connections are added.
+        """
+        if self._compactMap is None:
+            self._compactMap = CompactCityMap.fromCityMap(self)
+        return self._compactMap
+
+    def spatialIndex(self) -> "SpatialIndex":
+        """
+        Return a `SpatialIndex` over all locations in this map (e.g., for snapping GPS
+        coordinates onto the map). The index is cached until new locations are added.
+        """
+        if self._spatialIndex is None:
+            self._spatialIndex = SpatialIndex(self)
+        return self._spatialIndex
+
+
+class CompactCityMap(CityMap):
+    """
+    A read-only CityMap that interns location labels to dense integer ids (0 ... n - 1)
+    and stores connections in compressed sparse row (CSR) form; the neighbors of
+    location `i` are `targets[offsets[i]:offsets[i + 1]]` (in increasing order), with
+    the corresponding distances in `weights[offsets[i]:offsets[i + 1]]`.
+
+    Coordinates and connections live in flat typed arrays instead of per-location
+    dictionaries, which is several times smaller for large maps, and makes iterating
+    over the neighbors of a location a contiguous array scan.
+
+    For compatibility with code written against `CityMap` (e.g., `checkValid`,
+    `getTotalCost`, or `ShortestPathProblem`), `geoLocations`, `tags`, and `distances`
+    are read-only dictionary-like views keyed by location label.
+
+    Usage:
+        compactMap = cityMap.compact()
+        for nextLocation, distance in compactMap.distances[location].items(): ...
+    """
+    def __init__(
+        self,
+        labels: List[str],
+        latitudes: Sequence[float],
+        longitudes: Sequence[float],
+        offsets: Sequence[int],
+        targets: Sequence[int],
+        weights: Sequence[float],
+        nodeTags: Sequence[List[str]],
+        source: Optional[CityMap] = None,
+        shapes: Optional[Dict[Tuple[str, str], List[GeoLocation]]] = None,
+        labelIndex: Optional[Mapping[str, int]] = None,
+        tagTables: Optional["_TagTables"] = None,
+    ) -> None:
+        """
+        `labelIndex` and `tagTables` are only given for compiled maps (see
+        `loadCompiledMap`), whose labels and tag index live in the compiled file.
+        """
+        super().__init__()
+
+        # Location id <-> label
+        self.labels: Sequence[str] = labels
+        self.labelIndex: Mapping[str, int] = (
+            labelIndex if labelIndex is not None else {label: i for i, label in enumerate(labels)}
+        )
+
+        # Location id -> latitude/longitude (in degrees)
+        self.latitudes, self.longitudes = latitudes, longitudes
+
+        # CSR adjacency (see class docstring)
+        self.offsets, self.targets, self.weights = offsets, targets, weights
+
+        # Location id -> list of tags
+        self.nodeTags: Sequence[List[str]] = nodeTags
+        self.tagTables = tagTables
+
+        # Connection geometry (see `CityMap`)
+        self.shapes = shapes if shapes is not None else (source.shapes if source is not None else {})
+
+        # Inverted tag index (see `CityMap`); shared with the `source` map, if any (and
+        # left empty with `tagTables`, which answer tag queries instead)
+        if source is not None:
+            self.tagLocations, self.tagSets, self.tagKeys = (
+                source.tagLocations, source.tagSets, source.tagKeys
+            )
+        elif tagTables is None:
+            for label, tags in zip(labels, nodeTags):
+                for tag in tags:
+                    self._indexTag(label, tag)
+
+        # Read-only views that mirror the `CityMap` attributes
+        self.geoLocations = _GeoLocationsView(self)
+        self.tags = _TagsView(self)
+        self.distances = _DistancesView(self)
+        self._trigonometry: Optional[Tuple[array, array, array]] = None
+        self._straightLineFactor: Optional[float] = None
+
+    @classmethod
+    def fromCityMap(cls, cityMap: CityMap) -> "CompactCityMap":
+        """Build a compact snapshot of `cityMap`; tags (and their index) are shared."""
+        labels = list(cityMap.geoLocations)
+        labels += [label for label in cityMap.distances if label not in cityMap.geoLocations]
+        labelIndex = {label: i for i, label in enumerate(labels)}
+
+        latitudes, longitudes = array("d"), array("d")
+        for label in labels:
+            geo = cityMap.geoLocations.get(label)
+            latitudes.append(geo.latitude if geo is not None else float("nan"))
+            longitudes.append(geo.longitude if geo is not None else float("nan"))
+
+        offsets, targets, weights = array("q", [0]), array("i"), array("d")
+        for label in labels:
+            row = sorted(
+                (labelIndex[neighbor], distance)
+                for neighbor, distance in cityMap.distances.get(label, {}).items()
+            )
+            targets.extend(target for target, _ in row)
+            weights.extend(distance for _, distance in row)
+            offsets.append(len(targets))
+
+        nodeTags = [cityMap.tags.get(label, []) for label in labels]
+        return cls(
+            labels, latitudes, longitudes, offsets, targets, weights, nodeTags, source=cityMap
+        )
+
+    @property
+    def numLocations(self) -> int:
+        return len(self.labels)
+
+    def index(self, label: str) -> int:
+        """Return the integer id for the location `label`."""
+        return self.labelIndex[label]
+
+    def hasTag(self, label: str, tag: str) -> bool:
+        if self.tagTables is None:
+            return super().hasTag(label, tag)
+        location = self.labelIndex.get(label)
+        return location is not None and self.tagTables.hasTag(location, tag)
+
+    def locationsWithTag(self, tag: str) -> Tuple[str, ...]:
+        if self.tagTables is None:
+            return super().locationsWithTag(tag)
+        return self.tagTables.locationsWithTag(tag)
+
+    def locationsWithTagKey(self, key: str) -> List[str]:
+        if self.tagTables is None:
+            return super().locationsWithTagKey(key)
+        return self.tagTables.locationsWithTagKey(key)
+
+    def edge(self, source: int, target: int) -> int:
+        """Return the connection id of source --> target (location ids), or -1 if none."""
+        start, end = self.offsets[source], self.offsets[source + 1]
+        edge = bisect_left(self.targets, target, start, end)
+        return edge if edge < end and self.targets[edge] == target else -1
+
+    def neighbors(self, index: int) -> Iterator[Tuple[int, float]]:
+        """Iterate over (neighbor id, distance) pairs for the location with id `index`."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return zip(self.targets[start:end], self.weights[start:end])
+
+    def trigonometry(self) -> Tuple[array, array, array]:
+        """
+        Return (latitudes, longitudes, cosines of latitudes) of all locations in radians
+        (indexed by location id), computed once per map; see `StraightLineEvaluator`.
+        """
+        if self._trigonometry is None:
+            latitudes = np.radians(np.asarray(self.latitudes, dtype=float))
+            longitudes = np.radians(np.asarray(self.longitudes, dtype=float))
+            self._trigonometry = (
+                array("d", latitudes.tolist()),
+                array("d", longitudes.tolist()),
+                array("d", np.cos(latitudes).tolist()),
+            )
+        return self._trigonometry
+
+    def straightLineFactor(self) -> float:
+        """
+        Return the largest factor `f` <= 1 such that every connection is at least `f`
+        times the straight-line distance between its locations (computed once per
+        map). Straight-line distances times `f` never overestimate the cost of a path,
+        even on maps with connections shorter than that (e.g., grid maps, with 1m
+        connections between locations ~1.11m apart); `f` is 1 for real maps.
+        """
+        if self._straightLineFactor is None:
+            latitudes = np.asarray(self.latitudes, dtype=float)
+            longitudes = np.asarray(self.longitudes, dtype=float)
+            sources = np.repeat(np.arange(self.numLocations), np.diff(np.asarray(self.offsets)))
+            targets = np.asarray(self.targets, dtype=np.int64)
+            straightLines = computeConnectionDistances(
+                latitudes[sources], longitudes[sources], latitudes[targets], longitudes[targets]
+            )
+            # (Skip locations without coordinates, and locations at the same coordinates)
+            valid = straightLines > 0
+            ratios = np.asarray(self.weights, dtype=float)[valid] / straightLines[valid]
+            self._straightLineFactor = float(min(1.0, ratios.min(initial=1.0)))
+        return self._straightLineFactor
+
+    def compact(self) -> "CompactCityMap":
+        return self
+
+    # (Change the source `CityMap` instead, and call `compact()` again)
+    def addLocation(self, label: str, location: GeoLocation, tags: List[str]) -> None:
+        raise TypeError("CompactCityMap is read-only!")
+
+    def addTag(self, label: str, tag: str) -> None:
+        raise TypeError("CompactCityMap is read-only!")
+
+    def addConnection(
+        self, source: str, target: str, distance: Optional[float] = None
+    ) -> None:
+        raise TypeError("CompactCityMap is read-only!")
+
+    def addConnections(
+        self, connections: Sequence[Tuple[str, str]], distances: Optional[Sequence[float]] = None
+    ) -> None:
+        raise TypeError("CompactCityMap is read-only!")
+
+    def updateConnections(
+        self, updates: Sequence[Tuple[str, str, float]], symmetric: bool = True
+    ) -> List[ConnectionUpdate]:
+        raise TypeError("CompactCityMap is read-only!")
+
+
+# Read-only views used by `CompactCityMap`; like the `defaultdict`s in `CityMap`,
+# looking up an unknown label in `tags` or `distances` returns an empty value (but
+# unlike a `defaultdict`, nothing is inserted).
+class _GeoLocationsView(Mapping):
+    def __init__(self, compactMap: CompactCityMap) -> None:
+        self._map = compactMap
+
+    def __getitem__(self, label: str) -> GeoLocation:
+        index = self._map.labelIndex[label]
+        return GeoLocation(self._map.latitudes[index], self._map.longitudes[index])
+
+    def __contains__(self, label: object) -> bool:
+        return label in self._map.labelIndex
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._map.labels)
+
+    def __len__(self) -> int:
+        return len(self._map.labels)
+
+
+class _TagsView(Mapping):
+    def __init__(self, compactMap: CompactCityMap) -> None:
+        self._map = compactMap
+
+    def __getitem__(self, label: str) -> List[str]:
+        index = self._map.labelIndex.get(label)
+        return self._map.nodeTags[index] if index is not None else []
+
+    def __contains__(self, label: object) -> bool:
+        return label in self._map.labelIndex
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._map.labels)
+
+    def __len__(self) -> int:
+        return len(self._map.labels)
+
+
+class _DistancesView(Mapping):
+    def __init__(self, compactMap: CompactCityMap) -> None:
+        self._map = compactMap
+
+    def __getitem__(self, label: str) -> "_DistancesRow":
+        index = self._map.labelIndex.get(label)
+        if index is None:
+            return _DistancesRow(self._map, 0, 0)
+        return _DistancesRow(self._map, self._map.offsets[index], self._map.offsets[index + 1])
+
+    def __contains__(self, label: object) -> bool:
+        return label in self._map.labelIndex
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._map.labels)
+
+    def __len__(self) -> int:
+        return len(self._map.labels)
+
+
+class _DistancesRow(Mapping):
+    """Adjacent location label -> distance, for a single row of the CSR arrays."""
+    __slots__ = ("_map", "_start", "_end")
+
+    def __init__(self, compactMap: CompactCityMap, start: int, end: int) -> None:
+        self._map, self._start, self._end = compactMap, start, end
+
+    def __getitem__(self, label: str) -> float:
+        index = self._map.labelIndex.get(label)
+        if index is not None:
+            edge = bisect_left(self._map.targets, index, self._start, self._end)
+            if edge < self._end and self._map.targets[edge] == index:
+                return self._map.weights[edge]
+        raise KeyError(label)
+
+    def __iter__(self) -> Iterator[str]:
+        labels = self._map.labels
+        return (labels[target] for target in self._map.targets[self._start:self._end])
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def items(self) -> List[Tuple[str, float]]:
+        labels, start, end = self._map.labels, self._start, self._end
+        return [
+            (labels[target], weight)
+            for target, weight in zip(self._map.targets[start:end], self._map.weights[start:end])
+        ]
+
+
+class SpatialIndex:
+    """
+    Uniform grid over the latitude/longitude of a set of locations in a `CityMap`
+    (all locations by default). Coordinates are kept in NumPy arrays sorted by grid
+    cell, so that a query only computes (vectorized) distances to locations in the
+    handful of cells that overlap the query radius.
+
+    Usage:
+        index = cityMap.spatialIndex()
+        label, distance = index.nearest(GeoLocation(37.3375, -121.8901), maxDistance=250)
+    """
+    def __init__(
+        self,
+        cityMap: CityMap,
+        labels: Optional[List[str]] = None,
+        cellMeters: float = 100.0,
+    ) -> None:
+        labels = list(cityMap.geoLocations) if labels is None else list(labels)
+        latitudes = np.array([cityMap.geoLocations[label].latitude for label in labels], dtype=float)
+        longitudes = np.array([cityMap.geoLocations[label].longitude for label in labels], dtype=float)
+
+        # Grid cells are `cellMeters` tall, and (roughly) square at the mean latitude.
+        self.cellMeters = cellMeters
+        self.cellLatitude = degrees(cellMeters / RADIUS_EARTH)
+        meanLatitude = float(np.mean(latitudes)) if len(labels) > 0 else 0.0
+        self.cellLongitude = self.cellLatitude / max(cos(radians(meanLatitude)), 1e-6)
+        self.originLatitude = float(np.min(latitudes)) if len(labels) > 0 else 0.0
+        self.originLongitude = float(np.min(longitudes)) if len(labels) > 0 else 0.0
+
+        # Sort locations by cell key (= row * numColumns + column), so that each row of
+        # cells in a query is a contiguous range of the arrays.
+        rows, columns = self._cells(latitudes, longitudes)
+        self.numColumns = int(columns.max()) + 1 if len(labels) > 0 else 1
+        keys = rows * self.numColumns + columns
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.labels: List[str] = [labels[i] for i in order]
+        self.latitudes, self.longitudes = latitudes[order], longitudes[order]
+
+    def _cells(self, latitudes: np.ndarray, longitudes: np.ndarray):
+        rows = np.floor((latitudes - self.originLatitude) / self.cellLatitude).astype(np.int64)
+        columns = np.floor((longitudes - self.originLongitude) / self.cellLongitude).astype(np.int64)
+        return rows, columns
+
+    def _candidates(self, geo: GeoLocation, radius: float) -> np.ndarray:
+        """Return indices of all locations in grid cells that might be within `radius`."""
+        deltaLatitude = degrees(radius / RADIUS_EARTH)
+        maxLatitude = max(abs(geo.latitude - deltaLatitude), abs(geo.latitude + deltaLatitude))
+        if maxLatitude >= 89.0 or deltaLatitude >= 45.0:
+            return np.arange(len(self.labels))
+
+        # A little slack, since a great circle is (slightly) shorter than a parallel
+        deltaLongitude = 1.01 * degrees(radius / (RADIUS_EARTH * cos(radians(maxLatitude))))
+        (minRow, maxRow), (minColumn, maxColumn) = self._cells(
+            np.array([geo.latitude - deltaLatitude, geo.latitude + deltaLatitude]),
+            np.array([geo.longitude - deltaLongitude, geo.longitude + deltaLongitude]),
+        )
+        minColumn, maxColumn = max(minColumn, 0), min(maxColumn, self.numColumns - 1)
+        if minColumn > maxColumn:
+            return np.arange(0)
+
+        rowKeys = np.arange(minRow, maxRow + 1) * self.numColumns
+        starts = np.searchsorted(self.keys, rowKeys + minColumn, side="left")
+        ends = np.searchsorted(self.keys, rowKeys + maxColumn, side="right")
+        return np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+
+    def _distances(self, geo: GeoLocation, indices: np.ndarray) -> np.ndarray:
+        return computeDistances(
+            geo.latitude, geo.longitude, self.latitudes[indices], self.longitudes[indices]
+        )
+
+    def within(self, geo: GeoLocation, radius: float) -> List[Tuple[str, float]]:
+        """Return all (label, distance) within `radius` meters of `geo`, nearest first."""
+        indices = self._candidates(geo, radius)
+        distances = self._distances(geo, indices)
+        found = sorted(
+            (distance, self.labels[index])
+            for index, distance in zip(indices.tolist(), distances.tolist())
+            if distance <= radius
+        )
+        return [(label, distance) for distance, label in found]
+
+    def nearest(
+        self, geo: GeoLocation, maxDistance: Optional[float] = None
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Return (label, distance) for the location closest to `geo` (ties are broken by
+        label), or None if there's no location within `maxDistance` meters. Without a
+        `maxDistance`, the closest location is always returned (however far it is).
+        """
+        if len(self.labels) == 0:
+            return None
+
+        # Without a maximum distance, search within a radius that doubles until it
+        # contains at least one location, or until every location is a candidate (in
+        # which case the closest one is among them, even if it's beyond the radius).
+        radius = maxDistance if maxDistance is not None else self.cellMeters
+        while True:
+            indices = self._candidates(geo, radius)
+            distances = self._distances(geo, indices)
+            if maxDistance is None and len(indices) == len(self.labels):
+                inside = np.ones(len(indices), dtype=bool)
+                break
+            inside = distances <= radius
+            if inside.any() or maxDistance is not None:
+                break
+            radius *= 2
+
+        if not inside.any():
+            return None
+        bestDistance = float(distances[inside].min())
+        bestLabel = min(
+            self.labels[index]
+            for index, distance in zip(indices.tolist(), distances.tolist())
+            if distance == bestDistance
+        )
+        return bestLabel, bestDistance
+
+
+class TravelTimeProfiles:
+    """
+    Time-dependent travel times (in seconds) for the connections of a `CityMap`; the
+    travel time of a connection is a piecewise-linear function of the departure time
+    (in seconds, e.g., since midnight), given by its breakpoints, and constant before
+    the first and after the last breakpoint. Connections without breakpoints take
+    `distance / speed` at any time.
+
+    Breakpoints are stored in flat arrays indexed by the connection ids of
+    `cityMap.compact()` (in the same CSR layout as its connections): the breakpoints
+    of connection `e` are `times[pointOffsets[e]:pointOffsets[e + 1]]`, with the
+    corresponding travel times in `travelTimes[pointOffsets[e]:pointOffsets[e + 1]]`.
+
+    Every function must satisfy the "FIFO" property (leaving later never means
+    arriving earlier), i.e., travel times never decrease faster than time passes.
+
+    Usage:
+        rushHour = ([7 * 3600, 8 * 3600, 9 * 3600], [60.0, 180.0, 60.0])
+        profiles = TravelTimeProfiles(cityMap, {(source, target): rushHour})
+        arrival = departure + profiles.travelTime(profiles.edge(source, target), departure)
+    """
+    def __init__(
+        self,
+        cityMap: CityMap,
+        profiles: Optional[Mapping[Tuple[str, str], Tuple[Sequence[float], Sequence[float]]]] = None,
+        speed: float = 1.4,
+    ) -> None:
+        """
+        :param profiles: (source, target) -> (departure times, travel times), with
+                         departure times in increasing order.
+        :param speed: Speed (in meters/second; ~walking speed by default) for the
+                      connections without breakpoints.
+        """
+        self.graph: CompactCityMap = cityMap.compact()
+        self.speed = speed
+
+        byEdge: Dict[int, Tuple[Sequence[float], Sequence[float]]] = {}
+        for (source, target), (times, travelTimes) in (profiles or {}).items():
+            if len(times) != len(travelTimes):
+                raise ValueError(f"{source} --> {target}: {len(times)} times but {len(travelTimes)} travel times")
+            for i in range(len(times) - 1):
+                if times[i + 1] <= times[i]:
+                    raise ValueError(f"{source} --> {target}: departure times must be increasing")
+                if travelTimes[i + 1] - travelTimes[i] < times[i] - times[i + 1]:
+                    raise ValueError(f"{source} --> {target}: travel times violate FIFO at {times[i]}")
+            byEdge[self.edge(source, target)] = (times, travelTimes)
+
+        self.pointOffsets, self.times, self.travelTimes = array("q", [0]), array("d"), array("d")
+        for edge in range(len(self.graph.targets)):
+            times, travelTimes = byEdge.get(edge, ((), ()))
+            self.times.extend(times)
+            self.travelTimes.extend(travelTimes)
+            self.pointOffsets.append(len(self.times))
+
+        # Fastest speed over any connection (at any time); distance / `maxSpeed` is a
+        # lower bound on the travel time between two locations
+        self.maxSpeed = speed
+        for edge, (_, travelTimes) in byEdge.items():
+            distance, fastest = self.graph.weights[edge], min(travelTimes, default=float("inf"))
+            if distance > 0:
+                self.maxSpeed = max(self.maxSpeed, distance / fastest if fastest > 0 else float("inf"))
+
+    @classmethod
+    def fromCongestion(
+        cls,
+        cityMap: CityMap,
+        times: Sequence[float],
+        factors: Sequence[float],
+        connections: Optional[Sequence[Tuple[str, str]]] = None,
+        speed: float = 1.4,
+    ) -> "TravelTimeProfiles":
+        """
+        Scale the free-flow travel time (`distance / speed`) of `connections` (all of
+        them by default) by a piecewise-linear `factors` of the departure time, e.g.,
+            TravelTimeProfiles.fromCongestion(cityMap, [7 * 3600, 8 * 3600, 9 * 3600], [1, 3, 1])
+        """
+        graph = cityMap.compact()
+        if connections is None:
+            connections = [
+                (graph.labels[location], graph.labels[graph.targets[edge]])
+                for location in range(graph.numLocations)
+                for edge in range(graph.offsets[location], graph.offsets[location + 1])
+            ]
+        profiles = {}
+        for source, target in connections:
+            freeFlow = graph.distances[source][target] / speed
+            profiles[(source, target)] = (times, [freeFlow * factor for factor in factors])
+        return cls(cityMap, profiles, speed)
+
+    def edge(self, source: str, target: str) -> int:
+        """Return the connection id of source --> target."""
+        edge = self.graph.edge(self.graph.index(source), self.graph.index(target))
+        if edge == -1:
+            raise KeyError(f"No connection {source} --> {target}")
+        return edge
+
+    def travelTime(self, edge: int, departure: float) -> float:
+        """Travel time (in seconds) over connection `edge`, leaving at `departure`."""
+        start, end = self.pointOffsets[edge], self.pointOffsets[edge + 1]
+        if start == end:
+            return self.graph.weights[edge] / self.speed
+        times, travelTimes = self.times, self.travelTimes
+        i = bisect_right(times, departure, start, end)
+        if i == start:
+            return travelTimes[start]
+        if i == end:
+            return travelTimes[end - 1]
+        fraction = (departure - times[i - 1]) / (times[i] - times[i - 1])
+        return travelTimes[i - 1] + fraction * (travelTimes[i] - travelTimes[i - 1])
+
+    def breakpoints(self, edge: int) -> Tuple[array, array]:
+        """(departure times, travel times) of connection `edge` (empty if constant)."""
+        start, end = self.pointOffsets[edge], self.pointOffsets[edge + 1]
+        return self.times[start:end], self.travelTimes[start:end]
 
 
 def addLandmarks(
@@ -92,24 +829,35 @@ def addLandmarks(
     may not *exactly* line up with existing locations in the CityMap, so instead we map
     a given landmark onto the closest existing location (subject to a max tolerance).
     """
+    for label, tag in landmarkTags(cityMap, landmarkPath, toleranceMeters):
+        cityMap.addTag(label, tag)
+
+
+def landmarkTags(
+    cityMap: CityMap, landmarkPath: str, toleranceMeters: float = 250.0
+) -> List[Tuple[str, str]]:
+    """
+    Return the (label, tag) pairs that `addLandmarks` adds to `cityMap` (without
+    changing it; e.g., for a read-only `CompactCityMap`).
+    """
     with open(landmarkPath) as f:
         landmarks = json.load(f)
 
     # Iterate through landmarks and map onto the closest location in `cityMap`
+    spatialIndex = cityMap.spatialIndex()
+    tags = []
     for item in landmarks:
         latitudeString, longitudeString = item["geo"].split(",")
         geo = GeoLocation(float(latitudeString), float(longitudeString))
 
-        # Find the closest location by searching over all locations in `cityMap`
-        bestDistance, bestLabel = min(
-            (computeDistance(geo, existingGeo), existingLabel)
-            for existingLabel, existingGeo in cityMap.geoLocations.items()
-        )
-
-        if bestDistance < toleranceMeters:
+        # Find the closest location (within tolerance) using the spatial index
+        closest = spatialIndex.nearest(geo, maxDistance=toleranceMeters)
+        if closest is not None and closest[1] < toleranceMeters:
+            bestLabel, _ = closest
             for key in ["landmark", "amenity"]:
                 if key in item:
-                    cityMap.tags[bestLabel].append(makeTag(key, item[key]))
+                    tags.append((bestLabel, makeTag(key, item[key])))
+    return tags
 
 ########################################################################################
 # Utility Functions
@@ -121,9 +869,7 @@ def makeTag(key: str, value: str) -> str:
 
 
 def locationFromTag(tag: str, cityMap: CityMap) -> Optional[str]:
-    possibleLocations = sorted(
-        [location for location, tags in cityMap.tags.items() if tag in tags]
-    )
+    possibleLocations = cityMap.locationsWithTag(tag)
     return possibleLocations[0] if len(possibleLocations) > 0 else None
 
 
@@ -162,6 +908,123 @@ def computeDistance(geo1: GeoLocation, geo2: GeoLocation) -> float:
     return 2 * RADIUS_EARTH * asin(sqrt(haversine))
 
 
+def computeDistances(
+    latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray
+) -> np.ndarray:
+    """
+    Vectorized version of `computeDistance`; returns the distances (in meters) from
+    (`latitude`, `longitude`) to each of the points (`latitudes`, `longitudes`), all
+    specified in degrees.
+    """
+    return computeConnectionDistances(latitude, longitude, latitudes, longitudes)
+
+
+def computeConnectionDistances(
+    latitudes1: np.ndarray, longitudes1: np.ndarray, latitudes2: np.ndarray, longitudes2: np.ndarray
+) -> np.ndarray:
+    """
+    Vectorized version of `computeDistance`; returns the distances (in meters) between
+    corresponding points, i.e., from (`latitudes1[i]`, `longitudes1[i]`) to
+    (`latitudes2[i]`, `longitudes2[i]`), all specified in degrees. Arguments are
+    broadcast against each other, so either side may also be a single point.
+    """
+    lon1, lat1 = np.radians(longitudes1), np.radians(latitudes1)
+    lon2, lat2 = np.radians(longitudes2), np.radians(latitudes2)
+
+    # Haversine formula
+    deltaLon, deltaLat = lon2 - lon1, lat2 - lat1
+    haversine = (np.sin(deltaLat / 2) ** 2) + (np.cos(lat1) * np.cos(lat2)) * (
+        np.sin(deltaLon / 2) ** 2
+    )
+    return 2 * RADIUS_EARTH * np.arcsin(np.sqrt(np.minimum(haversine, 1.0)))
+
+
+class StraightLineEvaluator:
+    """
+    Straight-line distance from any location of a map to the nearest of a fixed set
+    of `targets` (e.g., the end locations of a search problem).
+
+    Calling `computeDistance` for every target converts both points to radians and
+    takes their cosines on every call. Here, radians and cosines are computed once per
+    map (see `CompactCityMap.trigonometry`) and once per target. Since the Haversine
+    distance increases with the (inner) haversine term, we also only take the square
+    root and arcsine of the smallest one.
+
+    With many targets, a `SpatialIndex` over the targets narrows down the candidates:
+    for each grid cell (computed on first use), only targets within `D + 2r` of the
+    cell's center can be the nearest target of a location in the cell, where `D` is
+    the distance from the center to its nearest target, and `r` the distance from the
+    center to the cell's corners (by the triangle inequality). Each call then only
+    checks the (few) candidates of a single cell, regardless of the number of targets.
+
+    Usage:
+        evaluator = StraightLineEvaluator(cityMap, cityMap.locationsWithTag(endTag))
+        distance = evaluator.distance(location)
+    """
+    # With more targets than this, only check the candidates of each grid cell
+    SPATIAL_INDEX_THRESHOLD = 16
+
+    def __init__(self, cityMap: CityMap, targets: Sequence[str], cellMeters: float = 100.0):
+        self.graph = cityMap.compact()
+        self.latitudes, self.longitudes, self.cosines = self.graph.trigonometry()
+
+        targetIds = [self.graph.index(label) for label in targets]
+        self.targets = [
+            (self.latitudes[target], self.longitudes[target], self.cosines[target])
+            for target in targetIds
+        ]
+
+        # Grid cell (row, column) -> candidate targets
+        self.index: Optional[SpatialIndex] = None
+        self.cellCandidates: Dict[Tuple[int, int], List[Tuple[float, float, float]]] = {}
+        if len(self.targets) > self.SPATIAL_INDEX_THRESHOLD:
+            self.index = SpatialIndex(self.graph, list(targets), cellMeters)
+
+    def _candidates(self, cell: Tuple[int, int]) -> List[Tuple[float, float, float]]:
+        index, (row, column) = self.index, cell
+        south = index.originLatitude + row * index.cellLatitude
+        west = index.originLongitude + column * index.cellLongitude
+        center = GeoLocation(south + index.cellLatitude / 2, west + index.cellLongitude / 2)
+        cornerDistance = max(
+            computeDistance(center, GeoLocation(latitude, longitude))
+            for latitude in (south, south + index.cellLatitude)
+            for longitude in (west, west + index.cellLongitude)
+        )
+
+        # (A millimeter of slack for floating point error)
+        _, nearestDistance = index.nearest(center)
+        labels = index.within(center, nearestDistance + 2 * cornerDistance + 1e-3)
+        candidates = [
+            (self.latitudes[target], self.longitudes[target], self.cosines[target])
+            for target in (self.graph.index(label) for label, _ in labels)
+        ]
+        self.cellCandidates[cell] = candidates
+        return candidates
+
+    def distance(self, label: str) -> float:
+        """Distance (in meters) from `label` to the nearest target (`inf` if none)."""
+        if len(self.targets) == 0:
+            return float("inf")
+        location = self.graph.labelIndex[label]
+        lat1, lon1, cos1 = self.latitudes[location], self.longitudes[location], self.cosines[location]
+
+        candidates = self.targets
+        if self.index is not None:
+            cell = (
+                floor((self.graph.latitudes[location] - self.index.originLatitude) / self.index.cellLatitude),
+                floor((self.graph.longitudes[location] - self.index.originLongitude) / self.index.cellLongitude),
+            )
+            candidates = self.cellCandidates.get(cell)
+            if candidates is None:
+                candidates = self._candidates(cell)
+
+        haversine = float("inf")
+        for lat2, lon2, cos2 in candidates:
+            sinLat, sinLon = sin((lat2 - lat1) / 2), sin((lon2 - lon1) / 2)
+            haversine = min(haversine, sinLat * sinLat + cos1 * cos2 * sinLon * sinLon)
+        return 2 * RADIUS_EARTH * asin(sqrt(min(haversine, 1.0)))
+
+
 def checkValid(
     path: List[str],
     cityMap: CityMap,
@@ -276,6 +1139,26 @@ def createGridMapWithCustomTags(width: int, height: int, tags: Dict[Tuple[int,in
 
     return cityMap
 
+def isWalkable(w: osm.Way) -> bool:
+    """Return whether the `osm.Way` is accessible on foot."""
+    #   =>> Reference: https://github.com/Tristramg/osm4routing2
+    #                  See -> `src/osm4routing/categorize.rs#L96`
+    pathType = w.tags.get("highway", None)
+    if pathType is None or pathType in {
+        "motorway",
+        "motorway_link",
+        "trunk",
+        "trunk_link",
+    }:
+        return False
+    elif (
+        w.tags.get("pedestrian", "n/a") == "no"
+        or w.tags.get("foot", "n/a") == "no"
+    ):
+        return False
+    return True
+
+
 def readMap(osmPath: str) -> CityMap:
     """
     Create a CityMap given a path to a OSM `.pbf` file; uses the osmium package to do
@@ -303,20 +1186,7 @@ def readMap(osmPath: str) -> CityMap:
             """An `osm.Way` contains an ordered list of connected nodes."""
 
             # We only include "ways" that are accessible on foot
-            #   =>> Reference: https://github.com/Tristramg/osm4routing2
-            #                  See -> `src/osm4routing/categorize.rs#L96`
-            pathType = w.tags.get("highway", None)
-            if pathType is None or pathType in {
-                "motorway",
-                "motorway_link",
-                "trunk",
-                "trunk_link",
-            }:
-                return
-            elif (
-                w.tags.get("pedestrian", "n/a") == "no"
-                or w.tags.get("foot", "n/a") == "no"
-            ):
+            if not isWalkable(w):
                 return
 
             # Otherwise, iterate through all nodes along the "way"...
@@ -347,13 +1217,196 @@ def readMap(osmPath: str) -> CityMap:
             nodeLabel, mapCreator.nodes[nodeLabel], tags=mapCreator.tags[nodeLabel]
         )
 
-    # When adding connections, don't pass distance flag (automatically compute!)
-    for src, tgt in mapCreator.edges:
-        cityMap.addConnection(src, tgt)
+    # When adding connections, don't pass distances (automatically computed, in batch!)
+    cityMap.addConnections(list(mapCreator.edges))
 
     return cityMap
 
 
+def readRoutableMap(
+    osmPath: str, simplifyChains: bool = False, landmarkPath: Optional[str] = None
+) -> CompactCityMap:
+    """
+    Memory-efficient alternative to `readMap` for large `.pbf` files, which streams
+    through the file twice and directly builds a `CompactCityMap`:
+        1. Read only the walkable ways, keeping their node ids in a flat array.
+        2. Read only the nodes referenced by those ways, keeping their coordinates (in
+           flat arrays) and tags; all other nodes are skipped.
+
+    Without `simplifyChains`, the result has the same locations, tags, and connections
+    as `readMap` (followed by `addLandmarks`, given a `landmarkPath`). With
+    `simplifyChains`, every untagged location with exactly two neighbors is removed,
+    and the chain of connections through it is merged into a single connection (with
+    the summed distance); the geometry of removed locations is kept in `shapes` for
+    plotting (see `CityMap.connectionShape`). Landmarks are snapped before chains are
+    collapsed, so the locations they snap onto are kept.
+
+    :param osmPath: Path to `.pbf` file defining a set of locations and connections.
+    :param simplifyChains: Whether to collapse chains of degree-2 locations.
+    :param landmarkPath: (Optional) path to `.json` file defining a set of landmarks
+                         (see `addLandmarks`; the result is read-only).
+    :return A (read-only) CompactCityMap, built using the OpenStreetMaps data.
+    """
+    class WayHandler(osmium.SimpleHandler):
+        def __init__(self) -> None:
+            super().__init__()
+            self.wayNodes = array("q")  # Node ids of all walkable ways, back to back
+            self.wayOffsets = array("q", [0])
+
+        def way(self, w: osm.Way) -> None:
+            if isWalkable(w):
+                self.wayNodes.extend(node.ref for node in w.nodes)
+                self.wayOffsets.append(len(self.wayNodes))
+
+    class NodeHandler(osmium.SimpleHandler):
+        def __init__(self, nodeIds: np.ndarray) -> None:
+            super().__init__()
+            self.nodeIds = nodeIds  # Sorted, so that node ids are found by binary search
+            self.latitudes = array("d", [float("nan")]) * len(nodeIds)
+            self.longitudes = array("d", [float("nan")]) * len(nodeIds)
+            self.tags: Dict[int, List[str]] = {}
+
+        def node(self, n: osm.Node) -> None:
+            index = int(np.searchsorted(self.nodeIds, n.id))
+            if index < len(self.nodeIds) and self.nodeIds[index] == n.id and n.location.valid():
+                self.latitudes[index], self.longitudes[index] = n.location.lat, n.location.lon
+                if len(n.tags) > 0:
+                    self.tags[index] = [makeTag(tag.k, tag.v) for tag in n.tags]
+
+    # Pass 1 :: ways (node ids only)
+    wayHandler = WayHandler()
+    wayHandler.apply_file(osmPath)
+    wayNodes, wayOffsets = np.frombuffer(wayHandler.wayNodes, dtype=np.int64), wayHandler.wayOffsets
+    nodeIds = np.unique(wayNodes)
+
+    # Pass 2 :: coordinates and tags of referenced nodes only
+    nodeHandler = NodeHandler(nodeIds)
+    nodeHandler.apply_file(osmPath)
+    latitudes = np.frombuffer(nodeHandler.latitudes, dtype=np.float64)
+    longitudes = np.frombuffer(nodeHandler.longitudes, dtype=np.float64)
+
+    # Consecutive nodes along each way are connected (skipping the last node of each way,
+    # missing nodes, and pairs of nodes at the same location)
+    wayIndices = np.searchsorted(nodeIds, wayNodes)
+    isWayEnd = np.zeros(len(wayNodes), dtype=bool)
+    isWayEnd[np.frombuffer(wayOffsets, dtype=np.int64)[1:] - 1] = True
+    sources, targets = wayIndices[:-1], wayIndices[1:]
+    keep = ~isWayEnd[:-1]
+    keep &= ~(np.isnan(latitudes[sources]) | np.isnan(latitudes[targets]))
+    keep &= (latitudes[sources] != latitudes[targets]) | (longitudes[sources] != longitudes[targets])
+    sources, targets = sources[keep], targets[keep]
+
+    # Renumber so that only connected locations are kept, and add both directions
+    used = np.unique(np.concatenate([sources, targets]))
+    renumber = np.full(len(nodeIds), -1, dtype=np.int64)
+    renumber[used] = np.arange(len(used))
+    sources, targets = renumber[sources], renumber[targets]
+    pairs = np.unique(
+        np.stack([np.concatenate([sources, targets]), np.concatenate([targets, sources])], axis=1),
+        axis=0,
+    )
+    sources, targets = pairs[:, 0], pairs[:, 1]
+    latitudes, longitudes = latitudes[used], longitudes[used]
+
+    labels = [str(nodeId) for nodeId in nodeIds[used].tolist()]
+    nodeTags = [
+        [makeTag("label", label)] + nodeHandler.tags.get(oldIndex, [])
+        for label, oldIndex in zip(labels, used.tolist())
+    ]
+    weights = computeConnectionDistances(
+        latitudes[sources], longitudes[sources], latitudes[targets], longitudes[targets]
+    ).tolist()
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(labels)))])
+
+    arrays = (
+        array("d", latitudes.tolist()),
+        array("d", longitudes.tolist()),
+        array("q", offsets.tolist()),
+        array("i", targets.tolist()),
+        array("d", weights),
+    )
+    compactMap = CompactCityMap(labels, *arrays, nodeTags)
+    if landmarkPath is not None:
+        for label, tag in landmarkTags(compactMap, landmarkPath):
+            nodeTags[compactMap.labelIndex[label]].append(tag)
+        compactMap = CompactCityMap(labels, *arrays, nodeTags)
+    return _simplifyChains(compactMap) if simplifyChains else compactMap
+
+
+def _simplifyChains(compactMap: CompactCityMap) -> CompactCityMap:
+    """Collapse chains of untagged, degree-2 locations (see `readRoutableMap`)."""
+    offsets, targets, weights = compactMap.offsets, compactMap.targets, compactMap.weights
+    numLocations = compactMap.numLocations
+    removable = [
+        offsets[i + 1] - offsets[i] == 2 and len(compactMap.nodeTags[i]) == 1
+        for i in range(numLocations)
+    ]
+
+    # (kept source, kept target) -> (distance, [removed locations along the way])
+    chains: Dict[Tuple[int, int], Tuple[float, List[int]]] = {}
+    visited = bytearray(numLocations)
+
+    def walkFrom(source: int) -> None:
+        for edge in range(offsets[source], offsets[source + 1]):
+            previous, current, distance, inner = source, targets[edge], weights[edge], []
+            while removable[current] and current != source:
+                visited[current] = 1
+                inner.append(current)
+                first, second = offsets[current], offsets[current] + 1
+                nextEdge = first if targets[first] != previous else second
+                previous, current = current, targets[nextEdge]
+                distance += weights[nextEdge]
+            if current != source and distance < chains.get((source, current), (float("inf"),))[0]:
+                chains[(source, current)] = (distance, inner)
+
+    for location in range(numLocations):
+        if not removable[location]:
+            walkFrom(location)
+
+    # Cycles made entirely of removable locations :: keep one location per cycle
+    for location in range(numLocations):
+        if removable[location] and not visited[location]:
+            removable[location] = False
+            walkFrom(location)
+
+    # Each chain was walked from both ends, and the distances summed in opposite orders
+    # may differ in the last bits; use the sum from the smaller location id both ways
+    for (source, target), (distance, inner) in chains.items():
+        if source < target and (target, source) in chains:
+            chains[(target, source)] = (distance, inner[::-1])
+
+    # Rebuild the CSR arrays over the kept locations
+    kept = [location for location in range(numLocations) if not removable[location]]
+    newIndex = {location: i for i, location in enumerate(kept)}
+    outgoing: List[List[Tuple[int, float]]] = [[] for _ in kept]
+    shapes: Dict[Tuple[str, str], List[GeoLocation]] = {}
+    labels = compactMap.labels
+    for (source, target), (distance, inner) in chains.items():
+        outgoing[newIndex[source]].append((newIndex[target], distance))
+        if len(inner) > 0:
+            shapes[(labels[source], labels[target])] = [
+                GeoLocation(compactMap.latitudes[i], compactMap.longitudes[i]) for i in inner
+            ]
+
+    newOffsets, newTargets, newWeights = array("q", [0]), array("i"), array("d")
+    for edges in outgoing:
+        for target, distance in sorted(edges):
+            newTargets.append(target)
+            newWeights.append(distance)
+        newOffsets.append(len(newTargets))
+
+    return CompactCityMap(
+        [labels[location] for location in kept],
+        array("d", [compactMap.latitudes[location] for location in kept]),
+        array("d", [compactMap.longitudes[location] for location in kept]),
+        newOffsets,
+        newTargets,
+        newWeights,
+        [compactMap.nodeTags[location] for location in kept],
+        shapes=shapes,
+    )
+
+
 def printMap(cityMap: CityMap):
     """Display a dense overview of the provided map, with tags for each location."""
     for label in cityMap.geoLocations:
@@ -363,26 +1416,345 @@ def printMap(cityMap: CityMap):
             print(f"  -> {label2} [distance = {distance}]")
 
 
-def createSanJoseMap() -> CityMap:
-    cityMap = readMap("data/sanjose.pbf")
-    addLandmarks(cityMap, "data/sanjose-landmarks.json")
-    return cityMap
+def createSanJoseMap(cacheDir: Optional[str] = None) -> CityMap:
+    return createCustomMap("data/sanjose.pbf", "data/sanjose-landmarks.json", cacheDir)
 
-def createCustomMap(map_file: str, landmarks_file: str) -> CityMap:
+def createCustomMap(
+    map_file: str, landmarks_file: str, cacheDir: Optional[str] = None, lowMemory: bool = False
+) -> CityMap:
     """
     Create a CityMap given a path to an OSM `.pbf` file; uses the osmium package to do
     any/all processing of discrete locations and connections between them.
     
     :param map_file: Path to `.pbf` file defining a set of locations and connections.
     :param landmarks_file: Path to `.json` file defining a set of landmarks.
+    :param cacheDir: (Optional) directory for compiled maps; if provided, returns a
+                     (read-only) `CompactCityMap` loaded via `loadCachedMap`.
+    :param lowMemory: Whether to parse `map_file` with `readRoutableMap` (for large
+                      maps); returns a (read-only) `CompactCityMap`.
     
     For further details on the format of the `.pbf` and `.json` files, see the README.md file.
     """
+    if cacheDir is not None:
+        return loadCachedMap(map_file, landmarks_file, cacheDir, lowMemory)
+    if lowMemory:
+        return readRoutableMap(map_file, landmarkPath=landmarks_file)
     cityMap = readMap(map_file)
     addLandmarks(cityMap, landmarks_file)
     return cityMap
 
 
+########################################################################################
+# Compiled Map Cache -- parsing a `.pbf` file (and snapping landmarks) takes much longer
+# than reading the resulting `CompactCityMap` back from a binary file. A compiled map
+# file has the following layout:
+#
+#   - `MAP_FILE_MAGIC`, then the length of the JSON header (8 bytes, little-endian).
+#   - JSON header: format version, cache key, byte order, counts, and the (offset, size)
+#                  of each section relative to the start of the data (8-byte aligned).
+#   - Sections (raw arrays or UTF-8 bytes):
+#       + latitudes/longitudes/offsets/targets/weights (see `CompactCityMap`)
+#       + labels: a `StringTable` over the location labels, in location id order
+#       + tags: a `StringTable` over the distinct tags (sorted), the tag ids of each
+#               location (in CSR form, in their original order), and the location ids
+#               with each tag (in CSR form, sorted by label); see `_TagTables`
+#       + shapes: JSON list of (source, target, [[latitude, longitude], ...])
+#
+# Everything but the (usually empty) shapes is read through `mmap`, so worker processes
+# that load the same file share the underlying memory pages (via the OS page cache)
+# rather than each decoding the labels and tags, and building indices over them.
+#
+# Bump `MAP_FORMAT_VERSION` whenever the layout changes, or the way `readMap` and
+# `addLandmarks` build maps changes; it is part of the cache key (see `mapCacheKey`).
+
+MAP_FILE_MAGIC = b"CITYMAP2"
+MAP_FORMAT_VERSION = 3
+
+
+class StringTable(Sequence):
+    """
+    Read-only table of strings 0 ... n - 1, stored back to back as UTF-8 in `data` (the
+    bytes of string `i` are `data[offsets[i]:offsets[i + 1]]`), with an open-addressing
+    hash table `slots` (CRC-32 of the UTF-8 bytes, linear probing, -1 :: empty slot) to
+    find the id of a string. All three may be buffers over a memory-mapped file.
+
+    Usage:
+        table = StringTable(*StringTable.build(["a", "b"]))
+        table[1], table.find("b")  # "b", 1
+    """
+    def __init__(self, data: Sequence[int], offsets: Sequence[int], slots: Sequence[int]) -> None:
+        self.data, self.offsets, self.slots = data, offsets, slots
+        self.mask = len(slots) - 1
+
+    @staticmethod
+    def build(strings: Sequence[str]) -> Tuple[bytes, array, array]:
+        """Return (data, offsets, slots) for `strings`."""
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = array("q", [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        slots = array("i", [-1]) * (1 << (2 * len(encoded)).bit_length())
+        mask = len(slots) - 1
+        for i, value in enumerate(encoded):
+            slot = zlib.crc32(value) & mask
+            while slots[slot] != -1:
+                slot = (slot + 1) & mask
+            slots[slot] = i
+        return b"".join(encoded), offsets, slots
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def find(self, string: str) -> int:
+        """Return the id of `string`, or -1 if it isn't in the table."""
+        value, data, offsets, slots = string.encode("utf-8"), self.data, self.offsets, self.slots
+        slot = zlib.crc32(value) & self.mask
+        while True:
+            i = slots[slot]
+            if i == -1 or data[offsets[i]:offsets[i + 1]] == value:
+                return i
+            slot = (slot + 1) & self.mask
+
+
+class _StringIndex(Mapping):
+    """String -> id over a `StringTable` (e.g., `CompactCityMap.labelIndex`)."""
+    def __init__(self, table: StringTable) -> None:
+        self._table = table
+
+    def __getitem__(self, string: str) -> int:
+        i = self._table.find(string) if isinstance(string, str) else -1
+        if i == -1:
+            raise KeyError(string)
+        return i
+
+    def get(self, string: str, default: Optional[int] = None) -> Optional[int]:
+        i = self._table.find(string) if isinstance(string, str) else -1
+        return i if i != -1 else default
+
+    def __contains__(self, string: object) -> bool:
+        return isinstance(string, str) and self._table.find(string) != -1
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+class _TagTables(Sequence):
+    """
+    Tags of a compiled map (see the file layout above), as a sequence of location id ->
+    list of tags (`CompactCityMap.nodeTags`); also answers the tag index queries of
+    `CompactCityMap` directly from the (memory-mapped) arrays.
+    """
+    def __init__(
+        self,
+        labels: Sequence[str],
+        tags: StringTable,
+        nodeOffsets: Sequence[int],
+        nodeTagIds: Sequence[int],
+        tagOffsets: Sequence[int],
+        tagLocationIds: Sequence[int],
+    ) -> None:
+        self.labels, self.tags = labels, tags
+        self.nodeOffsets, self.nodeTagIds = nodeOffsets, nodeTagIds
+        self.tagOffsets, self.tagLocationIds = tagOffsets, tagLocationIds
+
+    @staticmethod
+    def build(labels: Sequence[str], nodeTags: Sequence[List[str]]) -> Dict[str, object]:
+        """Return the tag sections of a compiled map (see `saveCompiledMap`)."""
+        distinctTags = sorted({tag for tags in nodeTags for tag in tags})
+        tagIds = {tag: i for i, tag in enumerate(distinctTags)}
+        nodeOffsets, nodeTagIds = array("q", [0]), array("i")
+        locationsByTag: List[List[int]] = [[] for _ in distinctTags]
+        for location in sorted(range(len(labels)), key=lambda location: labels[location]):
+            for tag in set(nodeTags[location]):
+                locationsByTag[tagIds[tag]].append(location)
+        for tags in nodeTags:
+            nodeTagIds.extend(tagIds[tag] for tag in tags)
+            nodeOffsets.append(len(nodeTagIds))
+        tagOffsets, tagLocationIds = array("q", [0]), array("i")
+        for locations in locationsByTag:
+            tagLocationIds.extend(locations)
+            tagOffsets.append(len(tagLocationIds))
+        tagData, tagStringOffsets, tagSlots = StringTable.build(distinctTags)
+        return {
+            "tagData": tagData,
+            "tagStringOffsets": tagStringOffsets,
+            "tagSlots": tagSlots,
+            "nodeTagOffsets": nodeOffsets,
+            "nodeTagIds": nodeTagIds,
+            "tagLocationOffsets": tagOffsets,
+            "tagLocationIds": tagLocationIds,
+        }
+
+    def __getitem__(self, location: int) -> List[str]:
+        tags, nodeTagIds = self.tags, self.nodeTagIds
+        return [tags[tagId] for tagId in nodeTagIds[self.nodeOffsets[location]:self.nodeOffsets[location + 1]]]
+
+    def __len__(self) -> int:
+        return len(self.nodeOffsets) - 1
+
+    def hasTag(self, location: int, tag: str) -> bool:
+        tagId = self.tags.find(tag)
+        if tagId == -1:
+            return False
+        return tagId in self.nodeTagIds[self.nodeOffsets[location]:self.nodeOffsets[location + 1]]
+
+    def locationsWithTag(self, tag: str) -> Tuple[str, ...]:
+        tagId, labels = self.tags.find(tag), self.labels
+        if tagId == -1:
+            return ()
+        locations = self.tagLocationIds[self.tagOffsets[tagId]:self.tagOffsets[tagId + 1]]
+        return tuple(labels[location] for location in locations)
+
+    def locationsWithTagKey(self, key: str) -> List[str]:
+        # Tags are sorted, so the "key=..." tags are a contiguous range ("=" < ">"); a tag
+        # without "=" is its own key (see `CityMap.tagKeys`)
+        first, last = bisect_left(self.tags, key + "="), bisect_left(self.tags, key + ">")
+        labels = set(self.locationsWithTag(key))
+        for tagId in range(first, last):
+            labels.update(self.locationsWithTag(self.tags[tagId]))
+        return sorted(labels)
+
+
+def mapCacheKey(map_file: str, landmarks_file: str) -> str:
+    """Hash of the map format version and the contents of a `.pbf` map and landmarks file."""
+    digest = hashlib.sha256(MAP_FILE_MAGIC + f"v{MAP_FORMAT_VERSION}".encode("utf-8"))
+    for path in [map_file, landmarks_file]:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def saveCompiledMap(cityMap: CityMap, path: str, key: str = "") -> None:
+    """Write `cityMap` (in compact form) to `path`; `key` is stored in the header."""
+    compactMap = cityMap.compact()
+    labelData, labelOffsets, labelSlots = StringTable.build(compactMap.labels)
+    sections = {
+        "latitudes": array("d", compactMap.latitudes),
+        "longitudes": array("d", compactMap.longitudes),
+        "offsets": array("q", compactMap.offsets),
+        "targets": array("i", compactMap.targets),
+        "weights": array("d", compactMap.weights),
+        "labelData": labelData,
+        "labelOffsets": labelOffsets,
+        "labelSlots": labelSlots,
+        **_TagTables.build(compactMap.labels, compactMap.nodeTags),
+        "shapes": json.dumps([
+            [source, target, [[geo.latitude, geo.longitude] for geo in inner]]
+            for (source, target), inner in compactMap.shapes.items()
+        ]).encode("utf-8"),
+    }
+
+    # Lay out sections (each 8-byte aligned) relative to the start of the data
+    layout, position = {}, 0
+    for name, values in sections.items():
+        layout[name] = (position, memoryview(values).nbytes)
+        position += -(-layout[name][1] // 8) * 8
+
+    header = json.dumps({
+        "version": MAP_FORMAT_VERSION,
+        "key": key,
+        "byteorder": sys.byteorder,
+        "numLocations": compactMap.numLocations,
+        "numConnections": len(compactMap.targets),
+        "sections": layout,
+    }).encode("utf-8")
+    dataStart = -(-(len(MAP_FILE_MAGIC) + 8 + len(header)) // 8) * 8
+
+    # Write to a temporary file first, so concurrent readers never see a partial file
+    temporaryPath = f"{path}.{os.getpid()}.tmp"
+    with open(temporaryPath, "wb") as f:
+        f.write(MAP_FILE_MAGIC + len(header).to_bytes(8, "little") + header)
+        for name, values in sections.items():
+            f.seek(dataStart + layout[name][0])
+            f.write(values)
+    os.replace(temporaryPath, path)
+
+
+def loadCompiledMap(path: str) -> Tuple[Optional[CompactCityMap], str]:
+    """
+    Load a map written by `saveCompiledMap`, returning (map, key); returns (None, "") if
+    `path` isn't a compiled map file (of this format version) readable on this machine.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAP_FILE_MAGIC)) != MAP_FILE_MAGIC:
+            return None, ""
+        headerSize = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(headerSize).decode("utf-8"))
+        if header.get("version") != MAP_FORMAT_VERSION or header["byteorder"] != sys.byteorder:
+            return None, ""
+        dataStart = -(-(len(MAP_FILE_MAGIC) + 8 + headerSize) // 8) * 8
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data = memoryview(buffer)
+    def section(name: str, format: str = "B") -> memoryview:
+        offset, size = header["sections"][name]
+        return data[dataStart + offset:dataStart + offset + size].cast(format)
+
+    labels = StringTable(section("labelData"), section("labelOffsets", "q"), section("labelSlots", "i"))
+    tagTables = _TagTables(
+        labels,
+        StringTable(section("tagData"), section("tagStringOffsets", "q"), section("tagSlots", "i")),
+        section("nodeTagOffsets", "q"),
+        section("nodeTagIds", "i"),
+        section("tagLocationOffsets", "q"),
+        section("tagLocationIds", "i"),
+    )
+    shapes = json.loads(bytes(section("shapes")).decode("utf-8"))
+    compactMap = CompactCityMap(
+        labels,
+        section("latitudes", "d"),
+        section("longitudes", "d"),
+        section("offsets", "q"),
+        section("targets", "i"),
+        section("weights", "d"),
+        tagTables,
+        shapes={
+            (source, target): [GeoLocation(lat, lon) for lat, lon in inner]
+            for source, target, inner in shapes
+        },
+        labelIndex=_StringIndex(labels),
+        tagTables=tagTables,
+    )
+    return compactMap, header["key"]
+
+
+def loadCachedMap(
+    map_file: str, landmarks_file: str, cacheDir: str, lowMemory: bool = False
+) -> CompactCityMap:
+    """
+    Return the compiled map for (`map_file`, `landmarks_file`) from `cacheDir`, parsing
+    the `.pbf` (and writing the compiled map) only if it isn't cached yet; with
+    `lowMemory`, the `.pbf` is parsed with `readRoutableMap` (which gives the same map).
+    """
+    key = mapCacheKey(map_file, landmarks_file)
+    path = os.path.join(cacheDir, f"{key}.cmap")
+    if os.path.exists(path):
+        compactMap, storedKey = loadCompiledMap(path)
+        if compactMap is not None and storedKey == key:
+            return compactMap
+
+    if lowMemory:
+        cityMap = readRoutableMap(map_file, landmarkPath=landmarks_file)
+    else:
+        cityMap = readMap(map_file)
+        addLandmarks(cityMap, landmarks_file)
+    os.makedirs(cacheDir, exist_ok=True)
+    saveCompiledMap(cityMap, path, key)
+    return cityMap.compact()
+
+
 if __name__ == "__main__":
     sanJoseMap = createSanJoseMap()
     printMap(sanJoseMap)
@@ -0,0 +1,395 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from mapUtil import CityMap, createCustomMap
+from routing import DijkstraSearch, HeldKarpWaypointsSearch
+from submission import ShortestPathProblem, WaypointsShortestPathProblem
+
+########################################################################################
+# Route Server
+#   > A small HTTP service that loads a `CityMap` once and answers route queries sent
+#     as JSON (`POST /route`):
+#         {"startLocation": "123", "endTag": "landmark=gates",
+#          "waypointTags": ["landmark=hoover_tower"]}       <-- optional
+#     and responds with
+#         {"path": ["123", ...], "cost": 1234.5, "numStatesExplored": 678,
+#          "waypointTags": [...]}                            <-- same format as path.json
+#
+#   > Queries are solved by a pool of worker processes. Forked workers share the map
+#     with the server process (and a map loaded from a compiled cache is memory-mapped,
+#     so its pages are shared by all processes in any case).
+#
+#   > Batching :: queued shortest path queries are sent to the workers in batches (of
+#     up to `batchSize` queries, waiting at most `batchDelay` seconds to fill a batch),
+#     which amortizes the cost of inter-process communication. Waypoint queries (which
+#     can take up to `queryTimeLimit` seconds) are sent on their own, so that a slow
+#     query never holds up the queries batched with it.
+#
+#   > Backpressure :: at most `maxPending` queries wait to be dispatched; beyond that,
+#     the server immediately responds with "503 Service Unavailable".
+#
+#   > Time limit :: waypoint queries with many (or very common) waypoint tags can take
+#     far longer than plain shortest path queries; workers give up on a query after
+#     `queryTimeLimit` seconds (responding with "504 Gateway Timeout"), so that a few
+#     such queries can't stall the whole pool.
+
+
+# Largest request body we accept (queries are small JSON objects); larger requests
+# are rejected with "413 Payload Too Large" before reading the body
+MAX_BODY_BYTES = 64 * 1024
+
+# Per-process map (set in the server process before forking, or by `_initWorker`)
+_workerMap: Optional[CityMap] = None
+_workerSearches: Dict[str, Any] = {}
+
+
+def _initWorker(
+    mapFile: str, landmarkFile: str, cacheDir: Optional[str], queryTimeLimit: Optional[float]
+) -> None:
+    global _workerMap
+    if _workerMap is None:
+        _workerMap = createCustomMap(mapFile, landmarkFile, cacheDir)
+    # (A single Dijkstra search explores each location at most once, so plain shortest
+    # path queries don't need a time limit)
+    _workerSearches["shortest"] = DijkstraSearch()
+    _workerSearches["waypoints"] = HeldKarpWaypointsSearch(timeLimit=queryTimeLimit)
+
+
+def solveQuery(cityMap: CityMap, query: Dict[str, Any], searches: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Solve a single (JSON) route query; returns the JSON response, which has an "error"
+    field if the query is invalid (and a "timedOut" field if it ran out of time).
+    """
+    startLocation, endTag = query.get("startLocation"), query.get("endTag")
+    waypointTags = query.get("waypointTags") or []
+    if not isinstance(startLocation, str) or not isinstance(endTag, str):
+        return {"error": "`startLocation` and `endTag` must be strings"}
+    if not isinstance(waypointTags, list) or not all(isinstance(tag, str) for tag in waypointTags):
+        return {"error": "`waypointTags` must be a list of strings"}
+    if startLocation not in cityMap.compact().labelIndex:
+        return {"error": f"Unknown location {startLocation!r}"}
+
+    if len(waypointTags) == 0:
+        problem = ShortestPathProblem(startLocation, endTag, cityMap)
+        search = searches["shortest"]
+    else:
+        problem = WaypointsShortestPathProblem(startLocation, waypointTags, endTag, cityMap)
+        search = searches["waypoints"]
+    search.solve(problem)
+    if getattr(search, "timedOut", False):
+        return {"error": "Query exceeded the time limit", "timedOut": True}
+
+    return {
+        "waypointTags": waypointTags,
+        "path": [startLocation] + search.actions if search.actions is not None else None,
+        "cost": search.pathCost,
+        "numStatesExplored": search.numStatesExplored,
+    }
+
+
+def _isWaypointQuery(query: Dict[str, Any]) -> bool:
+    return bool(query.get("waypointTags"))
+
+
+def _solveBatch(queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Solve a batch of queries; a query that raises gets an error response (with an
+    "internalError" field), without affecting the other queries in the batch.
+    """
+    results = []
+    for query in queries:
+        try:
+            results.append(solveQuery(_workerMap, query, _workerSearches))
+        except Exception as exception:
+            results.append({"error": repr(exception), "internalError": True})
+    return results
+
+
+class RouteServer:
+    """
+    Usage:
+        server = RouteServer("data/sanjose.pbf", "data/sanjose-landmarks.json", processes=4)
+        asyncio.run(server.serve("127.0.0.1", 8080))
+
+    Or, from within a running event loop (e.g., in tests):
+        await server.start("127.0.0.1", 0)   # Port 0 :: any free port
+        ...
+        server.close()
+    """
+    def __init__(
+        self,
+        mapFile: str,
+        landmarkFile: str,
+        cacheDir: Optional[str] = None,
+        processes: Optional[int] = None,
+        batchSize: int = 16,
+        batchDelay: float = 0.002,
+        maxPending: int = 1024,
+        queryTimeLimit: Optional[float] = 10.0,
+    ):
+        """
+        :param processes: Number of worker processes (default: number of CPUs).
+        :param batchSize: Maximum number of queries sent to a worker at once.
+        :param batchDelay: Maximum time (in seconds) to wait for a batch to fill up.
+        :param maxPending: Maximum number of queries waiting to be dispatched.
+        :param queryTimeLimit: Time limit (in seconds) for solving a waypoint query;
+                               None for no limit.
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batchSize, self.batchDelay, self.maxPending = batchSize, batchDelay, maxPending
+
+        # Load the map *before* creating the pool, so that forked workers inherit it
+        global _workerMap
+        _workerMap = createCustomMap(mapFile, landmarkFile, cacheDir)
+        _workerMap.compact()
+        context = (
+            multiprocessing.get_context("fork")
+            if "fork" in multiprocessing.get_all_start_methods() else None
+        )
+        self.executor = ProcessPoolExecutor(
+            self.processes, mp_context=context,
+            initializer=_initWorker, initargs=(mapFile, landmarkFile, cacheDir, queryTimeLimit),
+        )
+
+        # Start the workers now (rather than on the first query, from within the
+        # event loop); this also surfaces any errors from `_initWorker` immediately
+        self.executor.submit(_solveBatch, []).result()
+
+        # Created in `start` (they must belong to the running event loop)
+        self.pending: Optional[asyncio.Queue] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.numBatches = 0
+
+    ####################################################################################
+    # Dispatching queries to workers
+
+    async def _dispatch(self) -> None:
+        """
+        Collect pending shortest path queries into batches and send them to the worker
+        pool; waypoint queries are sent immediately, as batches of one.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.pending.get()
+            if _isWaypointQuery(item[0]):
+                await self._submit([item])
+                continue
+            batch = [item]
+            batchEnd = loop.time() + self.batchDelay
+            while len(batch) < self.batchSize:
+                if not self.pending.empty():
+                    item = self.pending.get_nowait()
+                else:
+                    timeout = batchEnd - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.pending.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if _isWaypointQuery(item[0]):
+                    await self._submit([item])
+                else:
+                    batch.append(item)
+            await self._submit(batch)
+
+    async def _submit(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        # Keep (at most) two batches in flight per worker
+        await self.slots.acquire()
+        self.numBatches += 1
+        asyncio.get_running_loop().create_task(self._runBatch(batch))
+
+    async def _runBatch(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.executor, _solveBatch, [query for query, _ in batch]
+            )
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as exception:
+            # The whole batch failed (e.g., a worker process died)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exception)
+        finally:
+            self.slots.release()
+
+    async def route(self, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Queue `query` and wait for its result; returns None if the queue is full."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.pending.put_nowait((query, future))
+        except asyncio.QueueFull:
+            return None
+        return await future
+
+    ####################################################################################
+    # HTTP
+
+    async def _handleConnection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                method, target, version = requestLine.decode("latin-1").split(maxsplit=2)
+
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode("latin-1").strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                contentLength = int(headers.get("content-length", 0))
+                if not 0 <= contentLength <= MAX_BODY_BYTES:
+                    # The body is never read, so the connection can't be reused
+                    error = {"error": f"Request body must be at most {MAX_BODY_BYTES} bytes"}
+                    self._writeResponse(writer, "413 Payload Too Large", error, keepAlive=False)
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(contentLength)
+
+                status, response = await self._handleRequest(method, target, body)
+                keepAlive = (
+                    headers.get("connection", "").lower() != "close"
+                    and not version.startswith("HTTP/1.0")
+                )
+                self._writeResponse(writer, status, response, keepAlive)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handleRequest(self, method: str, target: str, body: bytes) -> Tuple[str, Dict]:
+        if method == "GET" and target == "/health":
+            return "200 OK", {"status": "ok", "pending": self.pending.qsize(), "batches": self.numBatches}
+        if method != "POST" or target != "/route":
+            return "404 Not Found", {"error": f"No route for {method} {target}"}
+
+        try:
+            query = json.loads(body)
+        except ValueError:
+            return "400 Bad Request", {"error": "Request body must be JSON"}
+        if not isinstance(query, dict):
+            return "400 Bad Request", {"error": "Request body must be a JSON object"}
+
+        try:
+            result = await self.route(query)
+        except Exception as exception:
+            return "500 Internal Server Error", {"error": repr(exception)}
+        if result is None:
+            return "503 Service Unavailable", {"error": "Too many pending queries"}
+        if result.get("internalError"):
+            return "500 Internal Server Error", {"error": result["error"]}
+        if result.get("timedOut"):
+            return "504 Gateway Timeout", result
+        if "error" in result:
+            return "400 Bad Request", result
+        return "200 OK", result
+
+    @staticmethod
+    def _writeResponse(writer: asyncio.StreamWriter, status: str, response: Dict, keepAlive: bool) -> None:
+        body = json.dumps(response).encode("utf-8")
+        headers = [
+            f"HTTP/1.1 {status}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keepAlive else 'close'}",
+        ]
+        if status.startswith("503"):
+            headers.append("Retry-After: 1")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        """Start accepting connections (see `self.server.sockets` for the actual port)."""
+        self.pending = asyncio.Queue(maxsize=self.maxPending)
+        self.slots = asyncio.Semaphore(2 * self.processes)
+        self.dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        # Accept connections as fast as possible; backpressure is applied to queries
+        # (with 503 responses), rather than by refusing connections
+        self.server = await asyncio.start_server(
+            self._handleConnection, host, port, backlog=socket.SOMAXCONN
+        )
+        return self.server
+
+    def close(self) -> None:
+        """Stop accepting connections, and shut down the worker pool."""
+        self.server.close()
+        self.dispatcher.cancel()
+        # Drop queries that were never dispatched; at most two batches per worker were
+        # submitted to the pool, and those are left to finish (Python 3.8's `shutdown`
+        # can't cancel them)
+        while not self.pending.empty():
+            _, future = self.pending.get_nowait()
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        server = await self.start(host, port)
+        print(f"Serving routes on http://{host}:{port} with {self.processes} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--map-file", type=str, default="data/sanjose.pbf", help="Map (.pbf)"
+    )
+    parser.add_argument(
+        "--landmark-file",
+        type=str,
+        default="data/sanjose-landmarks.json",
+        help="Landmarks (.json)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="(Optional) directory for compiled maps, to skip re-parsing the map file",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--processes", type=int, default=None, help="Worker processes (default: #CPUs)"
+    )
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--batch-delay", type=float, default=0.002, help="Seconds")
+    parser.add_argument("--max-pending", type=int, default=1024)
+    parser.add_argument(
+        "--query-time-limit", type=float, default=10.0, help="Seconds per waypoint query"
+    )
+    args = parser.parse_args()
+
+    routeServer = RouteServer(
+        args.map_file,
+        args.landmark_file,
+        cacheDir=args.cache_dir,
+        processes=args.processes,
+        batchSize=args.batch_size,
+        batchDelay=args.batch_delay,
+        maxPending=args.max_pending,
+        queryTimeLimit=args.query_time_limit,
+    )
+    try:
+        asyncio.run(routeServer.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,1569 @@
+import hashlib
+import heapq
+import json
+import os
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from math import asin, sin, sqrt
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from mapUtil import (
+    RADIUS_EARTH,
+    CityMap,
+    CompactCityMap,
+    ConnectionUpdate,
+    StraightLineEvaluator,
+    TravelTimeProfiles,
+)
+from util import TIME_CHECK_INTERVAL, Heuristic, SearchAlgorithm, SearchMetrics, SearchProblem, State
+
+########################################################################################
+# Specialized Search Engines for Routing on a `CityMap`
+#   > Unlike the generic algorithms in `util.py`, which only interact with a problem
+#     through `State` objects, the engines below run directly on the integer location
+#     ids of a `CompactCityMap` (see `mapUtil.py`). They trade generality for speed, and
+#     are only applicable to plain shortest path problems (e.g., `ShortestPathProblem`
+#     in `submission.py`): a start location, an end tag, and a city map.
+#
+#   > Ties :: the engines order locations of equal cost by location id, whereas
+#     `UniformCostSearch` orders them by `State` (i.e., by label). When several paths
+#     are equally cheap, an engine may return a different (equally cheap) path than
+#     `UniformCostSearch`, and explore a different subset of the locations that tie
+#     with the end location; path costs always agree.
+
+
+def unwindPath(parents: List[int], labels: List[str], end: int) -> List[str]:
+    """
+    Follow `parents` back from location id `end` (until reaching a location with parent
+    -1) and return the list of location labels visited, *excluding* the start location.
+    """
+    path = []
+    while parents[end] != -1:
+        path.append(labels[end])
+        end = parents[end]
+    path.reverse()
+    return path
+
+
+def shortestPathCosts(
+    graph: CompactCityMap, sources: Iterable[int], targets: Optional[Iterable[int]] = None
+) -> Tuple[List[float], List[int], int]:
+    """
+    Run Dijkstra's algorithm from the location ids in `sources` (all with cost 0), and
+    return (costs, parents, number of locations explored), with costs and parents as
+    lists indexed by location id; sources and unreachable locations have parent -1.
+
+    Runs to exhaustion (so unreachable locations have cost `inf`), unless `targets` is
+    given, in which case the search stops as soon as every target is explored (and
+    only costs/parents of explored locations are final).
+    """
+    offsets, targets_, weights = graph.offsets, graph.targets, graph.weights
+    costs = [float("inf")] * graph.numLocations
+    parents = [-1] * graph.numLocations
+    explored = bytearray(graph.numLocations)
+    remaining = set(targets) if targets is not None else None
+    numExplored = 0
+
+    frontier = []
+    for source in sources:
+        costs[source] = 0.0
+        frontier.append((0.0, source))
+    heapq.heapify(frontier)
+
+    while frontier:
+        pastCost, location = heapq.heappop(frontier)
+        if explored[location]:
+            continue
+        explored[location] = 1
+        numExplored += 1
+        if remaining is not None:
+            remaining.discard(location)
+            if len(remaining) == 0:
+                break
+        for edge in range(offsets[location], offsets[location + 1]):
+            nextLocation = targets_[edge]
+            newCost = pastCost + weights[edge]
+            if newCost < costs[nextLocation]:
+                costs[nextLocation] = newCost
+                parents[nextLocation] = location
+                heapq.heappush(frontier, (newCost, nextLocation))
+    return costs, parents, numExplored
+
+
+########################################################################################
+# Reusable search workspaces
+#   > Rather than allocating (and later garbage collecting) per-location lists and
+#     dictionaries on every query, a workspace keeps arrays sized to the map and reuses
+#     them. Resetting only touches the entries written by the previous search: every
+#     location with a finite cost was either explored or is still on the frontier.
+
+
+class SearchWorkspace:
+    """
+    Preallocated per-location arrays for repeated searches over one `CityMap`.
+
+    Usage:
+        workspace = SearchWorkspace(cityMap)
+        algorithm = DijkstraSearch(workspace=workspace)
+    """
+    def __init__(self, cityMap: CityMap):
+        self.graph: CompactCityMap = cityMap.compact()
+        numLocations = self.graph.numLocations
+
+        # Location id -> cost/parent/explored flag
+        self.costs = array("d", [float("inf")]) * numLocations
+        self.parents = array("i", [-1]) * numLocations
+        self.explored = bytearray(numLocations)
+
+        # Explored location ids (in order) and frontier of the current search
+        self.exploredOrder: List[int] = []
+        self.frontier: List[Tuple[float, int]] = []
+
+        # Incremented by every `reset`, so that views of a search can detect staleness
+        self.version = 0
+
+    def reset(self) -> None:
+        """Restore the entries written by the previous search before starting a new one."""
+        costs, explored = self.costs, self.explored
+        for location in self.exploredOrder:
+            costs[location] = float("inf")
+            explored[location] = 0
+        for _, location in self.frontier:
+            costs[location] = float("inf")
+        self.exploredOrder.clear()
+        self.frontier.clear()
+        self.version += 1
+
+
+class _ExploredCostsView(Mapping):
+    """
+    Read-only `pastCosts`-style mapping (location label -> cost) over the locations
+    explored by the current search in a `SearchWorkspace`; only valid until the
+    workspace is reset.
+    """
+    def __init__(self, workspace: SearchWorkspace):
+        self.workspace = workspace
+        self.version = workspace.version
+
+    def _check(self) -> None:
+        if self.workspace.version != self.version:
+            raise RuntimeError("Search workspace was reset; these costs are no longer valid")
+
+    def __getitem__(self, label: str) -> float:
+        self._check()
+        location = self.workspace.graph.labelIndex.get(label)
+        if location is None or not self.workspace.explored[location]:
+            raise KeyError(label)
+        return self.workspace.costs[location]
+
+    def __iter__(self) -> Iterator[str]:
+        self._check()
+        labels = self.workspace.graph.labels
+        return (labels[location] for location in self.workspace.exploredOrder)
+
+    def __len__(self) -> int:
+        self._check()
+        return len(self.workspace.exploredOrder)
+
+
+########################################################################################
+# Dijkstra's algorithm on integer location ids
+
+
+class DijkstraSearch(SearchAlgorithm):
+    def __init__(self, verbose: int = 0, workspace: Optional[SearchWorkspace] = None):
+        """
+        :param workspace: Arrays to (re)use for every search; if not specified (or if
+                          it was built for another map), a workspace is created on the
+                          first `solve` and kept for later searches over the same map.
+        """
+        super().__init__()
+        self.verbose = verbose
+        self.workspace = workspace
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Run Dijkstra's algorithm on the specified `problem` instance, which must define
+        `startLocation`, `endTag`, and `cityMap` (e.g., `ShortestPathProblem`).
+
+        Finds a path of the same cost as `UniformCostSearch` (the same path, unless
+        there are ties; see above), but never creates `State` objects; the frontier is
+        a heap of (pastCost, location id) tuples, and costs and backpointers are kept
+        in the (reused) arrays of a `SearchWorkspace`.
+
+        Sets the following instance variables (see `SearchAlgorithm` docstring).
+            - self.actions: List[str]
+            - self.pathCost: float
+            - self.numStatesExplored: int
+            - self.pastCosts: Dict[str, float]
+            - self.exploredCosts: Mapping[str, float] (same as `pastCosts`, read directly
+                                  from the workspace, so only valid until it's reset;
+                                  e.g., by the next `solve`)
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.numStatesExplored: int = 0
+        self.metrics = metrics = SearchMetrics()
+        startTime = time.perf_counter()
+
+        graph: CompactCityMap = problem.cityMap.compact()
+        if self.workspace is None or self.workspace.graph is not graph:
+            self.workspace = SearchWorkspace(graph)
+        workspace = self.workspace
+        workspace.reset()
+        self.exploredCosts = _ExploredCostsView(workspace)
+
+        labels, hasTag, endTag = graph.labels, graph.hasTag, problem.endTag
+        offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+        costs, parents, explored = workspace.costs, workspace.parents, workspace.explored
+        exploredOrder, frontier = workspace.exploredOrder, workspace.frontier
+
+        # Add the start location
+        start = graph.index(problem.startLocation)
+        costs[start], parents[start] = 0.0, -1
+        frontier.append((0.0, start))
+        numPushes, numStalePops, maxFrontierSize = 1, 0, 1
+
+        while frontier:
+            pastCost, location = heapq.heappop(frontier)
+            if explored[location]:
+                # Outdated entry, skip
+                numStalePops += 1
+                continue
+            explored[location] = 1
+
+            # Update tracking variables
+            exploredOrder.append(location)
+            self.numStatesExplored += 1
+            if self.verbose >= 2:
+                print(f"Exploring {labels[location]} with pastCost {pastCost}")
+
+            # Check if we've reached an end location; if so, extract solution.
+            if hasTag(labels[location], endTag):
+                self.actions = unwindPath(parents, labels, location)
+                self.pathCost = pastCost
+                if self.verbose >= 1:
+                    print(f"numStatesExplored = {self.numStatesExplored}")
+                    print(f"pathCost = {self.pathCost}")
+                    print(f"actions = {self.actions}")
+                break
+
+            # Relax all connections out of `location`
+            for edge in range(offsets[location], offsets[location + 1]):
+                nextLocation = targets[edge]
+                newCost = pastCost + weights[edge]
+                if newCost < costs[nextLocation]:
+                    costs[nextLocation] = newCost
+                    parents[nextLocation] = location
+                    heapq.heappush(frontier, (newCost, nextLocation))
+                    numPushes += 1
+            if len(frontier) > maxFrontierSize:
+                maxFrontierSize = len(frontier)
+        else:
+            if self.verbose >= 1:
+                print("Searched the entire search space!")
+
+        self.pastCosts = {labels[location]: costs[location] for location in exploredOrder}
+
+        metrics.numStatesExplored, metrics.numPushes = self.numStatesExplored, numPushes
+        metrics.numStalePops, metrics.maxFrontierSize = numStalePops, maxFrontierSize
+        metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+########################################################################################
+# Bidirectional Dijkstra
+#   > Since `CityMap.addConnection` always adds connections in both directions, the
+#     backward search (from the end locations towards the start) can use the same
+#     adjacency arrays as the forward search.
+
+
+class BidirectionalSearch(SearchAlgorithm):
+    def __init__(self, verbose: int = 0):
+        super().__init__()
+        self.verbose = verbose
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Run bidirectional Dijkstra on the specified `problem` instance, which must
+        define `startLocation`, `endTag`, and `cityMap` (e.g., `ShortestPathProblem`).
+
+        A forward search from the start location and a backward search from *all*
+        locations with the end tag are interleaved (always expanding the side with the
+        smaller frontier priority). Let `bestCost` be the cheapest start -> end path
+        seen where the two searches meet; once the smallest forward and backward
+        priorities sum to at least `bestCost`, no cheaper path can exist.
+
+        Sets the same instance variables as `UniformCostSearch`, except that
+        `self.pastCosts` only holds locations explored by the forward search, and
+        `self.numStatesExplored` counts locations explored by both searches. The path
+        has the same cost as the one found by `UniformCostSearch`, but when there are
+        ties, it may be a different one (the searches can meet at any of several
+        equally good locations; see above).
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.numStatesExplored: int = 0
+        self.pastCosts = {}
+        self.metrics = metrics = SearchMetrics()
+        startTime = time.perf_counter()
+
+        graph: CompactCityMap = problem.cityMap.compact()
+        labels, offsets, targets, weights = graph.labels, graph.offsets, graph.targets, graph.weights
+        numLocations = graph.numLocations
+
+        # Index 0 :: forward search, index 1 :: backward search
+        costs = ([float("inf")] * numLocations, [float("inf")] * numLocations)
+        parents = ([-1] * numLocations, [-1] * numLocations)
+        explored = (bytearray(numLocations), bytearray(numLocations))
+        frontiers = ([], [])
+
+        start = graph.index(problem.startLocation)
+        costs[0][start] = 0.0
+        frontiers[0].append((0.0, start))
+        for end in map(graph.index, graph.locationsWithTag(problem.endTag)):
+            costs[1][end] = 0.0
+            frontiers[1].append((0.0, end))
+
+        # Best path found so far (through `meeting`)
+        bestCost, meeting = costs[1][start], start if costs[1][start] == 0.0 else -1
+        numPushes, numStalePops = len(frontiers[0]) + len(frontiers[1]), 0
+        maxFrontierSize = numPushes
+
+        while frontiers[0] and frontiers[1]:
+            if frontiers[0][0][0] + frontiers[1][0][0] >= bestCost:
+                break
+
+            # Expand the side with the smaller priority
+            side = 0 if frontiers[0][0][0] <= frontiers[1][0][0] else 1
+            pastCost, location = heapq.heappop(frontiers[side])
+            if explored[side][location]:
+                # Outdated entry, skip
+                numStalePops += 1
+                continue
+            explored[side][location] = 1
+
+            # Update tracking variables
+            if side == 0:
+                self.pastCosts[labels[location]] = pastCost
+            self.numStatesExplored += 1
+            if self.verbose >= 2:
+                direction = "forward" if side == 0 else "backward"
+                print(f"Exploring {labels[location]} ({direction}) with pastCost {pastCost}")
+
+            # Relax all connections out of `location`, checking whether this produces a
+            # cheaper path that meets the search from the other side.
+            sideCosts, otherCosts, sideParents = costs[side], costs[1 - side], parents[side]
+            for edge in range(offsets[location], offsets[location + 1]):
+                nextLocation = targets[edge]
+                newCost = pastCost + weights[edge]
+                if newCost < sideCosts[nextLocation]:
+                    sideCosts[nextLocation] = newCost
+                    sideParents[nextLocation] = location
+                    heapq.heappush(frontiers[side], (newCost, nextLocation))
+                    numPushes += 1
+                if sideCosts[nextLocation] + otherCosts[nextLocation] < bestCost:
+                    bestCost = sideCosts[nextLocation] + otherCosts[nextLocation]
+                    meeting = nextLocation
+            frontierSize = len(frontiers[0]) + len(frontiers[1])
+            if frontierSize > maxFrontierSize:
+                maxFrontierSize = frontierSize
+
+        if meeting == -1:
+            if self.verbose >= 1:
+                print("Searched the entire search space!")
+        else:
+            # Stitch together start -> meeting (forward) and meeting -> end (backward)
+            self.actions = unwindPath(parents[0], labels, meeting)
+            location = meeting
+            while parents[1][location] != -1:
+                location = parents[1][location]
+                self.actions.append(labels[location])
+            self.pathCost = bestCost
+            if self.verbose >= 1:
+                print(f"numStatesExplored = {self.numStatesExplored}")
+                print(f"pathCost = {self.pathCost}")
+                print(f"actions = {self.actions}")
+
+        metrics.numStatesExplored, metrics.numPushes = self.numStatesExplored, numPushes
+        metrics.numStalePops, metrics.maxFrontierSize = numStalePops, maxFrontierSize
+        metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+########################################################################################
+# ALT (A*, Landmarks, Triangle inequality) heuristic
+#   > Note :: "landmarks" here are a handful of locations that we precompute exact
+#             shortest path costs from (not the hand-defined `landmark=` tags). For any
+#             landmark `L` and locations `v`, `t`, the triangle inequality gives
+#                 cost(v, t) >= |cost(L, t) - cost(L, v)|,
+#             which is usually a much tighter lower bound than the straight-line
+#             distance on a walking network.
+
+
+class LandmarkTables:
+    """
+    Shortest path costs from a small set of landmark locations to every location in a
+    `CityMap`, selected by "farthest point" sampling (each new landmark is the location
+    farthest from all landmarks chosen so far).
+
+    Usage:
+        tables = LandmarkTables.loadOrCompute("data/sanjose.alt", cityMap)
+        heuristic = ALTHeuristic(endTag, cityMap, tables)
+    """
+    def __init__(self, graph: CompactCityMap, landmarks: List[int], costs: List[array]) -> None:
+        """
+        Tables for `landmarks` (location ids in `graph`), where `costs[i][location]` is
+        the cost from `landmarks[i]` to `location`; see `compute` and `load`.
+        """
+        self.graph = graph
+        self.landmarks = landmarks
+        self.costs = costs
+
+    @classmethod
+    def compute(cls, cityMap: CityMap, numLandmarks: int = 16) -> "LandmarkTables":
+        """Select (up to) `numLandmarks` landmarks, and compute their tables."""
+        graph: CompactCityMap = cityMap.compact()
+        landmarks: List[int] = []
+        tables: List[array] = []
+        if graph.numLocations == 0:
+            return cls(graph, landmarks, tables)
+
+        # Start from the location farthest from an arbitrary location (location 0);
+        # unreachable locations are never chosen, so all landmarks share a component.
+        nearestCosts, _, _ = shortestPathCosts(graph, [0])
+        for _ in range(min(numLandmarks, graph.numLocations)):
+            landmark = max(
+                range(graph.numLocations),
+                key=lambda location: nearestCosts[location]
+                if nearestCosts[location] < float("inf") else -1.0,
+            )
+            costs, _, _ = shortestPathCosts(graph, [landmark])
+            landmarks.append(landmark)
+            tables.append(array("d", costs))
+
+            # Cost from each location to its nearest landmark
+            if len(landmarks) == 1:
+                nearestCosts = costs
+            else:
+                nearestCosts = [min(a, b) for a, b in zip(nearestCosts, costs)]
+        return cls(graph, landmarks, tables)
+
+    @staticmethod
+    def mapDigest(graph: CompactCityMap) -> str:
+        """
+        Digest of the location labels (in id order) and connections (CSR arrays) of
+        `graph`; tables computed before any connection was added or changed don't match.
+        """
+        digest = hashlib.sha1("\n".join(graph.labels).encode("utf-8"))
+        digest.update(np.asarray(graph.offsets, dtype=np.int64).tobytes())
+        digest.update(np.asarray(graph.targets, dtype=np.int32).tobytes())
+        digest.update(np.asarray(graph.weights, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def save(self, path: str) -> None:
+        """Write tables to `path` as a one-line JSON header followed by raw doubles."""
+        header = {
+            "mapDigest": self.mapDigest(self.graph),
+            "numLocations": self.graph.numLocations,
+            "landmarks": [self.graph.labels[landmark] for landmark in self.landmarks],
+        }
+        with open(path, "wb") as f:
+            f.write((json.dumps(header) + "\n").encode("utf-8"))
+            for costs in self.costs:
+                costs.tofile(f)
+
+    @classmethod
+    def load(cls, path: str, cityMap: CityMap) -> Optional["LandmarkTables"]:
+        """Load tables saved by `save`; returns None if they were built for another map."""
+        graph = cityMap.compact()
+        with open(path, "rb") as f:
+            header = json.loads(f.readline().decode("utf-8"))
+            if header["mapDigest"] != cls.mapDigest(graph):
+                return None
+
+            landmarks = [graph.index(label) for label in header["landmarks"]]
+            tables = []
+            for _ in landmarks:
+                costs = array("d")
+                costs.fromfile(f, header["numLocations"])
+                tables.append(costs)
+        return cls(graph, landmarks, tables)
+
+    @classmethod
+    def loadOrCompute(
+        cls, path: str, cityMap: CityMap, numLandmarks: int = 16
+    ) -> "LandmarkTables":
+        """Load tables from `path` if they match `cityMap`; otherwise compute & save them."""
+        if os.path.exists(path):
+            tables = cls.load(path, cityMap)
+            if tables is not None and len(tables.landmarks) >= numLandmarks:
+                return tables
+        tables = cls.compute(cityMap, numLandmarks)
+        tables.save(path)
+        return tables
+
+
+class ALTHeuristic(Heuristic):
+    """
+    Lower bound on the cost from a location to the nearest location with `endTag`,
+    using the triangle inequality with precomputed `LandmarkTables`. For each landmark
+    `L`, with `nearest`/`farthest` the smallest/largest cost from `L` to any end
+    location, the cost from `v` to the nearest end location is at least
+        max(nearest - cost(L, v), cost(L, v) - farthest)
+
+    This heuristic is consistent (so it can be used with `aStarReduction`).
+    """
+    def __init__(
+        self, endTag: str, cityMap: CityMap, tables: Optional[LandmarkTables] = None
+    ):
+        self.endTag = endTag
+        self.cityMap = cityMap
+        self.tables = tables if tables is not None else LandmarkTables.compute(cityMap)
+        self.graph = self.tables.graph
+
+        endLocations = [self.graph.index(label) for label in self.graph.locationsWithTag(endTag)]
+
+        # Landmark -> (nearest, farthest) cost to an end location; landmarks that can't
+        # reach any end location are skipped.
+        self.bounds: List[Tuple[array, float, float]] = []
+        for costs in self.tables.costs:
+            endCosts = [costs[end] for end in endLocations if costs[end] < float("inf")]
+            if len(endCosts) > 0:
+                self.bounds.append((costs, min(endCosts), max(endCosts)))
+
+    def evaluate(self, state: State) -> float:
+        location = self.graph.labelIndex[state.location]
+        best = 0.0
+        for costs, nearest, farthest in self.bounds:
+            cost = costs[location]
+            if cost < float("inf"):
+                best = max(best, nearest - cost, cost - farthest)
+        return best
+
+
+########################################################################################
+# Waypoints via a distance matrix + Held-Karp dynamic programming
+#   > Rather than searching over (location, visited waypoints) states, we only consider
+#     "candidate" locations (locations with at least one waypoint tag). Any optimal
+#     route is a sequence of shortest paths: start -> candidate -> ... -> candidate ->
+#     end, so it's enough to know the shortest path costs between candidates (one
+#     Dijkstra search from each candidate, plus one from all end locations), and then
+#     pick the best sequence of candidates.
+#
+#   > With common waypoint tags (e.g., "highway=crossing", with ~1000 locations), one
+#     search per candidate is far more work than a single Dijkstra search over
+#     (location, visited waypoints) states, which stops as soon as it reaches *some*
+#     candidate of each tag; beyond `maxCandidates` candidates, we run the latter
+#     instead (unless there are too many tags for it: it explores up to 2^(#tags)
+#     states per location). It runs on the `CompactCityMap` arrays, with each state
+#     packed into one integer: location * 2^(#tags) + visited waypoints bitmask.
+
+
+class HeldKarpWaypointsSearch(SearchAlgorithm):
+    def __init__(
+        self,
+        maxExactWaypoints: int = 13,
+        maxCandidates: int = 32,
+        timeLimit: Optional[float] = None,
+        verbose: int = 0,
+    ):
+        """
+        :param maxExactWaypoints: With up to this many waypoint tags, find the optimal
+                                  route with Held-Karp dynamic programming (exponential
+                                  in the number of tags); beyond that, find a (usually
+                                  near-optimal) route with a nearest-neighbor ordering
+                                  of the tags, improved by 2-opt moves.
+        :param maxCandidates: With more candidate locations (locations with at least one
+                              waypoint tag) than this, and at most `maxExactWaypoints`
+                              tags, find the optimal route with one Dijkstra search
+                              over (location, visited waypoints) states instead.
+        :param timeLimit: (Optional) time limit in seconds for each `solve` (covering
+                          all Dijkstra searches); if no route is found in time, the
+                          search stops with `self.timedOut` set (2-opt stops improving
+                          the route instead).
+        """
+        super().__init__()
+        self.maxExactWaypoints = maxExactWaypoints
+        self.maxCandidates = maxCandidates
+        self.timeLimit = timeLimit
+        self.verbose = verbose
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Find a route for the specified `problem` instance, which must define
+        `startLocation`, `waypointTags`, `endTag`, and `cityMap` (e.g.,
+        `WaypointsShortestPathProblem`).
+
+        Sets the same instance variables as `UniformCostSearch`, except that
+        `self.numStatesExplored` counts locations (or (location, visited waypoints)
+        states, see `maxCandidates`) explored by all Dijkstra searches, and
+        `self.pastCosts` maps each candidate location (or each explored location) to
+        its cost from the start.
+        Also sets
+            - self.timedOut: bool
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.numStatesExplored: int = 0
+        self.pastCosts = {}
+        self.timedOut = False
+        self.metrics = SearchMetrics()
+        startTime = time.perf_counter()
+        stopTime = startTime + self.timeLimit if self.timeLimit is not None else float("inf")
+
+        self._findRoute(problem, stopTime)
+
+        self.metrics.numStatesExplored = self.numStatesExplored
+        self.metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+    def _findRoute(self, problem: SearchProblem, stopTime: float) -> None:
+        """Body of `solve` (sets the same instance variables, except `self.metrics`)."""
+        graph: CompactCityMap = problem.cityMap.compact()
+        tags = sorted(set(problem.waypointTags))
+        fullMask = (1 << len(tags)) - 1
+
+        # Location id -> bitmask of waypoint tags at that location
+        masks = {}
+        for bit, tag in enumerate(tags):
+            for location in map(graph.index, graph.locationsWithTag(tag)):
+                masks[location] = masks.get(location, 0) | (1 << bit)
+        start = graph.index(problem.startLocation)
+        ends = [graph.index(label) for label in graph.locationsWithTag(problem.endTag)]
+        coveredTags = 0
+        for mask in masks.values():
+            coveredTags |= mask
+        if coveredTags != fullMask or len(ends) == 0:
+            return
+
+        candidates = sorted(masks)
+        if len(candidates) > self.maxCandidates and len(tags) <= self.maxExactWaypoints:
+            self._searchStates(graph, start, masks, set(ends), fullMask, stopTime)
+            return
+
+        # Shortest path trees rooted at each candidate, and at (all) end locations; all
+        # connections are symmetric, so following the parents in the tree rooted at `b`
+        # from `a` gives the shortest path a -> b.
+        trees = {}
+        for root in candidates + [None]:
+            if time.perf_counter() > stopTime:
+                self.timedOut = True
+                return
+            sources = ends if root is None else [root]
+            costs, parents, numExplored = shortestPathCosts(graph, sources, candidates + [start])
+            trees[root] = (costs, parents)
+            self.numStatesExplored += numExplored
+        endCosts, endParents = trees.pop(None)
+
+        def cost(a: int, b: int) -> float:
+            return trees[b][0][a]
+
+        if len(tags) <= self.maxExactWaypoints:
+            route, totalCost = self._heldKarp(start, masks, candidates, fullMask, cost, endCosts, stopTime)
+        else:
+            route, totalCost = self._twoOpt(start, masks, tags, cost, endCosts, stopTime)
+        if route is None:
+            return
+
+        # Expand the route (start -> candidates -> end) into the full list of locations
+        labels, path, location = graph.labels, [], start
+        for candidate in route:
+            parents = trees[candidate][1]
+            while location != candidate:
+                location = parents[location]
+                path.append(labels[location])
+        while endParents[location] != -1:
+            location = endParents[location]
+            path.append(labels[location])
+
+        self.actions, self.pathCost = path, totalCost
+        self.pastCosts = {labels[candidate]: cost(start, candidate) for candidate in candidates}
+        if self.verbose >= 1:
+            print(f"numStatesExplored = {self.numStatesExplored}")
+            print(f"pathCost = {self.pathCost}")
+            print(f"actions = {self.actions}")
+
+    def _searchStates(self, graph, start, masks, ends, fullMask, stopTime):
+        """
+        Dijkstra search over (location, visited waypoints) states, packed as integers
+        `location * (fullMask + 1) + mask`, from the start (with the tags at the start
+        location already visited) to the first explored state at an end location with
+        all tags visited. Sets the same instance variables as `_findRoute`; states
+        aren't labels, so `self.pastCosts` maps each location to the cost of the first
+        state explored there (i.e., its cost from the start).
+        """
+        offsets, targets, weights, labels = graph.offsets, graph.targets, graph.weights, graph.labels
+        numMasks = fullMask + 1
+        startState = start * numMasks + masks.get(start, 0)
+        costs, parents = {startState: 0.0}, {startState: -1}
+        explored = set()
+        frontier = [(0.0, startState)]
+
+        while frontier:
+            pastCost, state = heapq.heappop(frontier)
+            if state in explored:
+                continue
+            explored.add(state)
+            self.numStatesExplored += 1
+            if self.numStatesExplored % TIME_CHECK_INTERVAL == 0 and time.perf_counter() > stopTime:
+                self.timedOut = True
+                return
+
+            location, mask = divmod(state, numMasks)
+            if labels[location] not in self.pastCosts:
+                self.pastCosts[labels[location]] = pastCost
+            if mask == fullMask and location in ends:
+                path = []
+                while state != startState:
+                    path.append(labels[state // numMasks])
+                    state = parents[state]
+                path.reverse()
+                self.actions, self.pathCost = path, pastCost
+                if self.verbose >= 1:
+                    print(f"numStatesExplored = {self.numStatesExplored}")
+                    print(f"pathCost = {self.pathCost}")
+                    print(f"actions = {self.actions}")
+                return
+
+            for edge in range(offsets[location], offsets[location + 1]):
+                nextLocation = targets[edge]
+                nextState = nextLocation * numMasks + (mask | masks.get(nextLocation, 0))
+                newCost = pastCost + weights[edge]
+                if newCost < costs.get(nextState, float("inf")):
+                    costs[nextState] = newCost
+                    parents[nextState] = state
+                    heapq.heappush(frontier, (newCost, nextState))
+
+    def _heldKarp(self, start, masks, candidates, fullMask, cost, endCosts, stopTime):
+        """
+        Held-Karp DP; `best[mask][j]` is the cheapest way to cover the tags in `mask`,
+        ending at `candidates[j]`. Returns (route of candidate ids, cost), or (None,
+        None) if there's no route or we run out of time (after `stopTime`).
+        """
+        startMask = masks.get(start, 0)
+        finalCost, finalState = endCosts[start] if startMask == fullMask else float("inf"), None
+
+        best: Dict[int, List[float]] = {}
+        backpointers: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        for j, candidate in enumerate(candidates):
+            mask = startMask | masks[candidate]
+            if mask != startMask:
+                row = best.setdefault(mask, [float("inf")] * len(candidates))
+                row[j] = min(row[j], cost(start, candidate))
+
+        # Masks only ever gain bits, so process them in increasing order
+        for mask in range(fullMask + 1):
+            if mask not in best:
+                continue
+            if time.perf_counter() > stopTime:
+                self.timedOut = True
+                return None, None
+            row = best[mask]
+            for j, pastCost in enumerate(row):
+                if pastCost == float("inf"):
+                    continue
+                if mask == fullMask:
+                    if pastCost + endCosts[candidates[j]] < finalCost:
+                        finalCost, finalState = pastCost + endCosts[candidates[j]], (mask, j)
+                    continue
+                for l, candidate in enumerate(candidates):
+                    nextMask = mask | masks[candidate]
+                    if nextMask == mask:
+                        continue
+                    newCost = pastCost + cost(candidates[j], candidate)
+                    nextRow = best.setdefault(nextMask, [float("inf")] * len(candidates))
+                    if newCost < nextRow[l]:
+                        nextRow[l] = newCost
+                        backpointers[(nextMask, l)] = (mask, j)
+
+        if finalCost == float("inf"):
+            return None, None
+        route = []
+        while finalState is not None:
+            route.append(candidates[finalState[1]])
+            finalState = backpointers.get(finalState)
+        route.reverse()
+        return route, finalCost
+
+    def _twoOpt(self, start, masks, tags, cost, endCosts, stopTime):
+        """
+        Heuristic for many waypoints; choose an *order* of tags (nearest neighbor, then
+        2-opt), scoring each order by the best choice of one candidate per tag (a small
+        layered shortest path problem). Returns (route of candidate ids, cost); 2-opt
+        stops early (keeping the best route so far) after `stopTime`.
+        """
+        members = [[c for c, mask in masks.items() if mask & (1 << bit)] for bit in range(len(tags))]
+
+        def evaluate(order: List[int]) -> Tuple[float, List[int]]:
+            # layer[c] = (cost to reach candidate c in the current layer, route)
+            layer = {start: (0.0, [])}
+            for bit in order:
+                layer = {
+                    c: min((pastCost + cost(p, c), route + [c]) for p, (pastCost, route) in layer.items())
+                    for c in members[bit]
+                }
+            return min((pastCost + endCosts[c], route) for c, (pastCost, route) in layer.items())
+
+        # Nearest neighbor order :: repeatedly visit the closest member of any remaining tag
+        order, remaining, location = [], set(range(len(tags))), start
+        while remaining:
+            bit, location = min(
+                ((bit, c) for bit in remaining for c in members[bit]),
+                key=lambda item: (cost(location, item[1]), item[0]),
+            )
+            order.append(bit)
+            remaining.remove(bit)
+
+        # 2-opt :: reverse segments of the order while that improves the route
+        bestCost, bestRoute = evaluate(order)
+        improved = True
+        while improved and time.perf_counter() <= stopTime:
+            improved = False
+            for i in range(len(order) - 1):
+                for j in range(i + 1, len(order)):
+                    newOrder = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                    newCost, newRoute = evaluate(newOrder)
+                    if newCost < bestCost - 1e-9:
+                        order, bestCost, bestRoute, improved = newOrder, newCost, newRoute, True
+
+        if bestCost == float("inf"):
+            return None, None
+        return bestRoute, bestCost
+
+
+########################################################################################
+# Many-to-many distance matrices
+#   > One (early-terminating) Dijkstra search per source location; each search stops
+#     once every target has been explored. Sources are independent, so the searches
+#     can be spread over a pool of worker processes; each worker receives the CSR
+#     arrays of the map once (when it starts), rather than once per source.
+
+
+class _CSRGraph(NamedTuple):
+    """The subset of `CompactCityMap` used by `shortestPathCosts` (cheap to pickle)."""
+    offsets: array
+    targets: array
+    weights: array
+    numLocations: int
+
+
+def _distanceRow(graph: CompactCityMap, targets: List[int], source: int) -> List[float]:
+    costs, _, _ = shortestPathCosts(graph, [source], targets)
+    return [costs[target] for target in targets]
+
+
+# Per-process state for `distanceMatrix` workers (set by `_initDistanceWorker`); only
+# ever set in worker processes
+_workerGraph: Optional[_CSRGraph] = None
+_workerTargets: List[int] = []
+
+
+def _initDistanceWorker(graph: _CSRGraph, targets: List[int]) -> None:
+    global _workerGraph, _workerTargets
+    _workerGraph, _workerTargets = graph, targets
+
+
+def _workerDistanceRow(source: int) -> List[float]:
+    return _distanceRow(_workerGraph, _workerTargets, source)
+
+
+def distanceMatrix(
+    cityMap: CityMap,
+    sources: Sequence[str],
+    targets: Optional[Sequence[str]] = None,
+    processes: int = 1,
+) -> np.ndarray:
+    """
+    Return the matrix of shortest path costs (in meters) between locations, where entry
+    `[i, j]` is the cost from `sources[i]` to `targets[j]` (`inf` if there's no path).
+
+    :param sources: Location labels (rows).
+    :param targets: Location labels (columns); defaults to `sources`.
+    :param processes: Number of worker processes to spread the (per-source) searches
+                      over; 1 runs all searches in the calling process.
+
+    Usage:
+        matrix = distanceMatrix(cityMap, origins, destinations, processes=4)
+    """
+    graph: CompactCityMap = cityMap.compact()
+    targets = sources if targets is None else targets
+    sourceIds = [graph.index(label) for label in sources]
+    targetIds = [graph.index(label) for label in targets]
+    matrix = np.full((len(sourceIds), len(targetIds)), float("inf"))
+    if len(sourceIds) == 0 or len(targetIds) == 0:
+        return matrix
+
+    if processes <= 1:
+        for i, source in enumerate(sourceIds):
+            matrix[i] = _distanceRow(graph, targetIds, source)
+        return matrix
+
+    # Copy the CSR arrays (which may be memoryviews into a memory-mapped file) into
+    # plain arrays, so that they can be sent to worker processes
+    csrGraph = _CSRGraph(
+        array("q", graph.offsets), array("i", graph.targets), array("d", graph.weights),
+        graph.numLocations,
+    )
+    chunkSize = max(1, len(sourceIds) // (4 * processes))
+    with ProcessPoolExecutor(
+        processes, initializer=_initDistanceWorker, initargs=(csrGraph, targetIds)
+    ) as executor:
+        for i, row in enumerate(executor.map(_workerDistanceRow, sourceIds, chunksize=chunkSize)):
+            matrix[i] = row
+    return matrix
+
+
+########################################################################################
+# Cached shortest path trees
+#   > A one-to-all Dijkstra search from a location gives the shortest path to *every*
+#     location, so any later query from the same start (to any end tag) is a lookup
+#     plus unwinding the parents. Trees are kept in a least-recently-used (LRU) cache,
+#     bounded by the memory used by their arrays.
+
+
+class ShortestPathTreeCache:
+    """
+    LRU cache of shortest path trees (costs and parents, indexed by location id) keyed
+    by start location; each tree takes 12 bytes per location.
+
+    Usage:
+        cache = ShortestPathTreeCache(cityMap, maxBytes=64 * 2**20)
+        actions, cost = cache.query(startLocation, endTag)
+    """
+    def __init__(self, cityMap: CityMap, maxBytes: int = 64 * 2**20):
+        """
+        :param maxBytes: Memory budget for the cached trees; the least recently used
+                         trees are evicted once it is exceeded (the most recent tree is
+                         always kept).
+        """
+        self.cityMap = cityMap
+        self.maxBytes = maxBytes
+        self.graph: CompactCityMap = cityMap.compact()
+        self.trees: "OrderedDict[int, Tuple[array, array]]" = OrderedDict()
+        self.numBytes = 0
+        self.hits, self.misses = 0, 0
+
+        # Number of locations explored by the last call to `tree` (0 if it was cached)
+        self.numExplored = 0
+
+    def tree(self, startLocation: str) -> Tuple[array, array]:
+        """Return (costs, parents) of the shortest path tree rooted at `startLocation`."""
+        # Connections changed since the trees were computed (see `CityMap.compact`)
+        if self.cityMap.compact() is not self.graph:
+            self.clear()
+            self.graph = self.cityMap.compact()
+
+        start = self.graph.index(startLocation)
+        tree = self.trees.get(start)
+        if tree is not None:
+            self.hits += 1
+            self.numExplored = 0
+            self.trees.move_to_end(start)
+            return tree
+
+        self.misses += 1
+        costs, parents, self.numExplored = shortestPathCosts(self.graph, [start])
+        tree = (array("d", costs), array("i", parents))
+        self.trees[start] = tree
+        self.numBytes += self._treeBytes(tree)
+        while self.numBytes > self.maxBytes and len(self.trees) > 1:
+            _, evicted = self.trees.popitem(last=False)
+            self.numBytes -= self._treeBytes(evicted)
+        return tree
+
+    def query(self, startLocation: str, endTag: str) -> Tuple[Optional[List[str]], Optional[float]]:
+        """
+        Return (actions, cost) for the shortest path from `startLocation` to any
+        location with `endTag` (same `actions` as `UniformCostSearch`); returns
+        (None, None) if there's no path.
+        """
+        costs, parents = self.tree(startLocation)
+        ends = [self.graph.index(label) for label in self.graph.locationsWithTag(endTag)]
+        end = min(ends, key=lambda location: costs[location], default=None)
+        if end is None or costs[end] == float("inf"):
+            return None, None
+        return unwindPath(parents, self.graph.labels, end), costs[end]
+
+    def clear(self) -> None:
+        self.trees.clear()
+        self.numBytes = 0
+
+    @staticmethod
+    def _treeBytes(tree: Tuple[array, array]) -> int:
+        return sum(len(values) * values.itemsize for values in tree)
+
+
+class CachedTreeSearch(SearchAlgorithm):
+    def __init__(self, cache: ShortestPathTreeCache, verbose: int = 0):
+        """
+        A `SearchAlgorithm` that answers `ShortestPathProblem` queries with a
+        `ShortestPathTreeCache` (which must be built over `problem.cityMap`).
+        """
+        super().__init__()
+        self.cache = cache
+        self.verbose = verbose
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Sets the same instance variables as `UniformCostSearch`, except that
+        `self.numStatesExplored` is the number of locations explored to build the tree
+        (0 if it was cached), and `self.pastCosts` is left empty (the full tree is
+        available from `self.cache.tree(problem.startLocation)`). The path has the
+        same cost as the one found by `UniformCostSearch`, but the tree (and so the
+        path) is built with ties broken by location id (see above).
+        """
+        self.pastCosts = {}
+        self.metrics = SearchMetrics()
+        startTime = time.perf_counter()
+        self.actions, self.pathCost = self.cache.query(problem.startLocation, problem.endTag)
+        self.numStatesExplored = self.cache.numExplored
+        if self.verbose >= 1:
+            print(f"numStatesExplored = {self.numStatesExplored}")
+            print(f"pathCost = {self.pathCost}")
+            print(f"actions = {self.actions}")
+
+        self.metrics.numStatesExplored = self.numStatesExplored
+        self.metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+########################################################################################
+# Incremental re-planning (D* Lite)
+#   > Searches *backward* from the end locations, maintaining for every location `v`
+#     its cost-to-end `g(v)` and a one-step lookahead `rhs(v)` (the lowest cost of a
+#     connection `v --> w` plus `g(w)`). A location is "inconsistent" when the two
+#     differ; only inconsistent locations are (re)explored, in order of
+#     min(g, rhs) + (straight-line distance from the start, scaled down by
+#     `CompactCityMap.straightLineFactor` on maps with shorter connections).
+#
+#   > When connections change (see `CityMap.updateConnections`), only the `rhs` values
+#     of their sources need to be recomputed, and the repair work is limited to the
+#     part of the search that depends on those connections. The start location may
+#     also move (e.g., along the route being traveled), without starting over.
+#
+#   > Reference: Koenig & Likhachev, "D* Lite" (2002); the backward search from a fixed
+#                set of end locations is an LPA* ("Lifelong Planning A*") search.
+
+
+class DStarLiteSearch(SearchAlgorithm):
+    def __init__(self, verbose: int = 0):
+        """
+        A `SearchAlgorithm` for `ShortestPathProblem`s (start location, end tag, and
+        city map) that keeps its search state across calls to `solve`: as long as the
+        map and end tag stay the same, later calls (after connections change, or from
+        another start location) only repair the previous search.
+
+        Connection changes are picked up through `CityMap.addConnectionListener`;
+        call `reset()` after adding locations or connections to the map.
+        """
+        super().__init__()
+        self.verbose = verbose
+        self.cityMap: Optional[CityMap] = None
+        self.endTag: Optional[str] = None
+        # (source, target) -> latest distance, for connections changed since the last
+        # `solve` (so at most one entry per connection)
+        self.pending: Dict[Tuple[str, str], float] = {}
+
+    def reset(self) -> None:
+        """Forget all search state; the next `solve` starts from scratch."""
+        if self.cityMap is not None:
+            self.cityMap.removeConnectionListener(self._onConnectionsUpdated)
+        self.cityMap, self.endTag = None, None
+        self.pending = {}
+
+    def _onConnectionsUpdated(self, changes: List[ConnectionUpdate]) -> None:
+        for source, target, _, newDistance in changes:
+            self.pending[(source, target)] = newDistance
+
+    def _initialize(self, cityMap: CityMap, endTag: str) -> None:
+        self.reset()
+        self.cityMap, self.endTag = cityMap, endTag
+        cityMap.addConnectionListener(self._onConnectionsUpdated)
+
+        # Our own copy of the distances (which `_applyUpdates` keeps up to date), and for
+        # each connection `v --> w`, the index of the connection `w --> v`
+        self.graph: CompactCityMap = cityMap.compact()
+        graph, inf = self.graph, float("inf")
+        self.weights = array("d", graph.weights)
+        self.reverseEdges = array("q", bytes(8 * len(graph.targets)))
+        for location in range(graph.numLocations):
+            for edge in range(graph.offsets[location], graph.offsets[location + 1]):
+                self.reverseEdges[edge] = graph.edge(graph.targets[edge], location)
+
+        # Cost-to-end estimates, and the priority queue of inconsistent locations
+        # (heap of (key, location), with lazy deletion; `queued` holds current keys)
+        self.costs = array("d", [inf]) * graph.numLocations
+        self.lookaheads = array("d", [inf]) * graph.numLocations
+        self.isEnd = bytearray(graph.numLocations)
+        self.heap: List[Tuple[float, float, int]] = []
+        self.queued: Dict[int, Tuple[float, float]] = {}
+
+        # Keys are offset by `keyModifier`, which grows whenever the start moves (rather
+        # than recomputing the keys of all queued locations)
+        self.start, self.keyModifier = -1, 0.0
+        self.latitudes, self.longitudes, self.cosines = graph.trigonometry()
+        # (Stays valid: `CityMap.updateConnections` never shortens a connection below this)
+        self.straightLineFactor = graph.straightLineFactor()
+
+        for end in map(graph.index, graph.locationsWithTag(endTag)):
+            self.isEnd[end] = 1
+            self.lookaheads[end] = 0.0
+            self.heap.append((0.0, 0.0, end))
+            self.queued[end] = (0.0, 0.0)
+        heapq.heapify(self.heap)
+
+    def _straightLine(self, source: int, target: int) -> float:
+        latitudes, longitudes, cosines = self.latitudes, self.longitudes, self.cosines
+        sinLat = sin((latitudes[target] - latitudes[source]) / 2)
+        sinLon = sin((longitudes[target] - longitudes[source]) / 2)
+        haversine = sinLat * sinLat + cosines[source] * cosines[target] * sinLon * sinLon
+        return 2 * RADIUS_EARTH * self.straightLineFactor * asin(sqrt(min(haversine, 1.0)))
+
+    def _key(self, location: int) -> Tuple[float, float]:
+        cost = min(self.costs[location], self.lookaheads[location])
+        return (cost + self._straightLine(self.start, location) + self.keyModifier, cost)
+
+    def _updateLocation(self, location: int) -> None:
+        """(Re)queue `location` if it's inconsistent, otherwise dequeue it."""
+        if self.costs[location] != self.lookaheads[location]:
+            key = self._key(location)
+            self.queued[location] = key
+            heapq.heappush(self.heap, (key[0], key[1], location))
+        else:
+            self.queued.pop(location, None)
+
+    def _lookahead(self, location: int) -> float:
+        """Lowest cost of a connection out of `location` plus the cost-to-end from there."""
+        offsets, targets, weights, costs = self.graph.offsets, self.graph.targets, self.weights, self.costs
+        return min(
+            (weights[edge] + costs[targets[edge]] for edge in range(offsets[location], offsets[location + 1])),
+            default=float("inf"),
+        )
+
+    def _applyUpdates(self) -> bool:
+        """Apply pending connection changes; returns False if they don't fit the map."""
+        weights, costs, lookaheads, isEnd = self.weights, self.costs, self.lookaheads, self.isEnd
+        labelIndex = self.graph.labelIndex
+        pending, self.pending = self.pending, {}
+        for (source, target), newDistance in pending.items():
+            location, neighbor = labelIndex.get(source), labelIndex.get(target)
+            edge = self.graph.edge(location, neighbor) if location is not None and neighbor is not None else -1
+            if edge == -1:
+                return False
+            oldDistance, weights[edge] = weights[edge], newDistance
+            if isEnd[location]:
+                continue
+            if newDistance < oldDistance:
+                lookaheads[location] = min(lookaheads[location], newDistance + costs[neighbor])
+            elif lookaheads[location] == oldDistance + costs[neighbor]:
+                lookaheads[location] = self._lookahead(location)
+            self._updateLocation(location)
+        return True
+
+    def _computeShortestPath(self) -> int:
+        """Repair the search until the start is consistent; returns #locations explored."""
+        offsets, targets, weights = self.graph.offsets, self.graph.targets, self.weights
+        costs, lookaheads, isEnd = self.costs, self.lookaheads, self.isEnd
+        reverseEdges, heap, queued = self.reverseEdges, self.heap, self.queued
+        start, inf, numExplored = self.start, float("inf"), 0
+
+        while True:
+            # Skip outdated heap entries
+            while heap and queued.get(heap[0][2]) != heap[0][:2]:
+                heapq.heappop(heap)
+            topKey, location = (heap[0][:2], heap[0][2]) if heap else ((inf, inf), -1)
+            if topKey >= self._key(start) and lookaheads[start] <= costs[start]:
+                break
+
+            # Keys only grow as the start moves; requeue with an up-to-date key
+            newKey = self._key(location)
+            if topKey < newKey:
+                queued[location] = newKey
+                heapq.heapreplace(heap, (newKey[0], newKey[1], location))
+                continue
+            heapq.heappop(heap)
+            del queued[location]
+            numExplored += 1
+            if self.verbose >= 2:
+                print(f"Exploring {self.graph.labels[location]} with cost-to-end {lookaheads[location]}")
+
+            edges = range(offsets[location], offsets[location + 1])
+            if costs[location] > lookaheads[location]:
+                # Cost-to-end decreased :: neighbors might now be cheaper via `location`
+                cost = costs[location] = lookaheads[location]
+                for edge in edges:
+                    neighbor = targets[edge]
+                    newLookahead = weights[reverseEdges[edge]] + cost
+                    if not isEnd[neighbor] and newLookahead < lookaheads[neighbor]:
+                        lookaheads[neighbor] = newLookahead
+                        self._updateLocation(neighbor)
+            else:
+                # Cost-to-end increased :: recompute neighbors that relied on `location`
+                oldCost, costs[location] = costs[location], inf
+                for edge in edges:
+                    neighbor = targets[edge]
+                    if not isEnd[neighbor] and lookaheads[neighbor] == weights[reverseEdges[edge]] + oldCost:
+                        lookaheads[neighbor] = self._lookahead(neighbor)
+                        self._updateLocation(neighbor)
+                self._updateLocation(location)
+        return numExplored
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Find (or repair) the shortest path for `problem`, which must define
+        `startLocation`, `endTag`, and `cityMap` (e.g., `ShortestPathProblem`).
+
+        Sets the same instance variables as `UniformCostSearch`, except that
+        `self.numStatesExplored` only counts the locations (re)explored by this call,
+        and `self.pastCosts` maps the locations along the path to their cost from the
+        start.
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.pastCosts: Dict[str, float] = {}
+        self.metrics = SearchMetrics()
+        startTime = time.perf_counter()
+
+        if problem.cityMap is not self.cityMap or problem.endTag != self.endTag or not self._applyUpdates():
+            self._initialize(problem.cityMap, problem.endTag)
+        start = self.graph.index(problem.startLocation)
+        if self.start != -1 and start != self.start:
+            self.keyModifier += self._straightLine(self.start, start)
+        self.start = start
+        self.numStatesExplored = self._computeShortestPath()
+
+        # Follow the cheapest connections from the start; each step costs exactly the
+        # decrease in cost-to-end, so the path cost is the start's cost-to-end
+        offsets, targets, weights, costs = self.graph.offsets, self.graph.targets, self.weights, self.costs
+        labels, location, pathCost = self.graph.labels, start, 0.0
+        actions = []
+        self.pastCosts[labels[start]] = 0.0
+        while not self.isEnd[location] and len(actions) < self.graph.numLocations:
+            edge = min(
+                range(offsets[location], offsets[location + 1]),
+                key=lambda edge: weights[edge] + costs[targets[edge]],
+                default=None,
+            )
+            if edge is None or weights[edge] + costs[targets[edge]] == float("inf"):
+                break
+            location, pathCost = targets[edge], pathCost + weights[edge]
+            actions.append(labels[location])
+            self.pastCosts[labels[location]] = pathCost
+        if self.isEnd[location]:
+            self.actions, self.pathCost = actions, pathCost
+
+        if self.verbose >= 1:
+            print(f"numStatesExplored = {self.numStatesExplored}")
+            print(f"pathCost = {self.pathCost}")
+            print(f"actions = {self.actions}")
+
+        self.metrics.numStatesExplored = self.numStatesExplored
+        self.metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+########################################################################################
+# Time-dependent routing
+#   > With time-dependent travel times (see `TravelTimeProfiles`), the cost of a
+#     connection depends on when we get there. As long as every travel time function
+#     is FIFO (leaving later never means arriving earlier), Dijkstra's algorithm still
+#     works on *arrival times*: each location is explored at its earliest arrival time,
+#     and each connection is followed at that time.
+#
+#   > Profile queries :: rather than one search per departure time, a single search
+#     propagates the whole arrival time function (of the departure time, over a
+#     window) to each location. Arrival functions are piecewise linear, so following
+#     a connection (function composition) and combining two routes (lower envelope)
+#     only involve their breakpoints.
+#
+#   > Reference: Dreyfus, "An Appraisal of Some Shortest-Path Algorithms" (1969);
+#                Delling & Wagner, "Time-Dependent Route Planning" (2009).
+
+
+class TimeDependentSearch(SearchAlgorithm):
+    def __init__(
+        self,
+        profiles: TravelTimeProfiles,
+        departureTime: float,
+        useHeuristic: bool = True,
+        verbose: int = 0,
+    ):
+        """
+        A `SearchAlgorithm` for the earliest arrival at a location with `problem.endTag`
+        from `problem.startLocation` (e.g., `ShortestPathProblem`), leaving at
+        `departureTime` (in seconds), with travel times from `profiles` (which must be
+        built over `problem.cityMap`).
+
+        With `useHeuristic=True`, this is A* search with the straight-line distance to
+        the nearest end location (scaled by `CompactCityMap.straightLineFactor`) at the
+        fastest speed of any connection (see `TravelTimeProfiles.maxSpeed`) as the
+        heuristic.
+        """
+        super().__init__()
+        self.profiles = profiles
+        self.departureTime = departureTime
+        self.useHeuristic = useHeuristic
+        self.verbose = verbose
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Sets the same instance variables as `UniformCostSearch`, where costs are travel
+        times (in seconds) rather than distances; in particular, `self.pastCosts` maps
+        each explored location to the earliest time it can be reached (minus the
+        departure time). Also sets
+            - self.arrivalTime: float (or None if no end location can be reached)
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.arrivalTime: Optional[float] = None
+        self.numStatesExplored: int = 0
+        self.pastCosts: Dict[str, float] = {}
+        self.metrics = metrics = SearchMetrics()
+        startTime = time.perf_counter()
+
+        profiles = self.profiles
+        graph, travelTime = profiles.graph, profiles.travelTime
+        labels, hasTag, endTag = graph.labels, graph.hasTag, problem.endTag
+        offsets, targets = graph.offsets, graph.targets
+
+        # Lower bound on the remaining travel time (memoized per location); see
+        # `CompactCityMap.straightLineFactor` for maps with shorter connections
+        estimates: Dict[int, float] = {}
+        evaluator = StraightLineEvaluator(graph, graph.locationsWithTag(endTag)) if self.useHeuristic else None
+        scale = graph.straightLineFactor() / profiles.maxSpeed
+
+        def estimate(location: int) -> float:
+            if evaluator is None:
+                return 0.0
+            value = estimates.get(location)
+            if value is None:
+                value = estimates[location] = evaluator.distance(labels[location]) * scale
+            return value
+
+        start, departure = graph.index(problem.startLocation), self.departureTime
+        arrivals: Dict[int, float] = {start: departure}
+        parents: Dict[int, int] = {start: -1}
+        explored = set()
+        frontier = [(departure + estimate(start), start)]
+        numPushes, numStalePops, maxFrontierSize = 1, 0, 1
+        while frontier:
+            _, location = heapq.heappop(frontier)
+            if location in explored:
+                numStalePops += 1
+                continue
+            explored.add(location)
+            arrival = arrivals[location]
+            self.pastCosts[labels[location]] = arrival - departure
+            self.numStatesExplored += 1
+            if self.verbose >= 2:
+                print(f"Exploring {labels[location]} at time {arrival}")
+
+            if hasTag(labels[location], endTag):
+                path = [location]
+                while parents[path[-1]] != -1:
+                    path.append(parents[path[-1]])
+                self.actions = [labels[location] for location in reversed(path[:-1])]
+                self.arrivalTime, self.pathCost = arrival, arrival - departure
+                break
+
+            for edge in range(offsets[location], offsets[location + 1]):
+                nextLocation = targets[edge]
+                nextArrival = arrival + travelTime(edge, arrival)
+                if nextArrival < arrivals.get(nextLocation, float("inf")):
+                    arrivals[nextLocation] = nextArrival
+                    parents[nextLocation] = location
+                    heapq.heappush(frontier, (nextArrival + estimate(nextLocation), nextLocation))
+                    numPushes += 1
+            if len(frontier) > maxFrontierSize:
+                maxFrontierSize = len(frontier)
+
+        if self.verbose >= 1:
+            print(f"numStatesExplored = {self.numStatesExplored}")
+            print(f"pathCost = {self.pathCost}")
+            print(f"actions = {self.actions}")
+
+        metrics.numStatesExplored, metrics.numPushes = self.numStatesExplored, numPushes
+        metrics.numStalePops, metrics.maxFrontierSize = numStalePops, maxFrontierSize
+        metrics.numHeuristicCalls = len(estimates)
+        metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+class ArrivalProfile(NamedTuple):
+    """
+    Earliest arrival time as a (piecewise-linear, non-decreasing) function of the
+    departure time, given by its breakpoints; `profile(departure)` evaluates it.
+    """
+    departures: np.ndarray
+    arrivals: np.ndarray
+
+    def __call__(self, departure: float) -> float:
+        return float(np.interp(departure, self.departures, self.arrivals))
+
+    def travelTime(self, departure: float) -> float:
+        return self(departure) - departure
+
+
+# Arrival functions in the profile search are NumPy arrays of breakpoints (xs, ys),
+# all over the same range of departure times; `np.interp` evaluates them, and like
+# travel time functions, it's constant beyond the first/last breakpoints.
+
+
+def _link(profiles: TravelTimeProfiles, edge: int, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Arrival function after following connection `edge`, given the arrival function
+    (xs, ys) at its source :: y -> y + travelTime(edge, y).
+    """
+    times, travelTimes = profiles.breakpoints(edge)
+    if len(times) == 0:
+        return xs, ys + profiles.travelTime(edge, 0.0)
+
+    # Breakpoints of the composition :: those of (xs, ys), plus the departures at
+    # which we reach `edge` exactly at one of its breakpoints (ys is non-decreasing,
+    # so we can invert it with `np.interp`)
+    times, travelTimes = np.frombuffer(times), np.frombuffer(travelTimes)
+    inner = times[(times > ys[0]) & (times < ys[-1])]
+    if len(inner) > 0:
+        newXs = np.union1d(xs, np.interp(inner, ys, xs))
+        xs, ys = newXs, np.interp(newXs, xs, ys)
+    return xs, ys + np.interp(ys, times, travelTimes)
+
+
+def _lowerEnvelope(
+    xs1: np.ndarray, ys1: np.ndarray, xs2: np.ndarray, ys2: np.ndarray, tolerance: float
+) -> Tuple[np.ndarray, np.ndarray, bool]:
+    """
+    Return the breakpoints of min(f1, f2), and whether f2 is below f1 (by more than
+    `tolerance`) anywhere.
+    """
+    xs = np.union1d(xs1, xs2)
+    values1, values2 = np.interp(xs, xs1, ys1), np.interp(xs, xs2, ys2)
+    if not np.any(values2 < values1 - tolerance):
+        return xs1, ys1, False
+
+    # Add the points where the functions cross (strictly between two breakpoints)
+    differences = values1 - values2
+    crossings = np.flatnonzero(differences[:-1] * differences[1:] < 0)
+    if len(crossings) > 0:
+        fractions = differences[crossings] / (differences[crossings] - differences[crossings + 1])
+        crossingXs = xs[crossings] + fractions * (xs[crossings + 1] - xs[crossings])
+        crossingYs = values1[crossings] + fractions * (values1[crossings + 1] - values1[crossings])
+        order = np.argsort(np.concatenate([xs, crossingXs]), kind="stable")
+        xs = np.concatenate([xs, crossingXs])[order]
+        envelope = np.concatenate([np.minimum(values1, values2), crossingYs])[order]
+    else:
+        envelope = np.minimum(values1, values2)
+    xs, envelope = _simplify(xs, envelope, tolerance)
+    return xs, envelope, True
+
+
+def _dominates(f1: Tuple[np.ndarray, np.ndarray], xs2: np.ndarray, ys2: np.ndarray, tolerance: float) -> bool:
+    """Return whether f1 <= f2 + tolerance everywhere."""
+    xs = np.union1d(f1[0], xs2)
+    return bool(np.all(np.interp(xs, *f1) <= np.interp(xs, xs2, ys2) + tolerance))
+
+
+def _simplify(xs: np.ndarray, ys: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Drop breakpoints that are (within `tolerance`) on the line through their neighbors;
+    each pass only drops non-adjacent breakpoints, so every pass changes the function
+    by at most `tolerance`.
+    """
+    for _ in range(4):
+        if len(xs) <= 2:
+            break
+        widths = np.diff(xs)
+        slopes = np.diff(ys) / np.where(widths > 0, widths, 1.0)
+        # Distance from each inner breakpoint to the line through its neighbors
+        deviations = np.abs(slopes[1:] - slopes[:-1]) * widths[:-1] * widths[1:] / (widths[:-1] + widths[1:])
+        drop = np.zeros(len(xs), dtype=bool)
+        drop[1:-1] = deviations <= tolerance
+        drop[2:-1] &= ~drop[1:-2]
+        if not drop.any():
+            break
+        xs, ys = xs[~drop], ys[~drop]
+    return xs, ys
+
+
+def arrivalProfile(
+    profiles: TravelTimeProfiles,
+    startLocation: str,
+    endTag: str,
+    earliestDeparture: float,
+    latestDeparture: float,
+    tolerance: float = 1e-3,
+) -> Optional[ArrivalProfile]:
+    """
+    Return the earliest arrival time at a location with `endTag` as a function of the
+    departure time from `startLocation`, for departures within [earliestDeparture,
+    latestDeparture] (or None if no end location can be reached).
+
+    Arrival functions are propagated in order of (earliest arrival + a lower bound on
+    the remaining travel time, as in `TimeDependentSearch`), until no queued location
+    can improve the profile anywhere. Breakpoints that change an arrival function by
+    at most `tolerance` seconds are dropped along the way.
+    """
+    graph = profiles.graph
+    labels, offsets, targets, hasTag = graph.labels, graph.offsets, graph.targets, graph.hasTag
+    evaluator = StraightLineEvaluator(graph, graph.locationsWithTag(endTag))
+    estimates: Dict[int, float] = {}
+    scale = graph.straightLineFactor() / profiles.maxSpeed
+
+    def estimate(location: int) -> float:
+        value = estimates.get(location)
+        if value is None:
+            value = estimates[location] = evaluator.distance(labels[location]) * scale
+        return value
+
+    # Location id -> arrival function (xs, ys); the queue holds (lower bound on the
+    # arrival at an end location, location id) for locations whose function changed
+    start = graph.index(startLocation)
+    window = np.unique([earliestDeparture, max(earliestDeparture, latestDeparture)])
+    arrivalFunctions: Dict[int, Tuple[np.ndarray, np.ndarray]] = {start: (window, window.copy())}
+    frontier = [(earliestDeparture + estimate(start), start)]
+    end: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    while frontier:
+        bound, location = heapq.heappop(frontier)
+        xs, ys = arrivalFunctions[location]
+        if bound != ys[0] + estimate(location):
+            # Outdated entry, skip
+            continue
+        if end is not None and bound >= end[1][-1]:
+            # Can't arrive before the profile's latest arrival
+            break
+        if end is not None and _dominates(end, xs, ys + estimate(location), tolerance):
+            # Can't improve the profile for any departure time
+            continue
+
+        if hasTag(labels[location], endTag):
+            end = (xs, ys) if end is None else _lowerEnvelope(end[0], end[1], xs, ys, tolerance)[:2]
+            continue
+
+        for edge in range(offsets[location], offsets[location + 1]):
+            nextLocation = targets[edge]
+            newXs, newYs = _link(profiles, edge, xs, ys)
+            nextEstimate = estimate(nextLocation)
+            if end is not None and (
+                newYs[0] + nextEstimate >= end[1][-1]
+                or _dominates(end, newXs, newYs + nextEstimate, tolerance)
+            ):
+                continue
+            current = arrivalFunctions.get(nextLocation)
+            if current is None:
+                arrivalFunctions[nextLocation] = _simplify(newXs, newYs, tolerance)
+            else:
+                mergedXs, mergedYs, improved = _lowerEnvelope(current[0], current[1], newXs, newYs, tolerance)
+                if not improved:
+                    continue
+                arrivalFunctions[nextLocation] = (mergedXs, mergedYs)
+            heapq.heappush(frontier, (arrivalFunctions[nextLocation][1][0] + estimate(nextLocation), nextLocation))
+
+    if end is None:
+        return None
+    return ArrivalProfile(end[0], end[1])
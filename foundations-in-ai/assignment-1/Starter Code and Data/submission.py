@@ -1,8 +1,11 @@
-from typing import List, Tuple
+from typing import Dict, List, Tuple
+
+import numpy as np
 
 from mapUtil import (
     CityMap,
-    computeDistance,
+    StraightLineEvaluator,
+    computeDistances,
     createSanJoseMap,
     locationFromTag,
     makeTag, getTotalCost,
@@ -49,7 +52,7 @@ class ShortestPathProblem(SearchProblem):
 
         # Check if the current location has the target endTag among its tags
         # Return true if we've reached a valid end location
-        return self.endTag in self.cityMap.tags[state.location]
+        return self.cityMap.hasTag(state.location, self.endTag)
 
         # END_YOUR_CODE
 
@@ -63,6 +66,9 @@ class ShortestPathProblem(SearchProblem):
         successors = []
         # Look upp all the locations connected to the current location in cityMap
         for nextLocation, distance in self.cityMap.distances[state.location].items():
+            # Skip closed connections (see `CityMap.updateConnections`)
+            if distance == float("inf"):
+                continue
             # Create a new state with only the next location
             nextState = State(nextLocation)
             # Add successor with action => nextLocation, newState, and cost => distance
@@ -130,12 +136,21 @@ class WaypointsShortestPathProblem(SearchProblem):
         # We want waypointTags to be consistent/canonical (sorted) and hashable (tuple)
         self.waypointTags = tuple(sorted(waypointTags))
 
+        # Waypoint tag `i` corresponds to bit `1 << i`; precompute the bitmask of the
+        # waypoint tags at each location (locations without waypoint tags are omitted)
+        self.waypointBits = {}
+        for bit, tag in enumerate(self.waypointTags):
+            for location in self.cityMap.locationsWithTag(tag):
+                self.waypointBits[location] = self.waypointBits.get(location, 0) | (1 << bit)
+        self.allWaypoints = (1 << len(self.waypointTags)) - 1
+
     def startState(self) -> State:
         # BEGIN_YOUR_CODE 
 
-        # Initialize state with starting location and empty frozenset for visited waypoints
-        # Use frozenset since it's hashable (required for State's memory)
-        return State(self.startLocation, memory=frozenset())
+        # Initialize state with starting location and a bitmask of visited waypoints
+        # Use an int since it's hashable (required for State's memory) and cheap to update;
+        # the start location itself may already cover some waypoints
+        return State(self.startLocation, memory=self.waypointBits.get(self.startLocation, 0))
 
         # END_YOUR_CODE
 
@@ -144,9 +159,9 @@ class WaypointsShortestPathProblem(SearchProblem):
 
         # Two conditions need to be met:
         # 1. Current location has the endTag
-        # 2. All required waypoints have been visited (stored in memory)
-        has_end_tag = self.endTag in self.cityMap.tags[state.location]
-        all_waypoints_visited = all(waypoint in state.memory for waypoint in self.waypointTags)
+        # 2. All required waypoints have been visited (all bits set in memory)
+        has_end_tag = self.cityMap.hasTag(state.location, self.endTag)
+        all_waypoints_visited = state.memory == self.allWaypoints
         return has_end_tag and all_waypoints_visited
 
         # END_YOUR_CODE
@@ -155,13 +170,14 @@ class WaypointsShortestPathProblem(SearchProblem):
         # BEGIN_YOUR_CODE 
 
         successors = []
+        waypointBits = self.waypointBits
         # Get all connected locations and their distances
         for nextLoc, distance in self.cityMap.distances[state.location].items():
-            # Find any waypointTags at the next location
-            current_waypoints = frozenset(tag for tag in self.cityMap.tags[nextLoc] 
-                                        if tag in self.waypointTags)
-            # Combine previously visited waypoints with new ones
-            updated_waypoints = state.memory.union(current_waypoints)
+            # Skip closed connections (see `CityMap.updateConnections`)
+            if distance == float("inf"):
+                continue
+            # Combine previously visited waypoints with any waypoints at the next location
+            updated_waypoints = state.memory | waypointBits.get(nextLoc, 0)
             # Create new state with updated location and waypoints
             nextState = State(nextLoc, memory=updated_waypoints)
             successors.append((nextLoc, nextState, distance))
@@ -237,12 +253,18 @@ def aStarReduction(problem: SearchProblem, heuristic: Heuristic) -> SearchProble
 
             # Get successors from original problem
             successors = []
+            currentHeuristic = heuristic.evaluate(state)
             for action, nextState, cost in problem.successorsAndCosts(state):
+                # Closed connections can't be part of any path
+                if cost == float("inf"):
+                    continue
                 # Modify cost to include heuristic estimate for A*
                 # f(n) = g(n) + h(n) where:
                 # g(n) = cost to reach node (original cost)
                 # h(n) = estimated cost to goal (heuristic)
-                newCost = cost + heuristic.evaluate(nextState)
+                # The reduced cost cost + h(next) - h(current) telescopes along a path,
+                # so the total reduced cost of reaching `n` is g(n) + h(n) - h(start).
+                newCost = cost + heuristic.evaluate(nextState) - currentHeuristic
                 successors.append((action, nextState, newCost))
             return successors
 
@@ -268,10 +290,19 @@ class StraightLineHeuristic(Heuristic):
         # BEGIN_YOUR_CODE
 
         # Find all locations that have the endTag and store their locations
-        self.endLocations = []
-        for location, tags in self.cityMap.tags.items():
-            if self.endTag in tags:
-                self.endLocations.append(location)
+        self.endLocations = list(self.cityMap.locationsWithTag(self.endTag))
+
+        # Precompute radians/cosines of the end locations (and, once per map, of every
+        # location), so that `evaluate` doesn't redo the trigonometry on every call; with
+        # many end locations, the evaluator only checks those near the current location
+        self.evaluator = StraightLineEvaluator(self.cityMap, self.endLocations)
+
+        # Location -> heuristic value; the same location is evaluated many times (e.g.,
+        # by `aStarReduction`, once as a successor and once as the current state). The
+        # cache is emptied whenever it reaches `maxCacheSize` entries, which bounds its
+        # memory use even if the heuristic is reused for many searches.
+        self.cache: Dict[str, float] = {}
+        self.maxCacheSize = 1 << 16
 
         # END_YOUR_CODE
 
@@ -282,16 +313,111 @@ class StraightLineHeuristic(Heuristic):
         if not self.endLocations:
             return 0.0
 
-        # Get current location's coordinates
-        currentLocation = self.cityMap.geoLocations[state.location]
-
         # Find minimum straight-line distance to any end location
-        min_distance = float('inf')
-        for endLoc in self.endLocations:
-            endLocation = self.cityMap.geoLocations[endLoc]
-            distance = computeDistance(currentLocation, endLocation)
-            min_distance = min(min_distance, distance)
+        distance = self.cache.get(state.location)
+        if distance is None:
+            if len(self.cache) >= self.maxCacheSize:
+                self.cache.clear()
+            distance = self.cache[state.location] = self.evaluator.distance(state.location)
+        return distance
+
+        # END_YOUR_CODE
+
+
+########################################################################################
+# Waypoint-aware heuristic for A* (for `WaypointsShortestPathProblem`)
 
-        return min_distance
 
-        # END_YOUR_CODE
\ No newline at end of file
+class WaypointsHeuristic(Heuristic):
+    """
+    Lower bound on the cost of visiting every remaining waypoint tag and then an
+    `endTag` location, for states of `WaypointsShortestPathProblem` (whose `memory` is
+    the bitmask of visited waypoints, with bit `i` <=> `sorted(waypointTags)[i]`).
+
+    Each remaining waypoint tag (and `endTag`) forms a "group" of locations, and the
+    distance between two groups is the minimum straight-line distance between their
+    members. Any remaining route visits every group (ending at the `endTag` group), so
+    its length is at least
+        - the straight-line distance to the farthest group, and
+        - the distance to the nearest group plus the minimum spanning tree (MST) over
+          the remaining groups (the visiting order itself spans them).
+    We return the larger of the two; MSTs are memoized on the remaining waypoints.
+    """
+    def __init__(self, waypointTags: List[str], endTag: str, cityMap: CityMap):
+        self.waypointTags = tuple(sorted(waypointTags))
+        self.endTag = endTag
+        self.cityMap = cityMap
+
+        # Group `i` < len(waypointTags) is waypoint tag `i`; the last group is `endTag`
+        self.groupLocations = [
+            list(cityMap.locationsWithTag(tag)) for tag in self.waypointTags + (endTag,)
+        ]
+        self.groupCoordinates = [
+            (
+                np.array([cityMap.geoLocations[location].latitude for location in locations]),
+                np.array([cityMap.geoLocations[location].longitude for location in locations]),
+            )
+            for locations in self.groupLocations
+        ]
+
+        # Like `StraightLineHeuristic`, fall back to 0 if some group has no locations
+        # (the problem has no solution anyway)
+        self.hasEmptyGroup = any(len(locations) == 0 for locations in self.groupLocations)
+
+        # Pairwise group distances (in meters)
+        numGroups = len(self.groupLocations)
+        self.groupDistances = np.zeros((numGroups, numGroups))
+        for i in range(numGroups):
+            for j in range(i + 1, numGroups):
+                self.groupDistances[i, j] = self.groupDistances[j, i] = min(
+                    (self._distancesTo(cityMap.geoLocations[location], j).min(initial=float("inf"))
+                     for location in self.groupLocations[i]),
+                    default=float("inf"),
+                )
+
+        # Memoized MST weights (keyed on the bitmask of visited waypoints), and location
+        # -> distances to each group
+        self.spanningTrees: Dict[int, float] = {}
+        self.locationDistances: Dict[str, np.ndarray] = {}
+
+    def _distancesTo(self, geoLocation, group: int) -> np.ndarray:
+        latitudes, longitudes = self.groupCoordinates[group]
+        return computeDistances(geoLocation.latitude, geoLocation.longitude, latitudes, longitudes)
+
+    def _spanningTree(self, memory: int) -> float:
+        """Weight of the MST over the groups not yet covered by `memory` (Prim's)."""
+        weight = self.spanningTrees.get(memory)
+        if weight is None:
+            groups = [
+                group for group in range(len(self.waypointTags)) if not memory & (1 << group)
+            ] + [len(self.waypointTags)]
+            distances = self.groupDistances[groups[0], groups]
+            inTree = np.zeros(len(groups), dtype=bool)
+            inTree[0], weight = True, 0.0
+            for _ in range(len(groups) - 1):
+                nearest = int(np.argmin(np.where(inTree, np.inf, distances)))
+                weight += float(distances[nearest])
+                inTree[nearest] = True
+                distances = np.minimum(distances, self.groupDistances[groups[nearest], groups])
+            self.spanningTrees[memory] = weight
+        return weight
+
+    def evaluate(self, state: State) -> float:
+        if self.hasEmptyGroup:
+            return 0.0
+
+        distances = self.locationDistances.get(state.location)
+        if distances is None:
+            geoLocation = self.cityMap.geoLocations[state.location]
+            distances = np.array([
+                self._distancesTo(geoLocation, group).min(initial=float("inf"))
+                for group in range(len(self.groupLocations))
+            ])
+            self.locationDistances[state.location] = distances
+
+        # Distances from the current location to the remaining groups
+        remaining = [
+            distances[group] for group in range(len(self.waypointTags))
+            if not state.memory & (1 << group)
+        ] + [distances[-1]]
+        return max(min(remaining) + self._spanningTree(state.memory), max(remaining))
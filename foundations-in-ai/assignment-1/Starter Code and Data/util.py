@@ -1,6 +1,10 @@
 import heapq
-from dataclasses import dataclass
-from typing import Dict, Hashable, List, Optional, Tuple
+import json
+import math
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
 
 ########################################################################################
 # Abstract Interfaces for State, Search Problems, and Search Algorithms.
@@ -41,6 +45,103 @@ class SearchProblem:
         raise NotImplementedError("Override me")
 
 
+@dataclass
+class SearchMetrics:
+    """
+    Counters (and, when profiling, timings in seconds) for a single call to `solve`.
+    Algorithms fill in the fields that apply to them; the rest stay 0. The baseline
+    searches below (`UniformCostSearch`, `AStarSearch`) only fill in the fields other
+    than `numStatesExplored` and `totalTime` when created with `profile=True`.
+    """
+    numStatesExplored: int = 0
+    numPushes: int = 0             # Frontier updates that inserted/improved a state
+    numStalePops: int = 0          # Outdated frontier entries skipped on removal
+    numSuccessorCalls: int = 0     # Calls to `problem.successorsAndCosts`
+    numSuccessors: int = 0         # Successors returned by those calls
+    numHeuristicCalls: int = 0     # Calls to `heuristic.evaluate`
+    maxFrontierSize: int = 0
+    totalTime: float = 0.0
+    successorTime: float = 0.0     # Time in `problem.successorsAndCosts`
+    isEndTime: float = 0.0         # Time in `problem.isEnd`
+    queueTime: float = 0.0         # Time in frontier operations
+    heuristicTime: float = 0.0     # Time in `heuristic.evaluate`
+
+    def asDict(self) -> Dict[str, float]:
+        return asdict(self)
+
+
+class MetricsTrace:
+    """
+    Metrics callback (see `SearchAlgorithm.addMetricsCallback`) that appends the
+    metrics of every search as one JSON object per line to the file at `path`.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def __call__(self, metrics: Dict[str, Any]) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps(metrics) + "\n")
+
+
+def timed(function: Callable, timings: SearchMetrics, field: str) -> Callable:
+    """Wrap `function` so that the time spent in each call is added to `timings.field`."""
+    def wrapper(*args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            setattr(timings, field, getattr(timings, field) + time.perf_counter() - start)
+    return wrapper
+
+
+def counted(function: Callable, counters: SearchMetrics, field: str) -> Callable:
+    """Wrap `function` so that each call adds 1 to `counters.field`."""
+    def wrapper(*args):
+        setattr(counters, field, getattr(counters, field) + 1)
+        return function(*args)
+    return wrapper
+
+
+def profiledCalls(problem: SearchProblem, frontier, metrics: SearchMetrics) -> Tuple[Callable, ...]:
+    """
+    Return `problem.isEnd`, `problem.successorsAndCosts`, `frontier.update`, and
+    `frontier.removeMin`, wrapped to time every call and to count successors, pushes
+    (updates returning True), and the frontier size (if `frontier` defines `__len__`)
+    in `metrics`. Searches only use these with `profile=True`, so that the counters
+    cost nothing otherwise.
+    """
+    successorsAndCosts = timed(
+        lambda state: list(problem.successorsAndCosts(state)), metrics, "successorTime"
+    )
+    update = timed(frontier.update, metrics, "queueTime")
+    removeMin = timed(frontier.removeMin, metrics, "queueTime")
+    frontierSize = getattr(frontier, "__len__", None)
+
+    def countedSuccessorsAndCosts(state: State) -> List[Tuple[str, State, float]]:
+        successors = successorsAndCosts(state)  # (as a list, even if the problem returns an iterator)
+        metrics.numSuccessorCalls += 1
+        metrics.numSuccessors += len(successors)
+        return successors
+
+    def countedUpdate(state: State, priority: float) -> bool:
+        pushed = update(state, priority)
+        if pushed:
+            metrics.numPushes += 1
+        return pushed
+
+    def countedRemoveMin() -> Tuple[Optional[State], Optional[float]]:
+        if frontierSize is not None:
+            metrics.maxFrontierSize = max(metrics.maxFrontierSize, frontierSize())
+        return removeMin()
+
+    return (
+        timed(problem.isEnd, metrics, "isEndTime"),
+        countedSuccessorsAndCosts,
+        countedUpdate,
+        countedRemoveMin,
+    )
+
+
 class SearchAlgorithm:
     def __init__(self):
         """
@@ -63,15 +164,38 @@ class SearchAlgorithm:
             - self.pastCosts: Dictionary mapping each string location visited by the
                               SearchAlgorithm to the corresponding cost to get there
                               from the starting location.
+
+            - self.metrics: `SearchMetrics` for the search (counters; timings, and
+                            for some algorithms all counters, only if the algorithm
+                            was created with `profile=True`). After each
+                            search, `self.metrics.asDict()` (plus the algorithm name
+                            and path cost) is passed to every metrics callback.
         """
         self.actions: List[str] = None
         self.pathCost: float = None
         self.numStatesExplored: int = 0
         self.pastCosts: Dict[str, float] = {}
+        self.metrics = SearchMetrics()
+        self.metricsCallbacks: List[Callable[[Dict[str, Any]], None]] = []
 
     def solve(self, problem: SearchProblem) -> None:
         raise NotImplementedError("Override me")
 
+    def addMetricsCallback(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """
+        Call `callback(metrics)` after every search, e.g.
+            search.addMetricsCallback(MetricsTrace("search-metrics.jsonl"))
+        """
+        self.metricsCallbacks.append(callback)
+
+    def reportMetrics(self) -> Dict[str, Any]:
+        """Return (and pass to all metrics callbacks) the metrics of the last search."""
+        metrics = {"algorithm": type(self).__name__, "pathCost": self.pathCost}
+        metrics.update(self.metrics.asDict())
+        for callback in self.metricsCallbacks:
+            callback(metrics)
+        return metrics
+
 
 class Heuristic:
     # A Heuristic object is defined by a single function `evaluate(state)` that
@@ -81,14 +205,45 @@ class Heuristic:
         raise NotImplementedError("Override me")
 
 
+# Searches with a time limit only read the clock once every `TIME_CHECK_INTERVAL`
+# explored states (reading it is about as expensive as exploring a state).
+TIME_CHECK_INTERVAL = 64
+
+
 ########################################################################################
 # Uniform Cost Search (Dijkstra's algorithm)
 
 
 class UniformCostSearch(SearchAlgorithm):
-    def __init__(self, verbose: int = 0):
+    def __init__(
+        self,
+        verbose: int = 0,
+        frontierFactory: Optional[Callable] = None,
+        profile: bool = False,
+        timeLimit: Optional[float] = None,
+    ):
+        """
+        `frontierFactory` is called (with no arguments) at the start of each `solve` to
+        create the frontier; any of the priority queues below can be used, e.g.
+            UniformCostSearch(frontierFactory=IndexedPriorityQueue)
+            UniformCostSearch(frontierFactory=lambda: BucketQueue(bucketWidth=1.0))
+
+        Defaults to `PriorityQueue`.
+
+        `self.metrics` always holds `numStatesExplored` and `totalTime`; with
+        `profile=True`, it also holds the other counters, and splits the time spent in
+        `isEnd`, `successorsAndCosts`, and frontier operations (see `profiledCalls`; at
+        some extra cost per call).
+
+        With a `timeLimit` (in seconds, for each `solve`), the search stops with
+        `self.timedOut` set if no path is found in time; the clock is only read every
+        `TIME_CHECK_INTERVAL` states (and never without a time limit).
+        """
         super().__init__()
         self.verbose = verbose
+        self.frontierFactory = frontierFactory or PriorityQueue
+        self.profile = profile
+        self.timeLimit = timeLimit
 
     def solve(self, problem: SearchProblem) -> None:
         """
@@ -99,6 +254,7 @@ class UniformCostSearch(SearchAlgorithm):
             - self.pathCost: float
             - self.numStatesExplored: int
             - self.pastCosts: Dict[str, float]
+            - self.timedOut: bool
 
         *Hint*: Some of these variables might be really helpful for Problem 3!
         """
@@ -106,22 +262,42 @@ class UniformCostSearch(SearchAlgorithm):
         self.pathCost: float = None
         self.numStatesExplored: int = 0
         self.pastCosts: Dict[str, float] = {}
+        self.timedOut = False
+        self.metrics = metrics = SearchMetrics()
+        startTime = time.perf_counter()
+        stopTime = startTime + self.timeLimit if self.timeLimit is not None else None
 
         # Initialize data structures
-        frontier = PriorityQueue()  # Explored states are maintained by the frontier.
+        frontier = self.frontierFactory()  # Explored states are maintained by the frontier.
         backpointers = {}           # Map state -> previous state.
 
+        # When profiling, time (and count) every call to the problem and frontier
+        isEnd, successorsAndCosts = problem.isEnd, problem.successorsAndCosts
+        update, removeMin = frontier.update, frontier.removeMin
+        if self.profile:
+            isEnd, successorsAndCosts, update, removeMin = profiledCalls(problem, frontier, metrics)
+
         # Add the start state
         startState = problem.startState()
-        frontier.update(startState, 0.0)
+        update(startState, 0.0)
 
         while True:
+            if (
+                stopTime is not None
+                and self.numStatesExplored % TIME_CHECK_INTERVAL == 0
+                and time.perf_counter() > stopTime
+            ):
+                self.timedOut = True
+                if self.verbose >= 1:
+                    print("Ran out of time!")
+                break
+
             # Remove the state from the queue with the lowest pastCost (priority).
-            state, pastCost = frontier.removeMin()
+            state, pastCost = removeMin()
             if state is None and pastCost is None:
                 if self.verbose >= 1:
                     print("Searched the entire search space!")
-                return
+                break
 
             # Update tracking variables
             self.pastCosts[state.location] = pastCost
@@ -130,7 +306,7 @@ class UniformCostSearch(SearchAlgorithm):
                 print(f"Exploring {state} with pastCost {pastCost}")
 
             # Check if we've reached an end state; if so, extract solution.
-            if problem.isEnd(state):
+            if isEnd(state):
                 self.actions = []
                 while state != startState:
                     action, prevState = backpointers[state]
@@ -142,23 +318,797 @@ class UniformCostSearch(SearchAlgorithm):
                     print(f"numStatesExplored = {self.numStatesExplored}")
                     print(f"pathCost = {self.pathCost}")
                     print(f"actions = {self.actions}")
-                return
+                break
             # Expand from `state`, updating the frontier with each `newState`
-            for action, newState, cost in problem.successorsAndCosts(state):
+            for action, newState, cost in successorsAndCosts(state):
                 if self.verbose >= 3:
                     print(f"\t{state} => {newState} (Cost: {pastCost} + {cost})")
 
-                if frontier.update(newState, pastCost + cost):
+                if update(newState, pastCost + cost):
                     # We found better way to go to `newState` --> update backpointer!
                     backpointers[newState] = (action, state)
 
+        metrics.numStatesExplored = self.numStatesExplored
+        if self.profile:
+            metrics.numStalePops = getattr(frontier, "numStalePops", 0)
+        metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+########################################################################################
+# A* Search
+#   > Equivalent to running `UniformCostSearch` on `aStarReduction(problem, heuristic)`
+#     (see `submission.py`), but without wrapping the problem: the frontier is ordered
+#     by pastCost + h(state), where h(state) is computed at most once per state (and
+#     never for states that have already been explored).
+#
+#   > Weighted A* :: ordering the frontier by pastCost + weight * h(state) (for some
+#     weight > 1) makes the search greedier, exploring far fewer states, while the cost
+#     of the path found is still at most `weight` times the optimal cost.
+
+
+class AStarSearch(SearchAlgorithm):
+    def __init__(
+        self,
+        heuristic: Heuristic,
+        verbose: int = 0,
+        frontierFactory: Optional[Callable] = None,
+        profile: bool = False,
+        weight: float = 1.0,
+        timeLimit: Optional[float] = None,
+    ):
+        """
+        `heuristic` must be consistent (e.g., `StraightLineHeuristic`); otherwise, the
+        path found may not be the shortest one. `frontierFactory` and `profile` are as
+        in `UniformCostSearch`.
+
+        :param weight: Weight (>= 1) of the heuristic; the path found costs at most
+                       `weight` times the optimal cost (e.g., 1.05 :: within 5%).
+        :param timeLimit: (Optional) time limit in seconds for each `solve`; if no path
+                          is found in time, the search stops with `self.timedOut` set.
+        """
+        super().__init__()
+        if weight < 1:
+            raise ValueError(f"Heuristic weight must be at least 1, got {weight}")
+        self.heuristic = heuristic
+        self.verbose = verbose
+        self.frontierFactory = frontierFactory or PriorityQueue
+        self.profile = profile
+        self.weight = weight
+        self.timeLimit = timeLimit
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Run A* search on the specified `problem` instance.
+
+        Sets the same instance variables as `UniformCostSearch`; in particular,
+        `self.pastCosts` holds the true cost from the start to each explored location
+        (rather than the reduced costs of `aStarReduction`). Also sets
+            - self.suboptimalityBound: float (`weight` if a path was found, else None)
+            - self.timedOut: bool
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.numStatesExplored: int = 0
+        self.pastCosts: Dict[str, float] = {}
+        self.suboptimalityBound: Optional[float] = None
+        self.timedOut = False
+        self.metrics = metrics = SearchMetrics()
+        startTime = time.perf_counter()
+        weight = self.weight
+        stopTime = startTime + self.timeLimit if self.timeLimit is not None else None
+
+        frontier = self.frontierFactory()  # Ordered by pastCost + h(state)
+        backpointers = {}                  # Map state -> (action, previous state)
+
+        # Map state -> (best known cost from start, h(state)); once a state has been
+        # explored, h(state) is replaced by None
+        costs: Dict[State, Tuple[float, Optional[float]]] = {}
+
+        isEnd, successorsAndCosts = problem.isEnd, problem.successorsAndCosts
+        update, removeMin = frontier.update, frontier.removeMin
+        evaluate = self.heuristic.evaluate
+        if self.profile:
+            isEnd, successorsAndCosts, update, removeMin = profiledCalls(problem, frontier, metrics)
+            evaluate = counted(timed(evaluate, metrics, "heuristicTime"), metrics, "numHeuristicCalls")
+
+        # Add the start state
+        startState = problem.startState()
+        costs[startState] = (0.0, evaluate(startState))
+        update(startState, weight * costs[startState][1])
+
+        while True:
+            if (
+                stopTime is not None
+                and self.numStatesExplored % TIME_CHECK_INTERVAL == 0
+                and time.perf_counter() > stopTime
+            ):
+                self.timedOut = True
+                if self.verbose >= 1:
+                    print("Ran out of time!")
+                break
+            state, _ = removeMin()
+            if state is None:
+                if self.verbose >= 1:
+                    print("Searched the entire search space!")
+                break
+            pastCost = costs[state][0]
+            costs[state] = (pastCost, None)
+
+            # Update tracking variables
+            self.pastCosts[state.location] = pastCost
+            self.numStatesExplored += 1
+            if self.verbose >= 2:
+                print(f"Exploring {state} with pastCost {pastCost}")
+
+            # Check if we've reached an end state; if so, extract solution.
+            if isEnd(state):
+                self.actions = []
+                while state != startState:
+                    action, prevState = backpointers[state]
+                    self.actions.append(action)
+                    state = prevState
+                self.actions.reverse()
+                self.pathCost = pastCost
+                self.suboptimalityBound = weight
+                if self.verbose >= 1:
+                    print(f"numStatesExplored = {self.numStatesExplored}")
+                    print(f"pathCost = {self.pathCost}")
+                    print(f"actions = {self.actions}")
+                break
+
+            # Expand from `state`; only evaluate the heuristic for unexplored states that
+            # we've found a better way to reach
+            for action, newState, cost in successorsAndCosts(state):
+                if self.verbose >= 3:
+                    print(f"\t{state} => {newState} (Cost: {pastCost} + {cost})")
+                newCost = pastCost + cost
+                known = costs.get(newState)
+                if known is None:
+                    heuristicCost = evaluate(newState)
+                else:
+                    oldCost, heuristicCost = known
+                    if heuristicCost is None or newCost >= oldCost:
+                        continue
+                costs[newState] = (newCost, heuristicCost)
+                update(newState, newCost + weight * heuristicCost)
+                backpointers[newState] = (action, state)
+
+        metrics.numStatesExplored = self.numStatesExplored
+        if self.profile:
+            metrics.numStalePops = getattr(frontier, "numStalePops", 0)
+        metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+########################################################################################
+# Anytime Repairing A* (ARA*)
+#   > Runs a sequence of weighted A* searches with decreasing weights, reusing the work
+#     done by the previous searches: a state whose cost improves after it has already
+#     been explored (in the current iteration) is set aside as "inconsistent", and only
+#     re-expanded in the next iteration. Each iteration stops as soon as no state in the
+#     frontier can lead to a cheaper path than the best one found so far.
+#
+#   > A (weight-bounded) path is available early, and is improved until the weight
+#     reaches 1 (optimal) or the time limit expires; `suboptimalityBound` is then the
+#     tightest bound we can prove, i.e.,
+#         pathCost / min(pastCost + h(state) for frontier and inconsistent states)
+#
+#   > Reference: Likhachev, Gordon & Thrun, "ARA*: Anytime A* with Provable Bounds on
+#                Sub-Optimality" (2003).
+
+
+class AnytimeRepairingAStarSearch(SearchAlgorithm):
+    def __init__(
+        self,
+        heuristic: Heuristic,
+        initialWeight: float = 2.5,
+        weightStep: float = 0.5,
+        timeLimit: Optional[float] = None,
+        verbose: int = 0,
+    ):
+        """
+        `heuristic` must be consistent (e.g., `StraightLineHeuristic`).
+
+        :param initialWeight: Weight of the heuristic for the first search (>= 1).
+        :param weightStep: Amount by which the weight is decreased after each search.
+        :param timeLimit: (Optional) time limit in seconds for each `solve`; the best
+                          path found in time (if any) is returned.
+        """
+        super().__init__()
+        self.heuristic = heuristic
+        self.initialWeight = initialWeight
+        self.weightStep = weightStep
+        self.timeLimit = timeLimit
+        self.verbose = verbose
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Run ARA* on the specified `problem` instance.
+
+        Sets the same instance variables as `UniformCostSearch` (for the best path
+        found), as well as
+            - self.suboptimalityBound: float (pathCost <= bound * optimal cost, or None
+                                              if no path was found)
+            - self.timedOut: bool
+            - self.improvements: List[Tuple[float, float, float]] (elapsed time, path
+                                 cost, and suboptimality bound for each path found)
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.numStatesExplored: int = 0
+        self.pastCosts: Dict[str, float] = {}
+        self.suboptimalityBound: Optional[float] = None
+        self.timedOut = False
+        self.improvements: List[Tuple[float, float, float]] = []
+        self.metrics = metrics = SearchMetrics()
+        startTime = time.perf_counter()
+        stopTime = startTime + self.timeLimit if self.timeLimit is not None else None
+
+        isEnd, successorsAndCosts = problem.isEnd, problem.successorsAndCosts
+        evaluate = self.heuristic.evaluate
+        inf = float("inf")
+
+        costs: Dict[State, float] = {}          # Map state -> best known cost from start
+        heuristicCosts: Dict[State, float] = {}  # Map state -> h(state)
+        backpointers = {}                       # Map state -> (action, previous state, cost)
+
+        # Frontier :: binary heap of (priority, tie-breaker, state), with "lazy deletion"
+        # (`openPriorities` holds the current priority of each state in the frontier)
+        heap: List[Tuple[float, int, State]] = []
+        openPriorities: Dict[State, float] = {}
+        closed, inconsistent = set(), set()
+        numPushes = 0
+
+        def push(state: State, priority: float) -> None:
+            nonlocal numPushes
+            openPriorities[state] = priority
+            heapq.heappush(heap, (priority, numPushes, state))
+            numPushes += 1
+
+        def lowerBound() -> float:
+            """Lower bound on the optimal cost (min pastCost + h over open/inconsistent)."""
+            return min(
+                (costs[state] + heuristicCosts[state] for state in (*openPriorities, *inconsistent)),
+                default=inf,
+            )
+
+        def suboptimalityRatio() -> float:
+            """pathCost / lowerBound(); a zero lower bound only proves zero-cost paths optimal."""
+            bound = lowerBound()
+            if bound <= 0.0:
+                return 1.0 if self.pathCost <= 0.0 else inf
+            return self.pathCost / bound
+
+        startState = problem.startState()
+        costs[startState] = 0.0
+        heuristicCosts[startState] = evaluate(startState)
+        weight = max(1.0, self.initialWeight)
+        push(startState, weight * heuristicCosts[startState])
+        bestCost, numSuccessorCalls, numSuccessors, maxFrontierSize = inf, 0, 0, 0
+
+        while True:
+            # Weighted A* search, stopping once no state in the frontier can improve on
+            # the best path found so far
+            while heap:
+                priority, _, state = heap[0]
+                if openPriorities.get(state) != priority:
+                    heapq.heappop(heap)
+                    metrics.numStalePops += 1
+                    continue
+                if priority >= bestCost:
+                    break
+                if (
+                    stopTime is not None
+                    and self.numStatesExplored % TIME_CHECK_INTERVAL == 0
+                    and time.perf_counter() > stopTime
+                ):
+                    self.timedOut = True
+                    break
+                heapq.heappop(heap)
+                del openPriorities[state]
+                closed.add(state)
+
+                pastCost = costs[state]
+                self.pastCosts[state.location] = pastCost
+                self.numStatesExplored += 1
+                if self.verbose >= 2:
+                    print(f"Exploring {state} with pastCost {pastCost}")
+
+                # Record (rather than expand) end states that improve on the best path
+                if isEnd(state):
+                    if pastCost < bestCost:
+                        bestCost = pastCost
+                        self.actions, self.pathCost = [], 0.0
+                        while state != startState:
+                            action, state, cost = backpointers[state]
+                            self.actions.append(action)
+                            self.pathCost += cost
+                        self.actions.reverse()
+                        bound = max(1.0, min(weight, suboptimalityRatio()))
+                        self.improvements.append(
+                            (time.perf_counter() - startTime, self.pathCost, bound)
+                        )
+                        if self.verbose >= 1:
+                            print(f"Found pathCost = {self.pathCost} (bound = {bound})")
+                    continue
 
-# Data structure for supporting uniform cost search.
+                numSuccessorCalls += 1
+                for action, newState, cost in successorsAndCosts(state):
+                    numSuccessors += 1
+                    newCost = pastCost + cost
+                    if newCost >= costs.get(newState, inf):
+                        continue
+                    costs[newState] = newCost
+                    backpointers[newState] = (action, state, cost)
+                    if newState not in heuristicCosts:
+                        heuristicCosts[newState] = evaluate(newState)
+                    if newState in closed:
+                        inconsistent.add(newState)
+                    else:
+                        push(newState, newCost + weight * heuristicCosts[newState])
+                maxFrontierSize = max(maxFrontierSize, len(openPriorities))
+
+            # The tightest bound we can prove for the best path so far; when the search
+            # has run out of time, only the (weight-independent) ratio is valid
+            if self.pathCost is not None:
+                ratio = suboptimalityRatio()
+                self.suboptimalityBound = max(1.0, ratio if self.timedOut else min(weight, ratio))
+            if self.timedOut or len(openPriorities) == 0 and len(inconsistent) == 0:
+                break
+            if weight <= 1.0 or (self.suboptimalityBound or inf) <= 1.0:
+                break
+
+            # Decrease the weight, then move inconsistent states back to the frontier and
+            # reorder it according to the new weight
+            weight = max(1.0, weight - self.weightStep)
+            states = [*openPriorities, *inconsistent]
+            heap.clear()
+            openPriorities.clear()
+            closed.clear()
+            inconsistent.clear()
+            for state in states:
+                push(state, costs[state] + weight * heuristicCosts[state])
+            if self.verbose >= 1:
+                print(f"Decreasing weight to {weight}")
+
+        if self.verbose >= 1:
+            if self.timedOut:
+                print("Ran out of time!")
+            print(f"numStatesExplored = {self.numStatesExplored}")
+            print(f"pathCost = {self.pathCost} (suboptimalityBound = {self.suboptimalityBound})")
+            print(f"actions = {self.actions}")
+
+        metrics.numStatesExplored = self.numStatesExplored
+        metrics.numPushes, metrics.numSuccessorCalls = numPushes, numSuccessorCalls
+        metrics.numSuccessors, metrics.maxFrontierSize = numSuccessors, maxFrontierSize
+        metrics.numHeuristicCalls = len(heuristicCosts)
+        metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+########################################################################################
+# Memory-bounded search
+#   > `UniformCostSearch` and `AStarSearch` remember every state they have discovered,
+#     which (for large waypoint problems) can exhaust memory. The searches below use a
+#     fixed amount of memory instead, at the cost of re-exploring some states.
+#
+#   > IDA* :: repeated depth-first searches, each exploring the states with
+#             pastCost + h(state) below some bound (raised after each search). A
+#             (bounded) transposition table prunes states already reached more cheaply.
+#
+#   > SMA* :: A* with at most `maxNodes` search nodes in memory; when memory is full,
+#             the worst leaf is forgotten, and its cost is remembered by its parent so
+#             that it can be regenerated later if it becomes promising again.
+#
+#   > Reference: Korf, "Depth-first Iterative-Deepening: An Optimal Admissible Tree
+#                Search" (1985); Sarkar et al., "Reducing reexpansions in iterative-
+#                deepening search by controlling cutoff bounds" (1991); Russell,
+#                "Efficient memory-bounded search methods" (1992).
+
+
+class IterativeDeepeningAStarSearch(SearchAlgorithm):
+    def __init__(
+        self,
+        heuristic: Heuristic,
+        maxTableSize: int = 100000,
+        growth: float = 2.0,
+        verbose: int = 0,
+    ):
+        """
+        `heuristic` must be consistent (e.g., `StraightLineHeuristic`).
+
+        :param maxTableSize: Maximum number of states in the transposition table (which,
+                             along with the current path, is all the memory we use).
+                             Road maps have many paths to each location, so once the
+                             table is much smaller than the number of states A* would
+                             explore, the number of paths tried grows very quickly.
+        :param growth: With real-valued costs, raising the bound to the next smallest
+                       pruned value would explore only a handful of new states per
+                       iteration; instead, the bound is raised so that each iteration
+                       explores (roughly) `growth` times as many states as the previous
+                       one. The path found is still optimal (the last iteration finishes
+                       as a branch-and-bound search).
+        """
+        super().__init__()
+        self.heuristic = heuristic
+        self.maxTableSize = maxTableSize
+        self.growth = growth
+        self.verbose = verbose
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Run IDA* on the specified `problem` instance.
+
+        Sets the same instance variables as `UniformCostSearch`, except that
+        `self.pastCosts` only covers the locations in the transposition table, and
+        `self.numStatesExplored` counts every time a state is explored (across all
+        iterations). Also sets
+            - self.numIterations: int
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.numStatesExplored: int = 0
+        self.pastCosts: Dict[str, float] = {}
+        self.numIterations = 0
+        self.metrics = metrics = SearchMetrics()
+        startTime = time.perf_counter()
+
+        isEnd, successorsAndCosts = problem.isEnd, problem.successorsAndCosts
+        evaluate = self.heuristic.evaluate
+        inf = float("inf")
+
+        # Transposition table :: map state -> (lowest pastCost, iteration it was seen in),
+        # evicting the least recently used state when full
+        table: "OrderedDict[State, Tuple[float, int]]" = OrderedDict()
+        startState = problem.startState()
+        bound, bestCost = evaluate(startState), inf
+        numHeuristicCalls, numSuccessorCalls, numSuccessors, maxDepth = 1, 0, 0, 0
+
+        while True:
+            self.numIterations += 1
+            iteration = self.numIterations
+            if self.verbose >= 1:
+                print(f"Iteration {iteration} with bound {bound}")
+
+            # Number of pruned states by (rounded) log(pastCost + h(state)), used to
+            # pick the next bound; each bucket covers a 1% range of values
+            histogram: Dict[int, int] = {}
+            minPruned, numExplored = inf, 0
+
+            # Depth-first search; `stack` holds an iterator over the remaining successors
+            # of each state on the current path (starting with a dummy root).
+            stack = [iter([(None, startState, 0.0)])]
+            pathStates: List[State] = []
+            pathActions: List[str] = []
+            pathCosts: List[float] = [0.0]
+            onPath = set()
+            while stack:
+                successor = next(stack[-1], None)
+                if successor is None:
+                    stack.pop()
+                    if pathStates:
+                        onPath.discard(pathStates.pop())
+                        pathActions.pop()
+                        pathCosts.pop()
+                    continue
+                action, state, cost = successor
+                pastCost = pathCosts[-1] + cost
+                estimate = pastCost + evaluate(state)
+                numHeuristicCalls += 1
+                if estimate >= bestCost:
+                    continue
+                if estimate > bound:
+                    key = math.floor(100 * math.log(estimate))
+                    histogram[key] = histogram.get(key, 0) + 1
+                    minPruned = min(minPruned, estimate)
+                    continue
+
+                # Skip states that we've already reached more cheaply (or as cheaply, in
+                # this iteration), as well as cycles
+                known = table.get(state)
+                if known is not None:
+                    if known[0] < pastCost or (known[0] == pastCost and known[1] == iteration):
+                        continue
+                    table.move_to_end(state)
+                elif len(table) >= self.maxTableSize:
+                    table.popitem(last=False)
+                table[state] = (pastCost, iteration)
+                if state in onPath:
+                    continue
+
+                self.numStatesExplored += 1
+                numExplored += 1
+                if self.verbose >= 2:
+                    print(f"Exploring {state} with pastCost {pastCost}")
+
+                # Record (rather than expand) end states; from now on, only look for
+                # cheaper paths (branch-and-bound)
+                if isEnd(state):
+                    bestCost = pastCost
+                    self.actions = pathActions[1:] + [action] if pathStates else []
+                    self.pathCost = pastCost
+                    continue
+
+                successors = successorsAndCosts(state)
+                numSuccessorCalls += 1
+                numSuccessors += len(successors)
+                # Try the most promising successors first
+                successors = sorted(successors, key=lambda successor: successor[2] + evaluate(successor[1]))
+                numHeuristicCalls += len(successors)
+                stack.append(iter(successors))
+                pathStates.append(state)
+                pathActions.append(action)
+                pathCosts.append(pastCost)
+                onPath.add(state)
+                maxDepth = max(maxDepth, len(pathStates))
+
+            # Every state with pastCost + h(state) < min(bound, bestCost) has been
+            # explored, so if we've found a path, it's optimal
+            if bestCost < inf or len(histogram) == 0:
+                break
+            target, numPruned = max(1.0, (self.growth - 1) * numExplored), 0
+            for key in sorted(histogram):
+                numPruned += histogram[key]
+                if numPruned >= target:
+                    break
+            bound = max(math.exp((key + 1) / 100), minPruned)
+
+        for state, (pastCost, _) in table.items():
+            if pastCost < self.pastCosts.get(state.location, inf):
+                self.pastCosts[state.location] = pastCost
+        if self.verbose >= 1:
+            print(f"numStatesExplored = {self.numStatesExplored}")
+            print(f"pathCost = {self.pathCost}")
+            print(f"actions = {self.actions}")
+
+        metrics.numStatesExplored = self.numStatesExplored
+        metrics.numSuccessorCalls, metrics.numSuccessors = numSuccessorCalls, numSuccessors
+        metrics.numHeuristicCalls = numHeuristicCalls
+        metrics.maxFrontierSize = maxDepth
+        metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+class _SMANode:
+    """A search node of `SimplifiedMemoryBoundedAStarSearch`."""
+    __slots__ = (
+        "state", "action", "index", "parent", "pastCost", "estimate", "depth", "alive",
+        "successors", "nextSuccessor", "children", "forgotten",
+        "queued", "leafQueued",
+    )
+
+    def __init__(
+        self,
+        state: State,
+        action: Optional[str],
+        index: int,
+        parent: Optional["_SMANode"],
+        pastCost: float,
+        estimate: float,
+    ):
+        self.state, self.action, self.index, self.parent = state, action, index, parent
+        self.pastCost, self.estimate = pastCost, estimate
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.alive = True
+        self.successors: Optional[List[Tuple[str, State, float]]] = None
+        self.nextSuccessor = 0                 # Index of the next successor to generate
+        self.children: List[_SMANode] = []     # Successors in memory
+        self.forgotten: Dict[int, float] = {}  # Index -> estimate of forgotten successors
+
+        # Estimate with which the node was last pushed to each heap (None if not queued)
+        self.queued: Optional[float] = None
+        self.leafQueued: Optional[float] = None
+
+    def canGenerate(self) -> bool:
+        return (
+            self.successors is None
+            or self.nextSuccessor < len(self.successors)
+            or len(self.forgotten) > 0
+        )
+
+
+class SimplifiedMemoryBoundedAStarSearch(SearchAlgorithm):
+    def __init__(self, heuristic: Heuristic, maxNodes: int = 100000, verbose: int = 0):
+        """
+        `heuristic` must be consistent (e.g., `StraightLineHeuristic`).
+
+        :param maxNodes: Maximum number of search nodes in memory (at least 2). The path
+                         found is optimal if the optimal path has fewer than `maxNodes`
+                         states; otherwise, SMA* finds the best path that fits (if any).
+                         With less than (roughly) half the memory used by A*, SMA*
+                         spends most of its time regenerating forgotten states.
+        """
+        super().__init__()
+        assert maxNodes >= 2, "SMA* needs room for at least 2 nodes"
+        self.heuristic = heuristic
+        self.maxNodes = maxNodes
+        self.verbose = verbose
+
+    def solve(self, problem: SearchProblem) -> None:
+        """
+        Run SMA* on the specified `problem` instance.
+
+        Sets the same instance variables as `UniformCostSearch`, except that
+        `self.pastCosts` only covers the locations in memory at the end of the search,
+        and `self.numStatesExplored` counts every time a state is explored (a forgotten
+        state may be explored again).
+        """
+        self.actions: List[str] = None
+        self.pathCost: float = None
+        self.numStatesExplored: int = 0
+        self.pastCosts: Dict[str, float] = {}
+        self.metrics = metrics = SearchMetrics()
+        startTime = time.perf_counter()
+
+        isEnd, successorsAndCosts = problem.isEnd, problem.successorsAndCosts
+        evaluate = self.heuristic.evaluate
+        maxNodes, inf = self.maxNodes, float("inf")
+
+        # Nodes in memory, indexed by state (the cheapest node for each state); a state
+        # that is already in memory with a lower pastCost isn't generated again
+        nodes: Dict[State, _SMANode] = {}
+        numNodes = 0
+
+        # Both heaps use "lazy deletion" :: an entry is only valid if it matches the
+        # node's `queued` (or `leafQueued`) estimate.
+        #   > frontier :: nodes that can generate a successor, by lowest estimate (and
+        #                 deepest first)
+        #   > leaves :: nodes without successors in memory, by highest estimate (and
+        #               shallowest first); these are the candidates for forgetting
+        frontier: List[Tuple[float, int, int, _SMANode]] = []
+        leaves: List[Tuple[float, int, int, _SMANode]] = []
+        numPushes = 0
+
+        def push(node: _SMANode) -> None:
+            nonlocal frontier, leaves, numPushes
+            if node.canGenerate() and node.queued != node.estimate:
+                node.queued = node.estimate
+                heapq.heappush(frontier, (node.estimate, -node.depth, numPushes, node))
+                numPushes += 1
+            if len(node.children) == 0 and node.leafQueued != node.estimate:
+                node.leafQueued = node.estimate
+                heapq.heappush(leaves, (-node.estimate, node.depth, numPushes, node))
+                numPushes += 1
+
+            # Drop outdated entries once they outnumber the nodes in memory (so that
+            # the heaps also take O(maxNodes) memory)
+            if len(frontier) + len(leaves) > 4 * maxNodes:
+                frontier = [entry for entry in frontier if entry[3].alive and entry[3].queued == entry[0]]
+                leaves = [entry for entry in leaves if entry[3].alive and entry[3].leafQueued == -entry[0]]
+                heapq.heapify(frontier)
+                heapq.heapify(leaves)
+
+        def backup(node: _SMANode) -> None:
+            """Once all of its successors have been generated, a node's estimate is the
+            lowest estimate of its successors (in memory or forgotten)."""
+            while node is not None and node.successors is not None and node.nextSuccessor == len(node.successors):
+                estimate = min((child.estimate for child in node.children), default=inf)
+                estimate = min(estimate, min(node.forgotten.values(), default=inf))
+                if estimate == node.estimate:
+                    break
+                node.estimate = estimate
+                push(node)
+                node = node.parent
+
+        startState = problem.startState()
+        root = _SMANode(startState, None, -1, None, 0.0, evaluate(startState))
+        nodes[startState], numNodes = root, 1
+        push(root)
+        numHeuristicCalls, numSuccessorCalls, numSuccessors, maxNumNodes = 1, 0, 0, 1
+
+        while True:
+            # Pick the (deepest) node with the lowest estimate
+            node = None
+            while frontier:
+                estimate, _, _, candidate = heapq.heappop(frontier)
+                if candidate.alive and candidate.queued == estimate:
+                    candidate.queued = None
+                    node = candidate
+                    break
+                metrics.numStalePops += 1
+            if node is None or node.estimate == inf:
+                if self.verbose >= 1:
+                    print("Searched the entire search space (that fits in memory)!")
+                break
+
+            if isEnd(node.state):
+                self.actions, self.pathCost = [], node.pastCost
+                while node.parent is not None:
+                    self.actions.append(node.action)
+                    node = node.parent
+                self.actions.reverse()
+                if self.verbose >= 1:
+                    print(f"numStatesExplored = {self.numStatesExplored}")
+                    print(f"pathCost = {self.pathCost}")
+                    print(f"actions = {self.actions}")
+                break
+
+            if node.successors is None:
+                node.successors = successorsAndCosts(node.state)
+                self.numStatesExplored += 1
+                numSuccessorCalls += 1
+                numSuccessors += len(node.successors)
+                if self.verbose >= 2:
+                    print(f"Exploring {node.state} with pastCost {node.pastCost}")
+
+            # Generate a single successor (a new one if possible, otherwise regenerate a
+            # forgotten one, with the estimate it had when it was forgotten). Successors
+            # that are already in memory (more cheaply), or that are too deep to ever fit
+            # in memory along with their path, are skipped.
+            if node.nextSuccessor < len(node.successors):
+                index, estimate = node.nextSuccessor, node.estimate
+                node.nextSuccessor += 1
+            else:
+                index = min(node.forgotten, key=node.forgotten.__getitem__)
+                estimate = node.forgotten.pop(index)
+            child = None
+            action, newState, cost = node.successors[index]
+            newCost = node.pastCost + cost
+            known = nodes.get(newState)
+            if (known is None or newCost < known.pastCost) and node.depth + 2 <= maxNodes:
+                estimate = max(estimate, node.estimate, newCost + evaluate(newState))
+                numHeuristicCalls += 1
+                child = _SMANode(newState, action, index, node, newCost, estimate)
+
+            if child is not None:
+                # Make room by forgetting the worst leaf (other than `node`), which its
+                # parent remembers (so that it can be regenerated later)
+                if numNodes >= maxNodes:
+                    while True:
+                        negEstimate, _, _, leaf = heapq.heappop(leaves)
+                        if leaf.alive and leaf.leafQueued == -negEstimate and len(leaf.children) == 0:
+                            leaf.leafQueued = None
+                            if leaf is not node:
+                                break
+                    leaf.alive = False
+                    numNodes -= 1
+                    if nodes.get(leaf.state) is leaf:
+                        del nodes[leaf.state]
+                    parent = leaf.parent
+                    parent.children.remove(leaf)
+                    parent.forgotten[leaf.index] = leaf.estimate
+                    push(parent)
+
+                nodes[newState] = child
+                numNodes += 1
+                maxNumNodes = max(maxNumNodes, numNodes)
+                node.children.append(child)
+                node.leafQueued = None
+                push(child)
+            push(node)
+            backup(node)
+
+        for node in nodes.values():
+            location = node.state.location
+            self.pastCosts[location] = min(node.pastCost, self.pastCosts.get(location, inf))
+
+        metrics.numStatesExplored = self.numStatesExplored
+        metrics.numPushes, metrics.numSuccessorCalls = numPushes, numSuccessorCalls
+        metrics.numSuccessors, metrics.maxFrontierSize = numSuccessors, maxNumNodes
+        metrics.numHeuristicCalls = numHeuristicCalls
+        metrics.totalTime = time.perf_counter() - startTime
+        self.reportMetrics()
+
+
+########################################################################################
+# Data structures for supporting uniform cost search. All priority queues share the
+# same interface (`update` and `removeMin`); a state that has been removed is "done",
+# and further updates to it are ignored.
+
+
+# Binary heap with "lazy deletion"; each improvement pushes a new heap entry, and
+# outdated entries are skipped when popped (so the heap can grow to O(#edges)).
 class PriorityQueue:
     def __init__(self):
         self.DONE = -100000
         self.heap = []
         self.priorities = {}  # Map from state to priority
+        self.numStalePops = 0
+
+    # Number of heap entries (including outdated ones)
+    def __len__(self) -> int:
+        return len(self.heap)
 
     # Insert `state` into the heap with priority `newPriority` if `state` isn't in
     # the heap or `newPriority` is smaller than the existing priority.
@@ -177,9 +1127,149 @@ class PriorityQueue:
             priority, state = heapq.heappop(self.heap)
             if self.priorities[state] == self.DONE:
                 # Outdated priority, skip
+                self.numStalePops += 1
                 continue
             self.priorities[state] = self.DONE
             return state, priority
 
         # Nothing left...
         return None, None
+
+
+# Binary heap with a true decrease-key operation; each state appears in the heap at
+# most once (so the heap never grows past O(#states)), and we track the position of
+# every state in the heap so that its priority can be lowered in place.
+class IndexedPriorityQueue:
+    def __init__(self):
+        self.DONE = -100000
+        self.heap: List[Tuple[float, State]] = []
+        self.positions: Dict[State, int] = {}  # Map from state to index in `heap`
+        self.priorities = {}                   # Map from state to priority
+        self.numStalePops = 0                  # (Never any outdated entries)
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    # Insert `state` into the heap with priority `newPriority` if `state` isn't in
+    # the heap or `newPriority` is smaller than the existing priority.
+    #   > Return whether the priority queue was updated.
+    def update(self, state: State, newPriority: float) -> bool:
+        oldPriority = self.priorities.get(state)
+        if oldPriority is None:
+            self.heap.append((newPriority, state))
+            self.positions[state] = len(self.heap) - 1
+        elif oldPriority != self.DONE and newPriority < oldPriority:
+            self.heap[self.positions[state]] = (newPriority, state)
+        else:
+            return False
+        self.priorities[state] = newPriority
+        self._siftUp(self.positions[state])
+        return True
+
+    # Returns (state with minimum priority, priority) or (None, None) if empty.
+    def removeMin(self):
+        if len(self.heap) == 0:
+            return None, None
+
+        priority, state = self.heap[0]
+        last = self.heap.pop()
+        if len(self.heap) > 0:
+            self.heap[0] = last
+            self.positions[last[1]] = 0
+            self._siftDown(0)
+        del self.positions[state]
+        self.priorities[state] = self.DONE
+        return state, priority
+
+    def _siftUp(self, index: int) -> None:
+        entry = self.heap[index]
+        while index > 0:
+            parent = (index - 1) // 2
+            if not entry < self.heap[parent]:
+                break
+            self.heap[index] = self.heap[parent]
+            self.positions[self.heap[index][1]] = index
+            index = parent
+        self.heap[index] = entry
+        self.positions[entry[1]] = index
+
+    def _siftDown(self, index: int) -> None:
+        entry, size = self.heap[index], len(self.heap)
+        while True:
+            child = 2 * index + 1
+            if child >= size:
+                break
+            if child + 1 < size and self.heap[child + 1] < self.heap[child]:
+                child += 1
+            if not self.heap[child] < entry:
+                break
+            self.heap[index] = self.heap[child]
+            self.positions[self.heap[index][1]] = index
+            index = child
+        self.heap[index] = entry
+        self.positions[entry[1]] = index
+
+
+# Bucket (radix) queue in the style of Dial's algorithm; a state with priority `p` is
+# kept in bucket `int(p // bucketWidth)`, and buckets are emptied in increasing order
+# (first-in, first-out within a bucket). Each state is stored at most once, and a
+# heap of bucket ids finds the lowest non-empty bucket without scanning all buckets.
+#   > This is exact whenever all priorities are multiples of `bucketWidth` (e.g., the
+#     unit-cost grids from `createGridMap` with `bucketWidth=1`); otherwise, states
+#     within the same bucket may be removed out of order (by less than `bucketWidth`).
+class BucketQueue:
+    def __init__(self, bucketWidth: float = 1.0):
+        self.DONE = -100000
+        self.bucketWidth = bucketWidth
+        self.buckets: Dict[int, Dict[State, None]] = {}  # Bucket -> (ordered) states
+        self.priorities = {}                              # Map from state to priority
+        self.bucketIds: List[int] = []                    # Heap of (maybe emptied) buckets
+        self.size = 0
+        self.numStalePops = 0                             # (Never any outdated entries)
+
+    def __len__(self) -> int:
+        return self.size
+
+    # Insert `state` into the queue with priority `newPriority` if `state` isn't in
+    # the queue or `newPriority` is smaller than the existing priority.
+    #   > Return whether the priority queue was updated.
+    def update(self, state: State, newPriority: float) -> bool:
+        oldPriority = self.priorities.get(state)
+        if oldPriority is not None and (oldPriority == self.DONE or newPriority >= oldPriority):
+            return False
+
+        if oldPriority is not None:
+            self._discard(state, int(oldPriority // self.bucketWidth))
+        else:
+            self.size += 1
+        bucket = int(newPriority // self.bucketWidth)
+        if bucket not in self.buckets:
+            self.buckets[bucket] = {}
+            heapq.heappush(self.bucketIds, bucket)
+        self.buckets[bucket][state] = None
+        self.priorities[state] = newPriority
+        return True
+
+    # Returns (state with minimum priority, priority) or (None, None) if empty.
+    def removeMin(self):
+        if len(self.buckets) == 0:
+            return None, None
+
+        # Buckets are deleted as soon as they are emptied, leaving their ids in the
+        # heap; skip those to get to the lowest non-empty bucket.
+        while self.bucketIds[0] not in self.buckets:
+            heapq.heappop(self.bucketIds)
+        bucket = self.bucketIds[0]
+        state = next(iter(self.buckets[bucket]))
+        self._discard(state, bucket)
+        self.size -= 1
+
+        priority = self.priorities[state]
+        self.priorities[state] = self.DONE
+        return state, priority
+
+    def _discard(self, state: State, bucket: int) -> None:
+        states = self.buckets[bucket]
+        del states[state]
+        if len(states) == 0:
+            del self.buckets[bucket]
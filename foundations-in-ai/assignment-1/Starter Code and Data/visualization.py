@@ -5,7 +5,7 @@ from typing import List
 import plotly.express as px
 import plotly.graph_objects as go
 
-from mapUtil import CityMap, addLandmarks, readMap
+from mapUtil import CityMap, createCustomMap
 
 
 def plotMap(cityMap: CityMap, path: List[str], waypointTags: List[str], mapName: str):
@@ -26,11 +26,11 @@ def plotMap(cityMap: CityMap, path: List[str], waypointTags: List[str], mapName:
         for target in cityMap.distances[source]
     ]
     for source, target in connections:
-        lat.append(cityMap.geoLocations[source].latitude)
-        lat.append(cityMap.geoLocations[target].latitude)
+        # Connections that replace a chain of locations are drawn along the full chain
+        for geo in cityMap.connectionShape(source, target):
+            lat.append(geo.latitude)
+            lon.append(geo.longitude)
         lat.append(None)
-        lon.append(cityMap.geoLocations[source].longitude)
-        lon.append(cityMap.geoLocations[target].longitude)
         lon.append(None)
 
     # Plot all states & connections
@@ -44,11 +44,10 @@ def plotMap(cityMap: CityMap, path: List[str], waypointTags: List[str], mapName:
         connections = [(path[i], path[i + 1]) for i in range(len(path) - 1)]
         for connection in connections:
             source, target = connection
-            solutionLat.append(cityMap.geoLocations[source].latitude)
-            solutionLat.append(cityMap.geoLocations[target].latitude)
+            for geo in cityMap.connectionShape(source, target):
+                solutionLat.append(geo.latitude)
+                solutionLon.append(geo.longitude)
             solutionLat.append(None)
-            solutionLon.append(cityMap.geoLocations[source].longitude)
-            solutionLon.append(cityMap.geoLocations[target].longitude)
             solutionLon.append(None)
 
         # Visualize path by adding a trace
@@ -149,12 +148,17 @@ if __name__ == "__main__":
         default="path.json",
         help="Path to visualize (.json), path should correspond to some map file",
     )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="(Optional) directory for compiled maps, to skip re-parsing the map file",
+    )
     args = parser.parse_args()
 
     # Create cityMap and populate any relevant landmarks
     sanJoseMapName = args.map_file.split("/")[-1].split("_")[0]
-    sanJoseCityMap = readMap(args.map_file)
-    addLandmarks(sanJoseCityMap, args.landmark_file)
+    sanJoseCityMap = createCustomMap(args.map_file, args.landmark_file, args.cache_dir)
 
     # (Optional) Read path to visualize from JSON file
     if args.path_file: